@@ -0,0 +1 @@
+from .scry import Compiler, CompiledQuery, ScryException, query, query_columns
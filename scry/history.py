@@ -0,0 +1,78 @@
+# A log of the queries run in the REPL, kept in SQLite (~/.scry/history.db),
+# with the SQL each one generated, how much it returned, and how long each
+# phase took.  \slow and \top report on it, to show which queries are worth
+# optimizing or indexing for.
+
+import sqlite3
+import time
+
+phases = ["compile", "execute", "reshape", "format"]
+
+schema = f"""
+CREATE TABLE IF NOT EXISTS queries (
+    id INTEGER PRIMARY KEY,
+    at REAL NOT NULL,
+    query TEXT NOT NULL,
+    sql TEXT,
+    rows INTEGER,
+    bytes INTEGER,
+    {", ".join(f"{p}_ms REAL" for p in phases)},
+    total_ms REAL
+)
+"""
+
+class History:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute(schema)
+        self.db.execute("CREATE INDEX IF NOT EXISTS queries_query ON queries (query)")
+
+    # Records a run from run_page: {"query", "sql", "rows", "bytes", "timings"},
+    # with timings in seconds by phase, and a "total" if the phases overlapped.
+    def record(self, run):
+        timings = [run["timings"].get(p) for p in phases]
+        total = run.get("total", sum(t for t in timings if t is not None))
+        with self.db:
+            self.db.execute(
+                f"INSERT INTO queries (at, query, sql, rows, bytes, {', '.join(f'{p}_ms' for p in phases)}, total_ms)"
+                f" VALUES (?, ?, ?, ?, ?, {', '.join('?' for p in phases)}, ?)",
+                [time.time(), run["query"], run.get("sql"), run.get("rows"), run.get("bytes")]
+                + [t * 1000 if t is not None else None for t in timings] + [total * 1000])
+
+    # The queries with the slowest runs, with their slowest and average times.
+    def slowest(self, n=10):
+        return self.db.execute("""SELECT query, count(*), max(total_ms), avg(total_ms), max(rows)
+            FROM queries GROUP BY query ORDER BY max(total_ms) DESC LIMIT ?""", (n,)).fetchall()
+
+    # The most often run queries, with their total and average times, counting
+    # only runs since the given time.time(), if any.
+    def most_frequent(self, n=10, since=None):
+        return self.db.execute("""SELECT query, count(*), sum(total_ms), avg(total_ms), max(rows)
+            FROM queries WHERE at >= ? GROUP BY query ORDER BY count(*) DESC, sum(total_ms) DESC LIMIT ?""",
+            (since or 0, n)).fetchall()
+
+    # The slowest run of a query, phase by phase.
+    def phases(self, query):
+        return self.db.execute(f"""SELECT {", ".join(f"{p}_ms" for p in phases)}
+            FROM queries WHERE query = ? ORDER BY total_ms DESC LIMIT 1""", (query,)).fetchone()
+
+    def report(self, kind, n):
+        if kind == "slow":
+            header = f"{'slowest':>10} {'average':>10} {'runs':>6} {'rows':>8}  query"
+            rows = self.slowest(n)
+        else:
+            header = f"{'runs':>6} {'total':>10} {'average':>10} {'rows':>8}  query"
+            rows = self.most_frequent(n)
+
+        output = [header]
+        for query, runs, a, b, max_rows in rows:
+            if kind == "slow":
+                output.append(f"{a:>8.1f}ms {b:>8.1f}ms {runs:>6} {max_rows or 0:>8}  {query}")
+                slowest = self.phases(query)
+                output.append(" " * 39 + "  ".join(f"{p} {t:.1f}ms" for p, t in zip(phases, slowest) if t is not None))
+            else:
+                output.append(f"{runs:>6} {a:>8.1f}ms {b:>8.1f}ms {max_rows or 0:>8}  {query}")
+        return output
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,259 @@
+# The interactive side of scry.  This pulls in prompt_toolkit, which is slow to
+# import, so it's kept separate from scry.scry and only loaded when a REPL is
+# actually started.
+
+from bisect import bisect_left
+from collections import defaultdict, OrderedDict
+import lark
+import os
+import re
+import threading
+import time
+from prompt_toolkit import PromptSession
+from prompt_toolkit.history import FileHistory
+from prompt_toolkit.completion import Completer, Completion
+from prompt_toolkit.shortcuts.prompt import CompleteStyle
+
+from .history import History
+from .scry import Compiler, ScryException, deallocate, get_common_values, parse, refresh_schema, run_command, warm_up
+
+# How far back the history is read for queries to warm up.
+warm_up_days = 30
+
+completion_styles = {
+    "column": CompleteStyle.COLUMN,
+    "multi_column": CompleteStyle.MULTI_COLUMN,
+    "readline": CompleteStyle.READLINE_LIKE
+}
+
+# A sorted list of words, searched by prefix with bisect; the cost of a lookup
+# depends on the number of matches rather than the number of words.
+class PrefixIndex:
+    def __init__(self, words):
+        self.words = sorted(set(words))
+
+    def matches(self, prefix):
+        matches = []
+        for i in range(bisect_left(self.words, prefix), len(self.words)):
+            if not self.words[i].startswith(prefix):
+                break
+            matches.append(self.words[i])
+        return matches
+
+empty_index = PrefixIndex([])
+
+# Everything the completer looks up, indexed once per schema load.
+class CompletionIndex:
+    def __init__(self, table_info, foreign_keys):
+        schemas, tables, columns, table_columns = table_info
+        self.tables = tables
+        self.schemas = PrefixIndex(schemas)
+        self.all_tables = PrefixIndex(tables.keys())
+        self.columns = {t: PrefixIndex(cs) for t, cs in table_columns.items()}
+        self.neighbors = {t: PrefixIndex(t2 for joins in schema_joins.values() for t2 in joins.keys())
+                          for t, schema_joins in foreign_keys.items()}
+        schema_tables = defaultdict(list)
+        for t, ss in tables.items():
+            for s in ss:
+                schema_tables[s].append(t)
+        self.schema_tables = {s: PrefixIndex(ts) for s, ts in schema_tables.items()}
+        self.search_path_tables = {}
+
+    # Tables visible through the search path; cached per search path, as that
+    # can be changed with \set.
+    def tables_on_path(self, search_path):
+        if search_path not in self.search_path_tables:
+            schemas = set(search_path.split(","))
+            self.search_path_tables[search_path] = PrefixIndex(
+                t for t, ss in self.tables.items() if len(set(ss) & schemas) > 0)
+        return self.search_path_tables[search_path]
+
+# Column values for completing conditions, fetched from the statistics the
+# first time each column is completed.  Lookups happen on every keystroke, so
+# they're kept in an LRU cache; entries are refetched after ttl seconds, in
+# case the table has been analyzed since.
+class ValueCache:
+    def __init__(self, cur, size=256, ttl=600, clock=time.monotonic):
+        self.cur = cur
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.cache = OrderedDict()
+        # Completion runs in its own thread, and the cursor can't be shared.
+        self.lock = threading.Lock()
+
+    def values(self, schema, table, column):
+        key = (schema, table, column)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and self.clock() - entry[0] < self.ttl:
+                self.cache.move_to_end(key)
+                return entry[1]
+            values = get_common_values(self.cur, schema, table, column)
+            self.cache[key] = (self.clock(), values)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+            return values
+
+# A partial value after a comparison, like 'books.title = "Har'
+condition_value_pattern = re.compile(r'([\w.:@]+)\s*(?:=|<>|<=|>=|<|>|\bLIKE|\bILIKE)\s*("[^"]*|[-\w.]*)$', re.I)
+
+class ScryCompleter(Completer):
+    def __init__(self, settings, table_info, foreign_keys, values=None):
+        schemas, tables, columns, table_columns = table_info
+        self.table_info = table_info
+        self.schemas = schemas
+        self.tables = tables
+        self.columns = columns
+        self.table_columns = table_columns
+        self.foreign_keys = foreign_keys
+        self.settings = settings
+        self.values = values
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        self.index = CompletionIndex(self.table_info, self.foreign_keys)
+
+    def get_completions(self, doc, event):
+        full_line = "\n".join(doc.lines)
+        word = doc.get_word_before_cursor()
+        fullword = doc.get_word_before_cursor("\\S*")
+
+        # TODO: Make this less hacky
+        if full_line[0] == "\\":
+            words = re.split("\\s+", full_line)
+            candidates = []
+            if len(words) == 1:
+                word = words[0]
+                candidates = ["\\set", "\\alias", "\\next", "\\watch", "\\materialize", "\\count", "\\count~", "\\indexes", "\\slow", "\\top"]
+            if words[0] == "\\set":
+                if len(words) == 2:
+                    candidates = ["complete_style", "search_path", "limit", "schema_refresh", "format", "in_chunk_size", "materialize_analyze",
+                                  "sample", "sample_method", "sample_seed", "index_warnings", "fetch",
+                                  "dimension_rows", "dimension_ttl", "warm_up", "warm_prepare",
+                                  "pipeline", "pipeline_batch"]
+                if len(words) == 3 and words[1] == "complete_style":
+                    candidates = completion_styles.keys()
+                if len(words) == 3 and words[1] == "schema_refresh":
+                    candidates = ["off", "poll", "listen"]
+                if len(words) == 3 and words[1] == "format":
+                    candidates = ["tree", "columns"]
+                if len(words) == 3 and words[1] == "fetch":
+                    candidates = ["typed", "text"]
+                if len(words) == 3 and words[1] in ["warm_prepare", "pipeline"]:
+                    candidates = ["on", "off"]
+                if len(words) == 3 and words[1] == "sample_method":
+                    candidates = ["system", "bernoulli"]
+            if words[0] == "\\alias":
+                if len(words) == 2:
+                    candidates = self.index.all_tables.matches(word)
+            matches = [c for c in candidates if c.startswith(word)]
+            return [Completion(c, -len(word)) for c in matches]
+
+        aliases = {}
+        # There really should be a way to tell Lark to parse as far as it can,
+        # but just taking the longest parsable prefix should be good enough.
+        # TODO: This should do exponential/binary search after the first couple.
+        for l in range(len(full_line), 0, -1):
+            try:
+                aliases = parse(self.settings, self.table_info, self.foreign_keys, full_line[:l], aliases_only=True)
+                break
+            except ScryException:
+                pass
+            except lark.exceptions.LarkError:
+                pass
+
+        if self.values:
+            m = condition_value_pattern.search(doc.text_before_cursor)
+            if m:
+                return self.value_completions(aliases, *m.groups())
+
+        if word == ".":
+            word = ""
+
+        index = self.index
+        table_matches = index.tables_on_path(self.settings["config"]["search_path"]).matches(word)
+
+        component = doc.get_word_before_cursor("\\S*")
+        column_matches = []
+        parts = component.split(".")
+        schema_matches = []
+        if len(parts) > 1:
+            prev_part = parts[-2]
+            if prev_part in aliases.get(None, {}):
+                prev_part = aliases[None][prev_part][2]
+            column_matches = index.columns.get(prev_part, empty_index).matches(word)
+            schema_matches = index.schema_tables.get(prev_part, empty_index).matches(word)
+            table_matches = index.neighbors.get(prev_part, empty_index).matches(word)
+        else:
+            schema_matches = index.schemas.matches(word)
+            table_matches += [a for a in aliases.get(None, []) if a.startswith(word)]
+
+        matches = column_matches + sorted(set(table_matches)) + schema_matches
+        return [Completion(c, -len(word)) for c in matches]
+
+    def value_completions(self, aliases, path, typed):
+        *prefix, column = re.split("[.:]", path)
+        if not prefix:
+            return []
+        table = prefix[-1].split("@")[-1]
+        if table in aliases.get(None, {}):
+            schema, _, table = aliases[None][table]
+        elif table in self.tables:
+            schemas = self.tables[table]
+            schema = next((s for s in self.settings["config"]["search_path"].split(",") if s in schemas),
+                          next(iter(schemas)))
+        else:
+            return []
+        matches = [v for v in self.values.values(schema, table, column) if v.startswith(typed)]
+        return [Completion(v, -len(typed)) for v in matches]
+
+def repl(settings, cur, table_info, keys, monitor=None):
+    completer = ScryCompleter(settings, table_info, keys["foreign"], ValueCache(cur.connection.cursor()))
+    os.makedirs(os.getenv("HOME") + "/.scry", exist_ok=True)
+    settings["history"] = History(os.getenv("HOME") + "/.scry/history.db")
+    settings["compiler"] = Compiler(table_info, keys, settings)
+    warm = int(settings["config"]["warm_up"])
+    if warm:
+        # The history is only read here, since SQLite connections can't be
+        # shared with the thread.
+        since = time.time() - warm_up_days * 24 * 60 * 60
+        queries = [q for q, *_ in settings["history"].most_frequent(warm, since)]
+        # The thread gets its own cursor, and the settings as they are now, so
+        # that neither changes under it while the prompt is in use.
+        snapshot = dict(settings, config=dict(settings["config"]), aliases=dict(settings["aliases"]))
+        threading.Thread(target=warm_up, args=(snapshot, cur.connection.cursor(), queries), daemon=True).start()
+    session = PromptSession(
+            history=FileHistory(os.getenv("HOME") + "/.scry/history"),
+            completer=completer,
+            complete_in_thread=True)
+    try:
+        while True:
+            complete_style = completion_styles[settings["config"].get("complete_style", CompleteStyle.COLUMN)]
+            command = session.prompt("> ", complete_style=complete_style)
+            if command in ["quit", "break", "bye"]:
+                break
+            try:
+                if monitor:
+                    changed = monitor.changes(cur, settings["config"]["schema_refresh"])
+                    if changed:
+                        refresh_schema(cur, table_info, keys, changed)
+                        settings["compiler"].clear_cache()
+                        deallocate(settings, cur)
+                        if settings["dimensions"]:
+                            settings["dimensions"].discard(changed)
+                        completer.rebuild_index()
+                        print("Reloaded schema for", ", ".join(sorted(f"{s}.{t}" for s, t in changed)))
+                output = run_command(settings, cur, table_info, keys, command)
+                if output is not None:
+                    print("\n".join(output))
+            except ScryException as e:
+                print(e)
+            except lark.exceptions.LarkError as e:
+                print(e)
+    except EOFError:
+        pass
+    finally:
+        settings["history"].close()
+        settings["history"] = None
@@ -1,26 +1,32 @@
 #!/usr/bin/env python
 
 import argparse
-from collections import defaultdict
+from array import array
+import copy
+import heapq
+import itertools
+import json
+from collections import defaultdict, namedtuple, OrderedDict
+from dataclasses import dataclass, field
 import psycopg2
+import queue
 from lark import Lark
 import lark
 import os
 import re
+import select
 import sys
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.completion import Completer, Completion
-from prompt_toolkit.shortcuts.prompt import CompleteStyle
+import threading
+import time
+import weakref
 
 class ScryException(Exception):
     pass
 
-completion_styles = {
-    "column": CompleteStyle.COLUMN,
-    "multi_column": CompleteStyle.MULTI_COLUMN,
-    "readline": CompleteStyle.READLINE_LIKE
-}
+aggregates = ["count", "sum", "min", "max", "avg"]
+
+# Marks a $parameter in a query whose value has to be supplied by the caller.
+UNBOUND = object()
 
 def default_settings():
     return {
@@ -28,11 +34,36 @@ def default_settings():
             "complete_style": "column",
             "search_path": "scry,public,information_schema",
             "limit": 100,
+            "schema_refresh": "poll",
+            "format": "tree",
+            "in_chunk_size": 10000,
+            "materialize_analyze": "on",
+            "sample": "off",
+            "sample_method": "system",
+            "sample_seed": "off",
+            "index_warnings": "on",
+            "fetch": "typed",
+            "dimension_rows": 0,
+            "dimension_ttl": 300,
+            "warm_up": 0,
+            "warm_prepare": "off",
+            "pipeline": "off",
+            "pipeline_batch": 1000,
         },
         "aliases": {},
+        "paging": None,
+        # A DimensionCache, once dimension_rows is set
+        "dimensions": None,
+        # A history.History that queries are recorded in, if any
+        "history": None,
+        # A Compiler that query plans are cached in, if any
+        "compiler": None,
+        # Statements prepared by warm_up, by the SQL they run
+        "prepared": {},
     }
 
-def get_table_info(cur):
+# If names is given, only tables with those names are loaded.
+def get_table_info(cur, names=None):
     schemas = set()
     tables = defaultdict(set)
     columns = set()
@@ -42,8 +73,10 @@ def get_table_info(cur):
         column_name
     FROM information_schema.columns
     """
+    if names is not None:
+        query += "WHERE table_name IN %(names)s"
 
-    cur.execute(query)
+    cur.execute(query, {"names": tuple(names or ())})
 
     table_columns = defaultdict(lambda: [])
     for row in cur:
@@ -54,7 +87,8 @@ def get_table_info(cur):
         table_columns[t].append(c)
     return (list(schemas), {t: list(ss) for t, ss in tables.items()}, list(columns), table_columns)
 
-def get_unique_keys(cur):
+# If tables is given, only keys for those (schema, table) pairs are loaded.
+def get_unique_keys(cur, tables=None):
     query =  """SELECT
         tc.table_schema,
         tc.table_name,
@@ -68,9 +102,11 @@ def get_unique_keys(cur):
           AND tc.table_schema = kcu.table_schema
     WHERE
         tc.constraint_type IN ('PRIMARY KEY', 'UNIQUE')"""
+    if tables is not None:
+        query += " AND (tc.table_schema, tc.table_name) IN %(tables)s"
 
     keys = {}
-    cur.execute(query)
+    cur.execute(query, {"tables": tuple(tables or ())})
     for row in cur:
         schema, table, name, type, column = row
         ensure_exists(keys, schema, table, {})
@@ -102,7 +138,12 @@ def get_unique_keys(cur):
 
     return keys
 
-def get_foreign_keys(cur):
+# Joins are symmetric, so keys[t1][s1][t2][s2] = (c1, c2) is recorded both
+# ways; if a references set is given, the actual direction of each constraint
+# is added to it as (s1, t1, c1, s2, t2, c2), where (s1, t1, c1) references
+# (s2, t2, c2).  If tables is given, only constraints from or to those
+# (schema, table) pairs are loaded.
+def get_foreign_keys(cur, references=None, tables=None):
     query = """SELECT
         tc.table_schema,
         tc.table_name,
@@ -119,9 +160,12 @@ def get_foreign_keys(cur):
           ON ccu.constraint_name = tc.constraint_name
           AND ccu.table_schema = tc.table_schema
     WHERE tc.constraint_type = 'FOREIGN KEY'"""
+    if tables is not None:
+        query += """ AND ((tc.table_schema, tc.table_name) IN %(tables)s
+            OR (ccu.table_schema, ccu.table_name) IN %(tables)s)"""
 
     keys = {}
-    cur.execute(query)
+    cur.execute(query, {"tables": tuple(tables or ())})
     for row in cur:
         s1, t1, c1, s2, t2, c2 = row
         st1 = f"{s1}.{t1}"
@@ -130,8 +174,228 @@ def get_foreign_keys(cur):
         keys[t1][s1][t2][s2] = (c1, c2)
         ensure_exists(keys, t2, s2, t1, {})
         keys[t2][s2][t1][s1] = (c2, c1)
+        if references is not None:
+            references.add((s1, t1, c1, s2, t2, c2))
     return keys
 
+# Each table's indexes, as {schema: {table: [(index name, [columns])]}}, with
+# the columns in index order, stopping at the first expression.  Partial
+# indexes are left out, since they only help queries matching their predicate.
+def get_indexes(cur, tables=None):
+    query = """SELECT
+        n.nspname,
+        t.relname,
+        i.relname,
+        array(SELECT a.attname
+              FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+                  LEFT JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+              ORDER BY k.position)
+    FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE x.indisvalid AND x.indpred IS NULL AND n.nspname <> 'pg_toast'
+        AND NOT pg_is_other_temp_schema(n.oid)"""
+    if tables is not None:
+        query += " AND (n.nspname, t.relname) IN %(tables)s"
+    query += " ORDER BY i.relname"
+
+    indexes = {}
+    cur.execute(query, {"tables": tuple(tables or ())})
+    for schema, table, name, columns in cur:
+        if None in columns:
+            columns = columns[:columns.index(None)]
+        if columns:
+            ensure_exists(indexes, schema, table, [])
+            indexes[schema][table].append((name, columns))
+    return indexes
+
+# Values of a column from the planner's statistics, as query literals: the
+# most common values first, then the histogram bounds, which spread over the
+# rest of the column's range.  This never reads the table itself; a column
+# that hasn't been analyzed has no values.
+def get_common_values(cur, schema, table, column):
+    cur.execute("""SELECT
+        s.most_common_vals::text::text[],
+        s.histogram_bounds::text::text[],
+        t.typcategory = 'N'
+    FROM pg_stats s
+        JOIN pg_namespace n ON n.nspname = s.schemaname
+        JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = s.tablename
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attname = s.attname
+        JOIN pg_type t ON t.oid = a.atttypid
+    WHERE s.schemaname = %s AND s.tablename = %s AND s.attname = %s""", (schema, table, column))
+    values = []
+    for common, bounds, numeric in cur.fetchall():
+        for v in (common or []) + (bounds or []):
+            # Quoted values are taken as written, with no escapes, so there's
+            # no way to write one with a quote or backslash in it.
+            if not numeric and ('"' in v or "\\" in v):
+                continue
+            literal = v if numeric else '"' + v + '"'
+            if literal not in values:
+                values.append(literal)
+    return values
+
+def load_schema(cur):
+    table_info = get_table_info(cur)
+    references = set()
+    foreign_keys = get_foreign_keys(cur, references)
+    unique_keys = get_unique_keys(cur)
+    indexes = get_indexes(cur)
+    return table_info, { "unique": unique_keys, "foreign": foreign_keys, "references": references,
+                         "virtual": set(), "indexes": indexes }
+
+# Joins that scry knows about but the catalog doesn't, like those of a
+# materialized table, as (s1, t1, c1, s2, t2, c2, reference); reference says
+# whether (s1, t1, c1) is known to always have a match in (s2, t2, c2), like a
+# foreign key.
+def add_virtual_keys(keys, edges):
+    for s1, t1, c1, s2, t2, c2, reference in edges:
+        ensure_exists(keys["foreign"], t1, s1, t2, {})
+        keys["foreign"][t1][s1][t2][s2] = (c1, c2)
+        ensure_exists(keys["foreign"], t2, s2, t1, {})
+        keys["foreign"][t2][s2][t1][s1] = (c2, c1)
+        if reference:
+            keys["references"].add((s1, t1, c1, s2, t2, c2))
+
+# A hash of each relation's columns and key constraints, to find out which
+# ones a migration touched without reloading everything.
+def catalog_fingerprints(cur):
+    cur.execute("""SELECT
+        n.nspname,
+        c.relname,
+        md5(concat_ws('|',
+            (SELECT string_agg(a.attname || ':' || a.atttypid, ',' ORDER BY a.attnum)
+             FROM pg_attribute a
+             WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped),
+            (SELECT string_agg(k.conname || ':' || pg_get_constraintdef(k.oid), ',' ORDER BY k.conname)
+             FROM pg_constraint k
+             WHERE k.conrelid = c.oid AND k.contype IN ('p', 'u', 'f')),
+            (SELECT string_agg(pg_get_indexdef(x.indexrelid) || ':' || x.indisvalid, ',' ORDER BY x.indexrelid)
+             FROM pg_index x
+             WHERE x.indrelid = c.oid)))
+    FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'v', 'm', 'f', 'p') AND NOT pg_is_other_temp_schema(n.oid)""")
+    return {(s, t): h for s, t, h in cur}
+
+# Installed with --install-schema-trigger; lets a SchemaMonitor in "listen"
+# mode skip polling the catalog until some DDL has actually run.
+schema_channel = "scry_schema"
+schema_trigger_sql = f"""
+CREATE OR REPLACE FUNCTION scry_notify_schema_change() RETURNS event_trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('{schema_channel}', tg_tag);
+END
+$$;
+DROP EVENT TRIGGER IF EXISTS scry_schema_change;
+CREATE EVENT TRIGGER scry_schema_change ON ddl_command_end
+    EXECUTE FUNCTION scry_notify_schema_change();
+"""
+
+class SchemaMonitor:
+    def __init__(self, cur):
+        self.fingerprints = catalog_fingerprints(cur)
+        self.listening = False
+
+    # Returns the (schema, table) pairs that were created, dropped or altered
+    # since the last call.  mode is "poll" to check the catalog every time,
+    # "listen" to only check after a notification from the schema trigger,
+    # or "off".
+    def changes(self, cur, mode):
+        if mode == "off":
+            return set()
+        if mode == "listen":
+            conn = cur.connection
+            if not self.listening:
+                cur.execute(f"LISTEN {schema_channel}")
+                self.listening = True
+            else:
+                conn.poll()
+                notified = [n for n in conn.notifies if n.channel == schema_channel]
+                if not notified:
+                    return set()
+                conn.notifies[:] = [n for n in conn.notifies if n.channel != schema_channel]
+
+        fingerprints = catalog_fingerprints(cur)
+        changed = {t for t in fingerprints.keys() | self.fingerprints.keys()
+                   if fingerprints.get(t) != self.fingerprints.get(t)}
+        self.fingerprints = fingerprints
+        return changed
+
+def discard_foreign_key(foreign_keys, t1, s1, t2, s2):
+    by_schema = foreign_keys.get(t1, {})
+    by_table = by_schema.get(s1, {})
+    by_table.get(t2, {}).pop(s2, None)
+    if not by_table.get(t2, True):
+        del by_table[t2]
+    if not by_schema.get(s1, True):
+        del by_schema[s1]
+    if not foreign_keys.get(t1, True):
+        del foreign_keys[t1]
+
+# Reloads the columns and keys of the given (schema, table) pairs, updating
+# table_info and keys in place.
+def refresh_schema(cur, table_info, keys, tables):
+    if not tables:
+        return
+    tables = set(tables)
+    schemas, table_schemas, columns, table_columns = table_info
+
+    # Columns are looked up by table name alone, so reload every schema's
+    # table of the same name.
+    names = {t for s, t in tables}
+    _, fresh_schemas, _, fresh_columns = get_table_info(cur, names)
+    for t in names:
+        if t in fresh_schemas:
+            table_schemas[t] = fresh_schemas[t]
+            table_columns[t] = fresh_columns[t]
+        else:
+            table_schemas.pop(t, None)
+            table_columns.pop(t, None)
+    schemas[:] = list({s for ss in table_schemas.values() for s in ss})
+    columns[:] = list({c for cs in table_columns.values() for c in cs})
+
+    for s, t in tables:
+        keys["unique"].get(s, {}).pop(t, None)
+    for s, schema_keys in get_unique_keys(cur, tables).items():
+        ensure_exists(keys["unique"], s, {})
+        keys["unique"][s].update(schema_keys)
+
+    indexes = keys.setdefault("indexes", {})
+    for s, t in tables:
+        indexes.get(s, {}).pop(t, None)
+    for s, schema_indexes in get_indexes(cur, tables).items():
+        ensure_exists(indexes, s, {})
+        indexes[s].update(schema_indexes)
+
+    foreign_keys = keys["foreign"]
+    for s, t in tables:
+        for t2, by_schema in list(foreign_keys.get(t, {}).get(s, {}).items()):
+            for s2 in list(by_schema):
+                discard_foreign_key(foreign_keys, t, s, t2, s2)
+                discard_foreign_key(foreign_keys, t2, s2, t, s)
+    keys["references"] -= {r for r in keys["references"] if r[:2] in tables or r[3:5] in tables}
+    for t1, by_schema in get_foreign_keys(cur, keys["references"], tables).items():
+        for s1, by_table in by_schema.items():
+            for t2, by_schema2 in by_table.items():
+                for s2, join in by_schema2.items():
+                    ensure_exists(foreign_keys, t1, s1, t2, {})
+                    foreign_keys[t1][s1][t2][s2] = join
+
+    # Virtual keys were dropped along with the rest; put them back if both
+    # of their tables are still there.
+    virtual = keys.get("virtual", set())
+    for edge in list(virtual):
+        s1, t1, _, s2, t2, _, _ = edge
+        if (s1, t1) in tables or (s2, t2) in tables:
+            if s1 in table_schemas.get(t1, ()) and s2 in table_schemas.get(t2, ()):
+                add_virtual_keys(keys, [edge])
+            else:
+                virtual.discard(edge)
+
 # ensure_exists(dict, key1, key2, ..., keyn, default)
 # Ensures that dict[key1][key2]...[keyn] exists; sets to default if not, and
 # creates intermediate dictionares as necessary.
@@ -146,6 +410,19 @@ def ensure_exists(dict, *args):
             dict[key] = {}
         ensure_exists(dict[key], *rargs)
 
+# A cycle of aliases among components that couldn't be resolved, given what
+# each component needs ({alias: defining component}) and how many of its
+# definers are still unresolved.
+def alias_cycle(needs, waiting):
+    i = next(i for i, w in enumerate(waiting) if w)
+    seen = {}
+    path = []
+    while i not in seen:
+        seen[i] = len(path)
+        alias, i = next((a, j) for a, j in sorted(needs[i].items()) if waiting[j])
+        path.append(alias)
+    return path[seen[i]:] + [path[seen[i]]]
+
 class findAliases(lark.Transformer):
     def __init__(self, settings, table_info, foreign_keys):
         schemas, tables, columns, table_columns = table_info
@@ -156,6 +433,9 @@ class findAliases(lark.Transformer):
         self.foreign_keys = foreign_keys
         self.seen_aliases = set()
         self.aliases = { None: {}}
+        # Aliases are recorded with the schema of their path's first table; a
+        # join that leads into another schema is noted here by (prefix, alias).
+        self.alias_schemas = {}
 
     def _schema_for_table(self, table):
         if table in self.aliases:
@@ -166,7 +446,7 @@ class findAliases(lark.Transformer):
             if s in self.tables[table]:
                 return s
         # If it's not in the search_path, just take the first one.
-        return list(self.tables[table].keys())[0]
+        return self.tables[table][0]
 
     def _aliases_needed_for_path(self, path):
         needed = []
@@ -234,8 +514,14 @@ class findAliases(lark.Transformer):
 
             if path:
                 _, _, last_table = aliases[path[-1]]
-                if table not in self.foreign_keys[last_table][schema]:
+                last_schema = self.alias_schemas.get((prefix, path[-1]), schema)
+                joins = self.foreign_keys.get(last_table, {}).get(last_schema, {}).get(table)
+                if not joins:
                     raise ScryException(f"No known join of {table} to {path[-1]}")
+                # Stay in the same schema if possible
+                table_schema = last_schema if last_schema in joins else next(iter(joins))
+                if table_schema != schema:
+                    self.alias_schemas.setdefault((prefix, alias), table_schema)
 
 
             # Check that the alias doesn't already exist somewhere else
@@ -258,27 +544,41 @@ class findAliases(lark.Transformer):
         # Filter out whitespace
         children = [c for c in children if isinstance(c, tuple)]
 
-        # Tag queries with what aliases they need before they can be resolved
-        children_with_aliases = [(c[0], self._aliases_needed_for_path(c[0])) for c in children]
-
-        updated_one = True
-        while children_with_aliases and updated_one:
-            updated_one = False
-            next_round = []
-            for ca in children_with_aliases:
-                # If any needed aliases are unresolved, put this one off.
-                needed_aliases = ca[1]
-                if not all(a in self.aliases[None] for a in needed_aliases):
-                    next_round.append(ca)
-                    continue
-
-                # Add aliases for thie query, since we have everything we need.
-                self._add_aliases(None, ca[0])
-                updated_one = True
-            children_with_aliases = next_round
-
-        if children_with_aliases:
-            raise ScryException("Unfinished aliases:", children_with_aliases)
+        # A component using an alias has to wait for the (first) component
+        # defining it.  Components are resolved in dependency order, and
+        # otherwise in the order they were written.
+        definers = {}
+        for i, c in enumerate(children):
+            for elem in c[0]:
+                if isinstance(elem, tuple) and len(elem) == 2:
+                    definers.setdefault(elem[1], i)
+        needs = []
+        for c in children:
+            needed = self._aliases_needed_for_path(c[0])
+            for a in needed:
+                if a not in definers:
+                    raise ScryException(f"Alias {a} is only defined inside a condition")
+            needs.append({a: definers[a] for a in needed})
+        waiting = [len(set(n.values())) for n in needs]
+        dependents = defaultdict(list)
+        for i, n in enumerate(needs):
+            for j in set(n.values()):
+                dependents[j].append(i)
+
+        ready = [i for i, w in enumerate(waiting) if w == 0]
+        heapq.heapify(ready)
+        resolved = 0
+        while ready:
+            i = heapq.heappop(ready)
+            self._add_aliases(None, children[i][0])
+            resolved += 1
+            for j in dependents[i]:
+                waiting[j] -= 1
+                if waiting[j] == 0:
+                    heapq.heappush(ready, j)
+
+        if resolved < len(children):
+            raise ScryException(f"Circular aliases: {' -> '.join(alias_cycle(needs, waiting))}")
 
         deep_conditions = [(c[0][-1][-1], c[1]) for c in children if c[1]]
         # TODO: Handle actual aliases here(?!)
@@ -311,6 +611,7 @@ class findAliases(lark.Transformer):
         return (children, [])
 
     def path_elem(self, children):
+        children = [c for c in children if c.type != "SAMPLE"]
         # No alias
         table = children[0].value
         if len(children) == 1:
@@ -330,12 +631,19 @@ class findAliases(lark.Transformer):
     def terminator(self, children):
         return []
 
+    def aggregate(self, children):
+        if children[0].value not in aggregates:
+            raise ScryException(f"Unknown aggregate: {children[0].value}")
+        return []
+
 
 
 
 class buildTree(lark.Transformer):
-    def __init__(self, settings, tables, table_columns, foreign_keys, schemas, aliases):
+    def __init__(self, settings, tables, table_columns, foreign_keys, schemas, aliases, bindings=None, alias_schemas=None):
         self.trees = {}
+        self.bindings = bindings if bindings is not None else {}
+        self.alias_schemas = alias_schemas or {}
         self.settings = settings
         self.tables = tables
         self.table_columns = table_columns
@@ -343,6 +651,8 @@ class buildTree(lark.Transformer):
         self.schemas = schemas
         self.table_to_node = {}
         self.aliases = aliases
+        # Percentages given with ~ on a path, by alias
+        self.samples = {}
 
     def _table_alias(self, schema, tree):
         table = tree.children[0].value
@@ -360,17 +670,26 @@ class buildTree(lark.Transformer):
         schema, path, table = aliases[None][alias]
         return (schema, table, alias)
 
-    def _find_prefix(self, tree, prefix):
+    # A table in a different schema from its parent records its own.
+    def _find_prefix(self, tree, prefix, schema=None):
         if prefix == []:
             return tree
         (alias, *rprefix) = prefix
         ensure_exists(tree, "children", alias, {})
+        root_schema, _, table = self.aliases[None][alias]
+        table_schema = self.alias_schemas.get((None, alias), root_schema)
         if "table" not in tree["children"][alias]:
-            _, _, table = self.aliases[None][alias]
             tree["children"][alias]["table"] = table
-        return self._find_prefix(tree["children"][alias], rprefix)
+            if schema is not None and table_schema != schema:
+                tree["children"][alias]["schema"] = table_schema
+        return self._find_prefix(tree["children"][alias], rprefix, table_schema)
 
     def query_path(self, children):
+        aggregate = None
+        if isinstance(children[-1], tuple):
+            aggregate = children[-1][0]
+            children = children[:-1]
+
         if children[0] in self.schemas:
             children = children[1:]
 
@@ -394,6 +713,15 @@ class buildTree(lark.Transformer):
         query_root = self.trees[schema]
 
         target = self._find_prefix(query_root, path + [alias])
+
+        if aggregate:
+            column = columns[0] if columns != ["*"] else None
+            if column is None and aggregate != "count":
+                raise ScryException(f"{aggregate}() needs a column")
+            ensure_exists(target, "aggregates", [])
+            target["aggregates"].append((aggregate, column))
+            return
+
         ensure_exists(target, "columns", [])
 
         if "*" in columns:
@@ -404,13 +732,32 @@ class buildTree(lark.Transformer):
     def condition(self, children):
         prefix, suffix, column = children[0]
         op = children[1]
-        value = children[2].value
+        value = children[2]
 
         if prefix[0] in self.schemas:
             prefix = prefix[1:]
 
+        # A list is passed as a single array parameter, however long it is.
+        if op in ["IN", "NOT IN"]:
+            if isinstance(value, lark.Token):
+                name = value.value[1:]
+                self.bindings.setdefault(name, UNBOUND)
+            else:
+                name = f"_list{sum(1 for n in self.bindings if n.startswith('_list'))}"
+                self.bindings[name] = value
+            op, value = ("=", f"ANY(%({name})s)") if op == "IN" else ("<>", f"ALL(%({name})s)")
+        else:
+            value = value.value
+
+        # Generated SQL is always run with a parameter dict, so a literal %
+        # has to be doubled up to survive psycopg2's formatting.
         if value[0] == '"' and value[-1] == '"':
-            value = f"'{value[1:-1]}'"
+            value = value[1:-1].replace("'", "''").replace("%", "%%")
+            value = f"'{value}'"
+        elif value[0] == "$":
+            name = value[1:]
+            self.bindings.setdefault(name, UNBOUND)
+            value = f"%({name})s"
 
         def addConstraint(tree, suffix):
             if suffix == []:
@@ -442,13 +789,27 @@ class buildTree(lark.Transformer):
             addConstraint(prefix_node["conditions"]["children"][a], ts)
 
     def path_elem(self, children):
-        # No alias; use the table name
-        table = children[0].value
-        if len(children) == 1:
-            return children[0].value
-
-        # Otherwise return the alias
-        return children[1].value
+        sample = [c.value for c in children if c.type == "SAMPLE"]
+        children = [c for c in children if c.type != "SAMPLE"]
+        # No alias; use the table name, otherwise the alias
+        alias = children[-1].value
+        if sample:
+            if self.samples.get(alias, sample[0]) != sample[0]:
+                raise ScryException(f"Conflicting samples of {alias}")
+            self.samples[alias] = sample[0]
+        return alias
+
+    # Sampling applies to root tables: either \set sample, or ~N% on the
+    # table, which takes precedence.
+    def add_samples(self):
+        for alias in self.samples:
+            if self.aliases[None][alias][1]:
+                raise ScryException(f"Only the first table of a path can be sampled: {alias}")
+        for schemaTree in self.trees.values():
+            for alias, root in schemaTree.get("children", {}).items():
+                percent = self.samples.get(alias, self.settings["config"]["sample"])
+                if percent != "off":
+                    root["sample"] = sample_clause(self.settings, percent)
 
     def columns(self, children):
         if len(children) == 1:
@@ -458,6 +819,9 @@ class buildTree(lark.Transformer):
     def terminator(self, children):
         return []
 
+    def aggregate(self, children):
+        return (children[0].value,)
+
     def condition_full_path(self, children):
         return (children[0], [], children[1])
 
@@ -475,6 +839,18 @@ class buildTree(lark.Transformer):
     def comparison_op(self, children):
         return children[0].value
 
+    def in_op(self, children):
+        return " ".join(c.value.upper() for c in children)
+
+    def in_list(self, children):
+        return [literal_value(c.value) for c in children]
+
+    def in_file(self, children):
+        return ValuesFile(children[0].value)
+
+    def in_parameter(self, children):
+        return children[0]
+
     def column(self, children):
         return children[0].value
 
@@ -495,9 +871,7 @@ def parse_alias(tree):
     alias = tree.children[0].children[1].value
     return (table, alias)
 
-def parse(settings, table_info, foreign_keys, query, aliases_only=False):
-    schemas, tables, columns, table_columns = table_info
-    p = Lark(r"""
+grammar = r"""
         start: query | set | alias
 
         set: "\\set" NAME SETTING?
@@ -506,22 +880,30 @@ def parse(settings, table_info, foreign_keys, query, aliases_only=False):
         query: component (WS+ component)*
         component: query_path | condition
 
-        query_path: path_elem ("." path_elem)* ("." columns |  terminator)?
+        query_path: path_elem ("." path_elem)* ("." columns | "." aggregate | terminator)?
+        aggregate: NAME "(" ")"
 
-        condition: (condition_path | condition_full_path) comparison_op VALUE
+        condition: (condition_path | condition_full_path) (comparison_op VALUE | in_op in_values)
         condition_path: condition_path_prefix ":" condition_path_suffix
         condition_full_path: condition_path_prefix "." column
         condition_path_prefix: path_elem ("." path_elem)*
         condition_path_suffix: path_elem ("." path_elem)*
         !comparison_op: "=" | "<" | "<=" | "<>" | ">=" | ">" | "LIKE"i | "ILIKE"i
+        !in_op: "IN"i | "NOT"i "IN"i
+        in_values: "[" (VALUE ("," VALUE)*)? "]" -> in_list
+                 | "@" FILENAME -> in_file
+                 | PARAMETER -> in_parameter
 
-        path_elem: COMPONENT ("@" NAME)?
+        path_elem: COMPONENT ("@" NAME)? ("~" SAMPLE)?
         columns: COLUMN ("," COLUMN)*
         column: COLUMN
         terminator: "." ","
         COMPONENT: NAME
         COLUMN: NAME | "*"
-        VALUE: ESCAPED_STRING | SIGNED_NUMBER | "NULL"
+        VALUE: ESCAPED_STRING | SIGNED_NUMBER | "NULL" | PARAMETER
+        PARAMETER: "$" NAME
+        FILENAME: /\S+/
+        SAMPLE: /\d+(\.\d*)?%/
         SETTING: /\S+/
 
         %import common.CNAME -> NAME
@@ -529,8 +911,47 @@ def parse(settings, table_info, foreign_keys, query, aliases_only=False):
         %import common.SIGNED_NUMBER
         %import common.WS
         %ignore WS
-    """)
-    parsed = p.parse(query)
+    """
+
+_parser = None
+_parser_lock = threading.Lock()
+
+# Building the parser is by far the most expensive part of a parse, so only do
+# it once.  Parsing itself doesn't touch any shared state.
+def get_parser():
+    global _parser
+    with _parser_lock:
+        if _parser is None:
+            _parser = Lark(grammar)
+    return _parser
+
+set_pattern = re.compile(r"\s*\\set\s+([A-Za-z_]\w*)(?:\s+(\S+))?\s*$")
+alias_pattern = re.compile(r"\s*\\alias\s+([A-Za-z_]\w*)\s*@?\s*([A-Za-z_]\w*)\s*$")
+report_pattern = re.compile(r"\s*\\(slow|top)(?:\s+(\d+))?\s*$")
+indexes_pattern = re.compile(r"\s*\\indexes\s+(.*\S)\s*$", re.S)
+count_pattern = re.compile(r"\s*\\count(~?)\s+(.*\S)\s*$", re.S)
+materialize_pattern = re.compile(r"\s*\\materialize\s+([A-Za-z_]\w*)\s+(.*\S)\s*$", re.S)
+# \watch takes either an interval in seconds or @channel to rerun on NOTIFY
+watch_pattern = re.compile(r"\s*\\watch\s+(?:@([A-Za-z_]\w*)|(\d+(?:\.\d*)?))\s+(.*\S)\s*$", re.S)
+
+# \set and \alias are simple enough to match without the full parser, which
+# keeps them cheap (rcfiles are mostly made of them).
+def parse_meta(query):
+    m = set_pattern.match(query)
+    if m:
+        return (m.groups() if m.group(2) is not None else (m.group(1),), None)
+    m = alias_pattern.match(query)
+    if m:
+        return (None, m.groups())
+    return None
+
+def parse(settings, table_info, foreign_keys, query, aliases_only=False, bindings=None):
+    schemas, tables, columns, table_columns = table_info
+    meta = parse_meta(query)
+    if meta:
+        return (None, None, *meta)
+
+    parsed = get_parser().parse(query)
     parsed_set = parse_set(parsed)
     if parsed_set:
         return (None, None, parsed_set, None)
@@ -547,11 +968,31 @@ def parse(settings, table_info, foreign_keys, query, aliases_only=False):
     if aliases_only:
         return aliases
 
-    t = buildTree(settings, tables, table_columns, foreign_keys, schemas, aliases)
+    t = buildTree(settings, tables, table_columns, foreign_keys, schemas, aliases, bindings, at.alias_schemas)
     t.transform(parsed)
+    t.add_samples()
     return (t.trees, aliases, None, None)
 
 
+sample_pattern = re.compile(r"(\d+(?:\.\d*)?|\.\d+)%$")
+
+# The TABLESAMPLE clause for a percentage like "0.1%", with the method and
+# REPEATABLE seed from the settings.
+def sample_clause(settings, percent):
+    m = sample_pattern.match(percent)
+    if not m or float(m.group(1)) > 100:
+        raise ScryException(f"Invalid sample percentage: {percent}")
+    method = settings["config"]["sample_method"]
+    if method.lower() not in ["system", "bernoulli"]:
+        raise ScryException(f"Unknown sample method: {method}")
+    clause = f" TABLESAMPLE {method.upper()} ({m.group(1)})"
+    seed = settings["config"]["sample_seed"]
+    if seed != "off":
+        if not re.fullmatch(r"-?\d+", str(seed)):
+            raise ScryException(f"Invalid sample seed: {seed}")
+        clause += f" REPEATABLE ({seed})"
+    return clause
+
 def join_condition(foreign_keys, schema, t1, t2, a1, a2):
     st1 = schema + "." + t1
     st2 = schema + "." + t2
@@ -566,111 +1007,766 @@ def merge_clauses(dst, src):
         ensure_exists(dst, k, [])
         dst[k] += vs
 
-def generate_sql(keys, tree, schema=None, table=None, alias=None, lastAlias=None, lastTable=None, path=None):
-    def generate_condition(column, op, value):
-        # Oh, SQL and NULL.
-        if op == "=" and value.lower() == "null":
-            op = "IS"
-        if op == "<>" and value.lower() == "null":
-            op = "IS NOT"
-        return f"{column} {op} {value}"
-
-    def generate_condition_subquery(baseAlias, baseTable, tree):
-        def subcondition_sql(tree, lastTable, lastAlias):
-            clauses = {"joins": [], "wheres": []}
-            for a, subTree in tree.get("children", {}).items():
-                t = subTree["table"]
-                clauses["joins"].append(join_condition(keys["foreign"], schema, lastTable, t, lastAlias, a))
-                subclauses = subcondition_sql(subTree, t, a)
-                merge_clauses(clauses, subclauses)
-            for c in tree.get("conditions", []):
-                col, op, value = c
-                query_name = lastAlias if lastAlias != lastTable else schema + "." + lastTable
-
-                clauses["wheres"].append(generate_condition(f"{query_name}.{col}", op, value))
-            return clauses
-
-        clauses = subcondition_sql(tree, baseTable, baseAlias)
-        joins_string = schema + "." + table + " " + " ".join(clauses["joins"])
-        wheres_string = " AND ".join(clauses["wheres"])
-        query_name = baseAlias if baseAlias != lastTable else schema + "." + baseTable
-        # TODO: Handle non-id keys
-        sql = f"{query_name}.id IN (SELECT {schema}.{table}.id FROM {joins_string} WHERE {wheres_string})"
-        return sql
-
-    clauses = { "selects": [], "joins": [], "wheres": [], "uniques": [] }
-    if not schema:
-        for s, subTree in tree.items():
-            subclauses = generate_sql(keys, subTree, s, None, None, None, None, s)
-            merge_clauses(clauses, subclauses)
-        return clauses
-
-    if not table:
+def new_clauses():
+    return { "selects": [], "joins": [], "wheres": [], "uniques": [], "join_keys": [] }
+
+# The typed form of a query that SQL is generated from: one QueryNode per table
+# instance, in a tree following the joins.  parse() produces nested dicts, which
+# build_ir converts; optimize then rewrites the tree before emit_sql turns it
+# into clauses.
+@dataclass
+class QueryNode:
+    schema: str
+    table: str
+    alias: str
+    # The output path for this table's columns
+    path: str
+    columns: list = field(default_factory=list)
+    # As built by buildTree: {"conditions": [(column, op, value)], "children": {...}},
+    # where children are ":" conditions compiled to a subquery.
+    conditions: dict = field(default_factory=dict)
+    aggregates: list = field(default_factory=list)
+    children: list = field(default_factory=list)
+    parent: "QueryNode" = field(default=None, repr=False, compare=False)
+    # The node this one is joined to, and the (parent column, column) pair it's
+    # joined on.  Normally the parent, but join elimination can skip a level.
+    join_parent: "QueryNode" = field(default=None, repr=False, compare=False)
+    join: tuple = None
+    # Not joined at all; any columns are read from join_parent instead.
+    eliminated: bool = False
+    # A TABLESAMPLE clause, for root tables
+    sample: str = ""
+    # Filled in from a table kept client-side instead of being joined, as
+    # (column names, {key: row}); see cache_dimensions.
+    cached: tuple = field(default=None, repr=False, compare=False)
+
+    @property
+    def query_name(self):
+        return self.alias if self.alias != self.table else self.schema + "." + self.table
+
+def build_ir(keys, tree):
+    def build_node(schema, alias, tree, path, parent):
+        schema = tree.get("schema", schema)
+        node = QueryNode(schema, tree["table"], alias, path,
+                         list(tree.get("columns", [])), tree.get("conditions", {}),
+                         list(tree.get("aggregates", [])), parent=parent, join_parent=parent,
+                         sample=tree.get("sample", ""))
+        if parent:
+            node.join = keys["foreign"][parent.table][parent.schema][node.table][schema]
+        for a, subTree in tree.get("children", {}).items():
+            # Paths name the root's children by table, and everything deeper by alias.
+            name = subTree["table"] if parent is None else a
+            node.children.append(build_node(schema, a, subTree, path + "." + name, node))
+        return node
+
+    roots = []
+    for schema, schemaTree in tree.items():
+        for a, subTree in schemaTree.get("children", {}).items():
+            roots.append(build_node(schema, a, subTree, schema + "." + a, None))
+    return roots
+
+# The (schema, table) pairs a parsed query uses.
+def tree_tables(tree):
+    def walk(schema, tree):
+        for subTree in tree.get("children", {}).values():
+            tables.add((subTree.get("schema", schema), subTree["table"]))
+            walk(subTree.get("schema", schema), subTree)
+        # Conditions on other tables are kept as trees of their own
+        if isinstance(tree.get("conditions"), dict):
+            walk(schema, tree["conditions"])
+
+    tables = set()
+    for schema, schemaTree in tree.items():
+        walk(schema, schemaTree)
+    return tables
+
+def references(keys, node, column, target, target_column):
+    return (node.schema, node.table, column, target.schema, target.table, target_column) in keys.get("references", ())
+
+def unique_columns(keys, node):
+    return keys["unique"].get(node.schema, {}).get(node.table, {}).get("columns")
+
+# Skip joins that can't change the results:
+# - A table in the middle of a path that contributes nothing itself, and is
+#   joined to on the same (unique) column that the next table joins on.  The
+#   next table can then be joined directly to the previous one.  For
+#   favorites.books.series_books, favorites.book_id = books.id = series_books.book_id.
+#   A foreign key into the skipped table must guarantee a row would be found.
+# - A leaf table whose only selected column is the one it's joined on, when
+#   the previous table has a foreign key to it; e.g., books.authors.id is just
+#   books.author_id.
+def eliminate_joins(keys, roots):
+    def contributes(node):
+        return node.columns or node.conditions or node.aggregates
+
+    def eliminate(node):
+        if node.join_parent and not contributes(node) and len(node.children) == 1:
+            child = node.children[0]
+            parent_column, column = node.join
+            if (not child.aggregates and child.join[0] == column
+                    and unique_columns(keys, node) == [column]
+                    and (references(keys, node.join_parent, parent_column, node, column)
+                         or references(keys, child, child.join[1], node, column))):
+                node.eliminated = True
+                child.join_parent = node.join_parent
+                child.join = (parent_column, child.join[1])
+
+        if node.join_parent and not node.children and not node.conditions and not node.aggregates:
+            parent_column, column = node.join
+            if not node.columns or (
+                    set(node.columns) == {column} and unique_columns(keys, node) == [column]
+                    and references(keys, node.join_parent, parent_column, node, column)):
+                node.eliminated = True
+
+        for child in node.children:
+            eliminate(child)
+
+    for node in roots:
+        eliminate(node)
+    return roots
+
+optimizers = [eliminate_joins]
+
+# A column of a table kept client-side, looked up by the value of key, an
+# expression the query selects.
+Lookup = namedtuple("Lookup", ["key", "schema", "table", "key_column", "column"])
+
+# Small tables' rows, kept client-side so that a join to one can be filled in
+# after fetching instead of done in SQL, where its columns are repeated on
+# every row.  A table is small if pg_class.reltuples says it has at most
+# max_rows rows (one that has never been analyzed isn't).  Tables are
+# refetched after ttl seconds, and the least recently used are dropped.
+class DimensionCache:
+    def __init__(self, cur, size=64, clock=time.monotonic):
+        self.cur = cur
+        self.size = size
+        self.clock = clock
+        self.tables = OrderedDict()
+
+    # (column names, {key: row}) for schema.table, or None if it isn't small.
+    def rows(self, schema, table, key_column, max_rows, ttl, text=False):
+        key = (schema, table, key_column, text)
+        entry = self.tables.get(key)
+        if entry is not None and self.clock() - entry[0] < ttl:
+            self.tables.move_to_end(key)
+            return entry[1]
+
+        rows = None
+        self.cur.execute("""SELECT c.reltuples
+            FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s""", (schema, table))
+        found = self.cur.fetchone()
+        if found and 0 <= found[0] <= max_rows:
+            cur = text_cursor(self.cur.connection) if text else self.cur
+            # The statistics may be out of date, so check the size too.
+            cur.execute(f"SELECT * FROM {schema}.{table} LIMIT %s", (max_rows + 1,))
+            names = [d.name for d in cur.description]
+            fetched = cur.fetchall()
+            if len(fetched) <= max_rows:
+                i = names.index(key_column)
+                rows = (names, {row[i]: row for row in fetched})
+
+        self.tables[key] = (self.clock(), rows)
+        self.tables.move_to_end(key)
+        while len(self.tables) > self.size:
+            self.tables.popitem(last=False)
+        return rows
+
+    def discard(self, tables):
+        for key in [k for k in self.tables if k[:2] in tables]:
+            del self.tables[key]
+
+# Fill in leaf tables from client-side copies, when they're only there for
+# their columns and joined by their (single column) unique key, so at most one
+# row matches.  rows(schema, table, key_column) gives a table's rows, or None
+# to join it as usual.
+def cache_dimensions(keys, roots, rows):
+    def visit(node):
+        if (node.join_parent and not node.eliminated and node.columns and not node.children
+                and not node.conditions and not node.aggregates
+                and unique_columns(keys, node) == [node.join[1]]):
+            node.cached = rows(node.schema, node.table, node.join[1])
+        for child in node.children:
+            visit(child)
+
+    for node in roots:
+        visit(node)
+    return roots
+
+# The name of an index that can look up rows of a table by column, if any.
+def leading_index(keys, schema, table, column):
+    for name, columns in keys.get("indexes", {}).get(schema, {}).get(table, []):
+        if columns[0] == column:
+            return name
+    return None
+
+# The columns a query looks rows up by, besides scanning its root tables, as
+# (node, column, use): the column each table is joined on, and the columns
+# with conditions that an index could help with.
+def lookup_columns(roots):
+    def walk(node):
+        if node.join_parent and not node.eliminated and not node.cached:
+            yield (node, node.join[1], f"join from {node.join_parent.schema}.{node.join_parent.table}")
+        for column, op, value in node.conditions.get("conditions", []):
+            if op != "<>":
+                yield (node, column, "condition")
+        for child in node.children:
+            yield from walk(child)
+
+    for node in roots:
+        yield from walk(node)
+
+# Warnings for lookups that no index can help with, which will likely mean a
+# sequential scan of the whole table.  Without index information, there are
+# none.
+def index_warnings(keys, roots):
+    if "indexes" not in keys:
+        return []
+    warnings = []
+    for node, column, use in lookup_columns(roots):
+        if not leading_index(keys, node.schema, node.table, column):
+            warning = f"-- No index on {node.schema}.{node.table}.{column} ({use})"
+            if warning not in warnings:
+                warnings.append(warning)
+    return warnings
+
+def optimize(keys, roots):
+    for optimizer in optimizers:
+        roots = optimizer(keys, roots)
+    return roots
+
+def generate_condition(column, op, value):
+    # Oh, SQL and NULL.
+    if op == "=" and value.lower() == "null":
+        op = "IS"
+    if op == "<>" and value.lower() == "null":
+        op = "IS NOT"
+    return f"{column} {op} {value}"
+
+def generate_condition_subquery(keys, schema, table, baseAlias, baseTable, lastTable, tree):
+    def subcondition_sql(tree, lastTable, lastAlias):
+        clauses = {"joins": [], "wheres": []}
         for a, subTree in tree.get("children", {}).items():
             t = subTree["table"]
-            subclauses = generate_sql(keys, subTree, schema, t, a, None, None, path + "." + a)
+            clauses["joins"].append(join_condition(keys["foreign"], schema, lastTable, t, lastAlias, a))
+            subclauses = subcondition_sql(subTree, t, a)
             merge_clauses(clauses, subclauses)
+        for c in tree.get("conditions", []):
+            col, op, value = c
+            query_name = lastAlias if lastAlias != lastTable else schema + "." + lastTable
+
+            clauses["wheres"].append(generate_condition(f"{query_name}.{col}", op, value))
         return clauses
 
-    for c in tree.get("columns", []):
-        query_name = alias if alias != table else schema + "." + table
-        col = query_name + "." + c
-        clauses["selects"].append((f"{col}", f"{path}.{c}"))
+    clauses = subcondition_sql(tree, baseTable, baseAlias)
+    joins_string = schema + "." + table + " " + " ".join(clauses["joins"])
+    wheres_string = " AND ".join(clauses["wheres"])
+    query_name = baseAlias if baseAlias != lastTable else schema + "." + baseTable
+    # TODO: Handle non-id keys
+    sql = f"{query_name}.id IN (SELECT {schema}.{table}.id FROM {joins_string} WHERE {wheres_string})"
+    return sql
+
+def condition_sql(keys, node, lastTable):
+    wheres = []
+    for col, op, value in node.conditions.get("conditions", []):
+        wheres.append(generate_condition(f"{node.query_name}.{col}", op, value))
+    if "children" in node.conditions:
+        wheres.append(generate_condition_subquery(keys, node.schema, node.table, node.alias, node.table, lastTable, node.conditions))
+    return wheres
+
+def emit_sql(keys, roots):
+    def emit(node):
+        if node.aggregates:
+            return emit_aggregates(keys, node)
+        if node.cached:
+            return emit_lookups(node)
+
+        clauses = new_clauses()
+        for c in node.columns:
+            if node.eliminated:
+                # The only column it can have is the one it was joined on.
+                source = f"{node.join_parent.query_name}.{node.join[0]}"
+            else:
+                source = f"{node.query_name}.{c}"
+            clauses["selects"].append((source, f"{node.path}.{c}"))
 
-    if "conditions" in tree:
-        for c in tree["conditions"].get("conditions", []):
-            col, op, value = c
-            query_name = alias if alias != table else schema + "." + table
-            clauses["wheres"].append(generate_condition(f"{query_name}.{col}", op, value))
-        if "children" in tree["conditions"]:
-            clauses["wheres"].append(generate_condition_subquery(alias, table, tree["conditions"]))
-
-    if not lastTable:
-        if table in keys["unique"].get(schema, {}):
-            query_name = alias if alias != table else schema + "." + table
-            cols = keys["unique"][schema][table]["columns"]
-            clauses["uniques"] += [(query_name + "." + c, path + "." + c) for c in cols]
-        alias_string = " AS " + alias if alias != table else ""
-        clauses["joins"].append(schema + "." + table + alias_string)
-        for a, subTree in tree.get("children", {}).items():
-            t = subTree["table"]
-            subclauses = generate_sql(keys, subTree, schema, t, a, alias, table, path + "." + t)
-            merge_clauses(clauses, subclauses)
+        clauses["wheres"] += condition_sql(keys, node, node.parent.table if node.parent else None)
+
+        if not node.eliminated:
+            cols = unique_columns(keys, node) or []
+            clauses["uniques"] += [(node.query_name + "." + c, node.path + "." + c) for c in cols]
+            alias_string = " AS " + node.alias if node.alias != node.table else ""
+            if not node.join_parent:
+                clauses["joins"].append(node.schema + "." + node.table + alias_string + node.sample)
+            else:
+                parent_column, column = node.join
+                clauses["joins"].append(f"LEFT JOIN {node.schema}.{node.table}{alias_string} ON {node.join_parent.query_name}.{parent_column} = {node.query_name}.{column}")
+                clauses["join_keys"].append(node.query_name + "." + column)
+
+        for child in node.children:
+            merge_clauses(clauses, emit(child))
         return clauses
 
-    if table in keys["unique"][schema]:
-        query_name = alias if alias != table else schema + "." + table
-        cols = keys["unique"][schema][table]["columns"]
-        clauses["uniques"] += [(query_name + "." + c, path + "." + c) for c in cols]
-    clauses["joins"].append(join_condition(keys["foreign"], schema, lastTable, table, lastAlias, alias))
+    clauses = new_clauses()
+    for node in roots:
+        merge_clauses(clauses, emit(node))
+    return clauses
+
+# A cached table's columns are looked up by the parent's join column, which
+# stands in for its unique key as the join key would.
+def emit_lookups(node):
+    parent_column, column = node.join
+    key = f"{node.join_parent.query_name}.{parent_column}"
+    table = (node.schema, node.table, column)
+    unique = Lookup(key, *table, column)
+    clauses = new_clauses()
+    clauses["selects"] = [(Lookup(key, *table, c), f"{node.path}.{c}") for c in node.columns]
+    clauses["uniques"] = [(unique, f"{node.path}.{column}")]
+    clauses["join_keys"] = [unique]
+    clauses["lookup_tables"] = [(table, node.cached)]
+    return clauses
+
+def generate_sql(keys, tree):
+    return emit_sql(keys, optimize(keys, build_ir(keys, tree)))
+
+# Aggregates are computed in a correlated subquery per parent row, so only one
+# row per parent comes back instead of every row being aggregated.  An
+# aggregate on the root table aggregates over the whole (filtered) table.
+def emit_aggregates(keys, node):
+    if node.columns or node.children:
+        raise ScryException(f"Can't select from {node.alias} while aggregating over it")
 
-    for a, subTree in tree.get("children", {}).items():
-        t = subTree["table"]
-        subclauses = generate_sql(keys, subTree, schema, t, a, alias, table, path + "." + a)
-        merge_clauses(clauses, subclauses)
+    clauses = new_clauses()
+    # Conditions on the aggregated table restrict what's aggregated.
+    conditions = condition_sql(keys, node, None)
+
+    alias_string = " AS " + node.alias if node.alias != node.table else ""
+    if node.join_parent:
+        parent_column, column = node.join
+        conditions = [f"{node.join_parent.query_name}.{parent_column} = {node.query_name}.{column}"] + conditions
+    else:
+        clauses["joins"].append(node.schema + "." + node.table + alias_string + node.sample)
+        clauses["wheres"] += conditions
+
+    for func, column in node.aggregates:
+        arg = f"{node.query_name}.{column}" if column else "*"
+        select = f"{func}({arg})"
+        if node.join_parent:
+            select = f"(SELECT {select} FROM {node.schema}.{node.table}{alias_string} WHERE {' AND '.join(conditions)})"
+        clauses["selects"].append((select, f"{node.path}.{func}({column or ''})"))
 
     return clauses
 
-def serialize_sql(clauses, limit):
-    selects = clauses["uniques"] + clauses["selects"]
+# Cut the SELECT list down to what's actually needed:
+# - Each distinct expression is only fetched once, even if it's used for more
+#   than one output path (e.g., a unique key that's also selected).
+# - Unique key columns that a table was joined on are dropped.  They're equal
+#   to a column of the parent entity whenever the row exists, so they never
+#   distinguish one entity from another within a parent.
+# The expressions to fetch are listed in "columns", in order, and any
+# Lookups to fill in after fetching in "lookups".
+def minimize_projection(clauses):
+    join_keys = set(clauses.get("join_keys", []))
+    uniques = [u for u in clauses["uniques"] if u[0] not in join_keys]
+    columns = {}
+    lookups = {}
+    for expr, path in uniques + clauses["selects"]:
+        if isinstance(expr, Lookup):
+            lookups.setdefault(expr, len(lookups))
+            expr = expr.key
+        columns.setdefault(expr, len(columns))
+    minimized = dict(clauses, uniques=uniques, columns=list(columns))
+    if lookups:
+        minimized["lookups"] = list(lookups)
+    return minimized
+
+# Where each field's value is in a row: either looked up in the minimized
+# column list, or positional, uniques first.  Lookups come after the columns,
+# once fill_lookups has added them.
+def column_indexes(clauses, fields):
+    if "columns" not in clauses:
+        return list(range(len(fields)))
+    exprs = clauses["columns"] + clauses.get("lookups", [])
+    columns = {expr: i for i, expr in enumerate(exprs)}
+    return [columns[f[0]] for f in fields]
+
+# Adds the values of the query's Lookups to each row.
+def fill_lookups(rows, sql_clauses):
+    if not sql_clauses.get("lookups"):
+        return rows
+    tables = dict(sql_clauses["lookup_tables"])
+    columns = {expr: i for i, expr in enumerate(sql_clauses["columns"])}
+    sources = []
+    for lookup in sql_clauses["lookups"]:
+        names, table_rows = tables[(lookup.schema, lookup.table, lookup.key_column)]
+        sources.append((columns[lookup.key], table_rows, names.index(lookup.column)))
+
+    filled = []
+    for row in rows:
+        values = []
+        for key, table_rows, i in sources:
+            match = table_rows.get(row[key])
+            values.append(match[i] if match is not None else None)
+        filled.append(tuple(row) + tuple(values))
+    return filled
+
+def serialize_sql(clauses, limit, order_by=None):
+    selects = clauses.get("columns") or [s[0] for s in clauses["uniques"] + clauses["selects"]]
     joins = clauses["joins"]
     wheres = clauses["wheres"]
-    selects_string = ", ".join([s[0] for s in selects])
+    selects_string = ", ".join(selects)
     joins_string = " ".join(joins)
     wheres_string = ""
     if wheres != []:
         wheres_string = " WHERE " + " AND ".join(wheres)
+    if order_by:
+        wheres_string += " ORDER BY " + ", ".join(order_by)
     limit_string = ""
     if limit != 0:
         limit_string = f"LIMIT {limit}"
     return f"SELECT {selects_string} FROM {joins_string} {wheres_string} {limit_string}"
 
+# Paging state for a query: the root table's unique key, which the query is
+# ordered by so that \next can pick up after the last key seen with a keyset
+# condition.  Returns None if the query can't be paged (no unique key, or more
+# than one root table.)
+def paging_state(sql_clauses, params):
+    indexes = column_indexes(sql_clauses, sql_clauses["uniques"])
+    roots = [(i, u) for i, u in zip(indexes, sql_clauses["uniques"]) if len(u[1].split(".")) == 3]
+    if not roots or len(set(u[1].rsplit(".", 1)[0] for i, u in roots)) != 1:
+        return None
+    return {
+        "sql_clauses": sql_clauses,
+        "params": params,
+        "columns": [i for i, u in roots],
+        "keys": [u[0] for i, u in roots],
+        "last": None,
+        "done": False,
+    }
+
+# The rows for a page, trimmed so that the last root entity is complete: if the
+# limit may have cut it off partway, it's dropped and will be the start of the
+# next page.  Without any joins, every row is a whole entity.  If the page is
+# all one entity, it's kept, but marked as possibly cut off; see
+# truncation_warning.
+def trim_page(paging, rows, limit):
+    def key(row):
+        return tuple(row[i] for i in paging["columns"])
+
+    if len(rows) < limit:
+        paging["done"] = True
+    elif len(paging["sql_clauses"]["joins"]) > 1 and key(rows[0]) != key(rows[-1]):
+        last = key(rows[-1])
+        while key(rows[-1]) == last:
+            rows.pop()
+    elif len(paging["sql_clauses"]["joins"]) > 1:
+        paging["truncated"] = True
+    if rows:
+        paging["last"] = key(rows[-1])
+    return rows
+
+# \next continues after the page's last root entity, so if the limit cut the
+# only one on the page short, the rest of its rows are never shown.
+def truncation_warning(paging, limit):
+    if paging.pop("truncated", False):
+        table = paging["keys"][0].rsplit(".", 1)[0]
+        return f"-- The limit of {limit} rows may have cut off this {table}; \\set limit higher to see all of it"
+
+# Fill in caller-supplied values for the $parameters recorded while parsing.
+def bind_parameters(bindings, params):
+    params = params or {}
+    bound = {}
+    for name, value in bindings.items():
+        if value is UNBOUND:
+            if name not in params:
+                raise ScryException(f"No value given for parameter ${name}")
+            value = params[name]
+        elif isinstance(value, ValuesFile):
+            value = read_values(value.path)
+        bound[name] = value
+    return bound
+
+# The value of a list element, or a line of an IN @file; anything that looks
+# like a number is passed as one.
+def literal_value(value):
+    if value[0] == '"' and value[-1] == '"':
+        return value[1:-1]
+    if value[0] == "$":
+        raise ScryException(f"Parameters can't be used in lists: {value}")
+    if value.upper() == "NULL":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+# Read when the query is run rather than when it's compiled, so cached plans
+# see changes to the file.
+ValuesFile = namedtuple("ValuesFile", ["path"])
+
+# The values read from a file, kept as the strings they were written as.
+# They're sent as an untyped array literal, '{"01234","5"}', so Postgres
+# casts them to the type of the column they're compared with, and zip codes
+# stay zip codes.
+class FileValues(list):
+    pass
+
+def adapt_file_values(values):
+    elements = ('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+    return psycopg2.extensions.QuotedString("{" + ",".join(elements) + "}")
+
+psycopg2.extensions.register_adapter(FileValues, adapt_file_values)
+
+def read_values(path):
+    try:
+        with open(os.path.expanduser(path)) as f:
+            return FileValues(line.strip() for line in f if line.strip())
+    except OSError as e:
+        raise ScryException(f"Can't read values from {path}: {e.strerror}")
+
+# Splits the longest list bound to an "= ANY(...)" condition into chunks of at
+# most size values, giving the parameters to run the query with for each one.
+# Aggregates would be computed per chunk, so those queries are never split.
+def chunk_parameters(sql_clauses, sql, params, size):
+    if not size or any(s[1].endswith(")") for s in sql_clauses["selects"]):
+        return [params]
+    lists = [k for k, v in params.items()
+             if isinstance(v, list) and len(v) > size and f"= ANY(%({k})s)" in sql]
+    if not lists:
+        return [params]
+    name = max(lists, key=lambda k: len(params[k]))
+    values = params[name]
+    return [dict(params, **{name: type(values)(values[i:i + size])}) for i in range(0, len(values), size)]
+
+# The SQL and parameters to run each chunk with.  The limit is shared between
+# the chunks, so each only fetches what's left of it, given fetched(), the
+# number of rows fetched so far.
+def chunk_queries(sql_clauses, sql, chunks, limit, order_by, fetched):
+    for i, chunk in enumerate(chunks):
+        if not limit or i == 0:
+            yield sql, chunk
+        elif fetched() < limit:
+            yield serialize_sql(sql_clauses, limit - fetched(), order_by), chunk
+        else:
+            return
+
+# Parameters to print a query with; long lists are summarized rather than
+# printed in full.
+def display_parameters(params):
+    return {k: psycopg2.extensions.AsIs(f"'{{{len(v)} values}}'") if isinstance(v, list) and len(v) > 10 else v
+            for k, v in params.items()}
+
+CompiledQuery = namedtuple("CompiledQuery", ["sql", "params", "sql_clauses", "warnings"], defaults=[()])
+
+# Compiles scry queries to SQL against a fixed schema snapshot, without needing
+# a database connection.  Safe to share between threads; plans are cached by
+# query text (and the settings that affect them), so only the parameter
+# binding is repeated for a query that's been seen before.
+#
+# The result is meant to be run as cur.execute(c.sql, c.params), and the rows
+# passed to reshape_results along with c.sql_clauses, which must be treated as
+# read-only since it's shared by every caller of the same query.
+class Compiler:
+    def __init__(self, table_info, keys, settings=None, cache_size=1024):
+        self.table_info = table_info
+        self.keys = keys
+        self.settings = settings or default_settings()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by refresh_schema, so plans made from the old schema while it
+        # ran aren't cached.
+        self._generation = 0
+
+    @classmethod
+    def from_cursor(cls, cur, settings=None, cache_size=1024):
+        table_info, keys = load_schema(cur)
+        return cls(table_info, keys, settings, cache_size)
+
+    def _cache_key(self, query, settings):
+        config = settings["config"]
+        aliases = tuple(sorted(settings["aliases"].items()))
+        sample = (config["sample"], config["sample_method"], str(config["sample_seed"]))
+        return (query, str(config["limit"]), config["search_path"], sample, aliases)
+
+    def _plan(self, query, settings):
+        table_info, keys = self.table_info, self.keys
+        bindings = {}
+        tree, _, setting, alias = parse(settings, table_info, keys["foreign"], query, bindings=bindings)
+        if tree is None:
+            raise ScryException("Only queries can be compiled")
+        roots = optimize(keys, build_ir(keys, tree))
+        sql_clauses = minimize_projection(emit_sql(keys, roots))
+        sql = serialize_sql(sql_clauses, int(settings["config"]["limit"]))
+        return (sql, sql_clauses, bindings, tree_tables(tree), tuple(index_warnings(keys, roots)))
+
+    # settings, if given, are used instead of the compiler's own for this query.
+    def compile(self, query, params=None, settings=None):
+        settings = settings or self.settings
+        key = self._cache_key(query, settings)
+        with self._lock:
+            plan = self._cache.get(key)
+            if plan is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+
+        if plan is None:
+            # Planning happens outside the lock; two threads racing on the same
+            # new query just both do the work.
+            generation = self._generation
+            plan = self._plan(query, settings)
+            with self._lock:
+                self.misses += 1
+                if generation == self._generation:
+                    self._cache[key] = plan
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        sql, sql_clauses, bindings, _, warnings = plan
+        return CompiledQuery(sql, bind_parameters(bindings, params), sql_clauses, warnings)
+
+    def clear_cache(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+
+    # Reloads the given (schema, table) pairs, e.g. from SchemaMonitor.changes,
+    # and drops cached plans that used a table of the same name (a new table
+    # can change which schema a name resolves to).  The schema is refreshed
+    # in a copy so that queries being planned meanwhile see a consistent one.
+    def refresh_schema(self, cur, tables):
+        if not tables:
+            return
+        table_info, keys = copy.deepcopy((self.table_info, self.keys))
+        refresh_schema(cur, table_info, keys, tables)
+        names = {t for s, t in tables}
+        with self._lock:
+            self.table_info, self.keys = table_info, keys
+            self._generation += 1
+            for key in [k for k, plan in self._cache.items() if any(t in names for s, t in plan[3])]:
+                del self._cache[key]
+
+# Compilers for query(), so that each connection's schema is only loaded once.
+compilers = weakref.WeakKeyDictionary()
+cursor_ids = itertools.count()
+statement_ids = itertools.count()
+
+# The row indexes and expressions that identify a root entity: its unique key
+# if it has one, and otherwise its selected values.
+def root_key(sql_clauses):
+    for fields in [sql_clauses["uniques"], sql_clauses["selects"]]:
+        roots = [f for f in fields if len(f[1].split(".")) == 3]
+        if roots:
+            return column_indexes(sql_clauses, roots), [f[0] for f in roots]
+    return [], None
+
+# Runs a query and returns an iterator over its root entities, as namedtuples
+# with a field for each column and a list of entities for each child table:
+#
+#   for author in query(conn, "authors.name authors.books.title"):
+#       print(author.name, [b.title for b in author.books])
+#
+# Rows are read from a server-side cursor ordered by the root table's key, so
+# only one root entity's rows are held at a time.  Unlike the REPL, there is
+# no limit unless settings give one.
+def query(conn, text, params=None, settings=None, compiler=None, batch_size=1000):
+    compiled, settings = compile_for(conn, text, params, settings, compiler)
+    key_columns, order_by = root_key(compiled.sql_clauses)
+    sql = serialize_sql(compiled.sql_clauses, int(settings["config"]["limit"]), order_by)
+    return stream_entities(conn, sql, compiled.params, compiled.sql_clauses, key_columns, batch_size)
+
+def compile_for(conn, text, params, settings, compiler):
+    if compiler is None:
+        compiler = compilers.get(conn)
+        if compiler is None:
+            with conn.cursor() as cur:
+                compiler = compilers[conn] = Compiler.from_cursor(cur)
+    if settings is None:
+        settings = default_settings()
+        settings["config"]["limit"] = 0
+    return compiler.compile(text, params, settings), settings
+
+# Named cursors can only outlive a transaction if they're held.
+def server_cursor(conn, batch_size):
+    cur = conn.cursor(name=f"scry_{next(cursor_ids)}", withhold=conn.autocommit)
+    cur.itersize = batch_size
+    return cur
+
+# Runs a query and returns its selected columns as flat arrays, one entry per
+# row, without building any tree: {"scry.books.year": array('q', [...]), ...}.
+# See fetch_columns.
+def query_columns(conn, text, params=None, settings=None, compiler=None, batch_size=10000, use_numpy=None):
+    compiled, settings = compile_for(conn, text, params, settings, compiler)
+    cur = server_cursor(conn, batch_size)
+    try:
+        cur.execute(compiled.sql, compiled.params)
+        return fetch_columns(cur, compiled.sql_clauses, batch_size, use_numpy)
+    finally:
+        cur.close()
+
+def stream_entities(conn, sql, params, sql_clauses, key_columns, batch_size):
+    fields = result_fields(sql_clauses)
+    classes = {}
+
+    def entities(rows):
+        results = ResultStore(fields)
+        for row in rows:
+            results.add_row(row)
+        for schema_node, schema_indexes in zip(results.root.children, results.root.entities[0].children):
+            for schema_entity in (schema_node.entities[i] for i in schema_indexes):
+                for node, indexes in zip(schema_node.children, schema_entity.children):
+                    for i in indexes:
+                        yield entity_object(node, node.entities[i], node.name, classes)
+
+    cur = server_cursor(conn, batch_size)
+    try:
+        cur.execute(sql, params)
+        rows = []
+        last = None
+        for row in cur:
+            key = tuple(row[i] for i in key_columns)
+            if rows and key != last:
+                yield from entities(rows)
+                rows = []
+            rows.append(row)
+            last = key
+        yield from entities(rows)
+    finally:
+        cur.close()
+
+def entity_object(node, entity, path, classes):
+    cls = classes.get(path)
+    if cls is None:
+        # Aggregates like sum(year) become sum_year
+        names = [re.sub(r"\W+", "_", n).strip("_") for n in node.display + tuple(c.name for c in node.children)]
+        cls = classes[path] = namedtuple("Entity", names, rename=True)
+    values = list(entity.display or ())
+    for child, indexes in zip(node.children, entity.children or []):
+        children = []
+        for i in indexes:
+            e = child.entities[i]
+            # A LEFT JOIN through a table without columns that found nothing
+            if e.display is None and e.hidden is not None and all(v is None for v in e.hidden):
+                continue
+            children.append(entity_object(child, e, path + "." + child.name, classes))
+        values.append(children)
+    return cls(*values)
+
 def parseargs():
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--command", help="command to run")
     parser.add_argument("-d", "--database", help="database to connect to")
     parser.add_argument("-l", "--limit", help="row limit (0 for no limit)", type=int)
     parser.add_argument("-s", "--schema", help="default schema", default="scry")
+    parser.add_argument("-f", "--format", help="output format", choices=["tree", "columns"])
+    parser.add_argument("--install-schema-trigger", action="store_true",
+                        help="install an event trigger to notify sessions of schema changes, then exit")
     return parser.parse_args()
 
 def shared_prefix(l1, l2):
@@ -689,66 +1785,254 @@ def print_tree(tree, indent=""):
             print(f"{indent}  {repr(k)}: {repr(v)}")
 
 
-def reshape_results(cur, sql_clauses):
-    def tree_of_row(tree, path, display, value):
-        if len(path) == 1:
+# Reshaped results are stored compactly: each path in the query (schema,
+# table, joined table, ...) gets one ResultNode holding its column names, and
+# each distinct entity found at that path is a ResultEntity holding just the
+# values, plus the indexes of its children in each child node's entity list.
+class ResultNode:
+    __slots__ = ("name", "display", "hidden", "display_index", "hidden_index", "children", "entities")
+
+    def __init__(self, name):
+        self.name = name
+        self.display = ()
+        self.hidden = ()
+        self.display_index = []
+        self.hidden_index = []
+        self.children = []
+        self.entities = []
+
+    def child(self, name):
+        for c in self.children:
+            if c.name == name:
+                return c
+        c = ResultNode(name)
+        self.children.append(c)
+        return c
+
+# display and hidden are None for a node without display or hidden columns;
+# children is None for a node without child nodes.
+class ResultEntity:
+    __slots__ = ("display", "hidden", "children")
+
+    def __init__(self, display, hidden, children):
+        self.display = display
+        self.hidden = hidden
+        self.children = children
+
+class ResultStore:
+    # fields is a list of (path, display, index) for each output path, where
+    # index is the position of its value in a row.
+    def __init__(self, fields):
+        self.root = ResultNode(None)
+        for path, display, i in fields:
+            *tables, column = path.split(".")
+            node = self.root
+            for t in tables:
+                node = node.child(t)
             if display:
-                ensure_exists(tree, "display", [])
-                tree["display"].append((path[0], value))
+                node.display += (column,)
+                node.display_index.append(i)
             else:
-                ensure_exists(tree, "hidden", [])
-                tree["hidden"].append((path[0], value))
-            return
-        p, *rpath = path
-        ensure_exists(tree, "children", p, {})
-        tree_of_row(tree["children"][p], rpath, display, value)
-
-    def add_to_main_tree(tree, tree_for_row):
-        for table, subtree in tree_for_row.items():
-            display = tuple(subtree.get("display", (None,)))
-            if display != (None,) and all(v is None for k, v in display):
-                continue
-            hidden = tuple(subtree.get("hidden", (None,)))
+                node.hidden += (column,)
+                node.hidden_index.append(i)
+        self.root.entities.append(ResultEntity(None, None, [[] for c in self.root.children]))
+        # Only needed while rows are being added; maps (display, hidden) to
+        # the index of the entity for each parent entity and child node.
+        self._seen = {}
+
+    def add_row(self, row):
+        self._add(self.root, 0, row)
+
+    def _add(self, node, index, row):
+        entity = node.entities[index]
+        for position, child in enumerate(node.children):
+            display = None
+            if child.display_index:
+                display = tuple(row[i] for i in child.display_index)
+                # A LEFT JOIN that found nothing
+                if all(v is None for v in display):
+                    continue
+            hidden = tuple(row[i] for i in child.hidden_index) if child.hidden_index else None
+
+            seen = self._seen.setdefault((id(child), index), {})
             key = (display, hidden)
-            ensure_exists(tree, table, key, {})
-            if "children" in subtree:
-                add_to_main_tree(tree[table][key], subtree["children"])
+            child_index = seen.get(key)
+            if child_index is None:
+                child_index = len(child.entities)
+                grandchildren = [[] for c in child.children] if child.children else None
+                child.entities.append(ResultEntity(display, hidden, grandchildren))
+                entity.children[position].append(child_index)
+                seen[key] = child_index
+            self._add(child, child_index, row)
+
+    def finish(self):
+        self._seen = None
+        return self
+
+    # The same results as nested dicts, keyed by tuples of (column, value)
+    # pairs; much bigger, but easy to compare and print.
+    def as_tree(self):
+        def pairs(names, values):
+            return tuple(zip(names, values)) if values is not None else (None,)
+
+        def tree_of(node, entity):
+            tree = {}
+            for child, indexes in zip(node.children, entity.children or []):
+                for i in indexes:
+                    e = child.entities[i]
+                    ensure_exists(tree, child.name, {})
+                    tree[child.name][(pairs(child.display, e.display), pairs(child.hidden, e.hidden))] = tree_of(child, e)
+            return tree
+
+        return tree_of(self.root, self.root.entities[0])
 
-    tree = {}
+# The (path, display, index) of each column of the rows for sql_clauses.
+def result_fields(sql_clauses):
+    fields = sql_clauses["uniques"] + sql_clauses["selects"]
+    displays = [False] * len(sql_clauses["uniques"]) + [True] * len(sql_clauses["selects"])
+    indexes = column_indexes(sql_clauses, fields)
+    return [(f[1], d, i) for f, d, i in zip(fields, displays, indexes)]
 
-    selects = [(c[1], True) for c in sql_clauses["selects"]]
-    uniques = [(c[1], False) for c in sql_clauses["uniques"]]
-    fields = uniques + selects
+def reshape_results(cur, sql_clauses):
+    results = ResultStore(result_fields(sql_clauses))
 
     for row in cur:
-        tree_for_row = {}
-        for (p, d), v in zip(fields, row):
-            tree_of_row(tree_for_row, p.split("."), d, v)
-        add_to_main_tree(tree, tree_for_row["children"])
+        results.add_row(row)
 
-    return tree
+    return results.finish()
 
-def format_results(results, path="", indent=""):
+def format_entity(node, entity, path, indent):
+    if entity.display is None:
+        return format_children(node, entity, path + node.name + ".", indent)
     output = []
+    prefix = "- "
+    for k, v in zip(node.display, entity.display):
+        output.append(f"{indent}{prefix}{path}{node.name}.{k}: {v}")
+        prefix = "  "
+    return output + format_children(node, entity, "", indent + "  ")
 
-    def print_fields(table, fields):
-        output = []
-        k, v = fields[0]
-        output.append(f"{indent}- {path}{table}.{k}: {v}")
-        for k, v in fields[1:]:
-            output.append(f"{indent}  {path}{table}.{k}: {v}")
-        return output
-
-    for t, subTree in results.items():
-        for (display, hidden), nextTree in subTree.items():
-            if display != (None,):
-                output += print_fields(t, display)
-                output += format_results(nextTree, "", indent + "  ")
+def format_children(node, entity, path, indent):
+    output = []
+    for child, indexes in zip(node.children, entity.children or []):
+        for i in indexes:
+            output += format_entity(child, child.entities[i], path, indent)
+    return output
+
+def format_results(results):
+    return format_children(results.root, results.root.entities[0], "", "")
+
+# array.array typecodes for the Postgres types (by OID) that fit in one:
+# int8, int2 and int4, and float4 and float8.
+array_typecodes = {20: "q", 21: "q", 23: "q", 700: "d", 701: "d"}
+numpy_dtypes = {"q": "int64", "d": "float64"}
+
+# Reads an executed query's rows in batches into a column per selected path.
+# Integer and float columns are packed into array.arrays (or NumPy arrays, if
+# NumPy is installed and use_numpy isn't False); anything else, or a numeric
+# column with a NULL in it, is a list.
+def fetch_columns(cur, sql_clauses, batch_size=10000, use_numpy=None):
+    selects = sql_clauses["selects"]
+    indexes = column_indexes(sql_clauses, selects)
+    # A server-side cursor's description is only known after a fetch.
+    rows = cur.fetchmany(batch_size)
+    types = [cur.description[i].type_code for i in indexes]
+    columns = [array(array_typecodes[t]) if t in array_typecodes else [] for t in types]
+
+    while rows:
+        transposed = list(zip(*rows))
+        for n, i in enumerate(indexes):
+            column = columns[n]
+            if isinstance(column, array):
+                size = len(column)
+                try:
+                    column.extend(transposed[i])
+                    continue
+                except TypeError:
+                    # A NULL; the values before it were already added.
+                    del column[size:]
+                    columns[n] = column = column.tolist()
+            column.extend(transposed[i])
+        rows = cur.fetchmany(batch_size)
+
+    if use_numpy is not False:
+        try:
+            import numpy
+            columns = [numpy.frombuffer(c, numpy_dtypes[c.typecode]) if isinstance(c, array) else c for c in columns]
+        except ImportError:
+            if use_numpy:
+                raise
+    return {f[1]: c for f, c in zip(selects, columns)}
+
+def format_columns(columns):
+    return [json.dumps({path: list(c) for path, c in columns.items()}, default=str)]
+
+# The same results as JSON-ready dicts: each entity maps its columns to their
+# values, and each child table to a list of entities.  Tables without columns
+# of their own are folded into the names of their children, as in
+# format_results.
+def children_json(node, entity, path, output):
+    for child, indexes in zip(node.children, entity.children or []):
+        for i in indexes:
+            e = child.entities[i]
+            if e.display is None:
+                children_json(child, e, path + child.name + ".", output)
             else:
-                output += format_results(nextTree, path + t + ".", indent)
+                output.setdefault(path + child.name, []).append(entity_json(child, e))
+    return output
 
+def entity_json(node, entity):
+    return children_json(node, entity, "", dict(zip(node.display, entity.display)))
+
+def results_json(results):
+    return children_json(results.root, results.root.entities[0], "", {})
+
+# Entities are matched up by their unique key where there is one, and
+# otherwise by their displayed values (so a change shows up as a removal and
+# an addition).
+def entity_key(entity):
+    return entity.hidden if entity.hidden is not None else entity.display
+
+def diff_children(old_node, old_entity, new_node, new_entity, path, indent):
+    output = []
+    children = zip(old_node.children, new_node.children, old_entity.children or [], new_entity.children or [])
+    for old_child, new_child, old_indexes, new_indexes in children:
+        old = {entity_key(old_child.entities[i]): old_child.entities[i] for i in old_indexes}
+        new = {entity_key(new_child.entities[i]): new_child.entities[i] for i in new_indexes}
+        for key, e in old.items():
+            if key not in new:
+                output += ["- " + line for line in format_entity(old_child, e, path, indent)]
+        for key, e in new.items():
+            if key not in old:
+                output += ["+ " + line for line in format_entity(new_child, e, path, indent)]
+                continue
+            output += diff_entity(old_child, old[key], new_child, e, path, indent)
     return output
 
+def diff_entity(old_node, old_entity, new_node, new_entity, path, indent):
+    if new_entity.display is None:
+        return diff_children(old_node, old_entity, new_node, new_entity, path + new_node.name + ".", indent)
+
+    changes = diff_children(old_node, old_entity, new_node, new_entity, "", indent + "  ")
+    changed = old_entity.display != new_entity.display
+    if not changes and not changed:
+        return []
+
+    output = []
+    prefix = "- "
+    for k, old, new in zip(new_node.display, old_entity.display, new_entity.display):
+        if old != new:
+            output.append(f"~ {indent}{prefix}{path}{new_node.name}.{k}: {old} -> {new}")
+        else:
+            output.append(f"{'~' if changed else ' '} {indent}{prefix}{path}{new_node.name}.{k}: {new}")
+        prefix = "  "
+    return output + changes
+
+# Lines describing how two sets of results for the same query differ: "+" for
+# added entities, "-" for removed ones and "~" for changed ones, with
+# unchanged parents shown for context.
+def diff_results(old, new):
+    return diff_children(old.root, old.root.entities[0], new.root, new.root.entities[0], "", "")
+
 def run_setting(settings, setting):
     if len(setting) == 1:
         print(f"{setting[0]} is {settings['config'].get(setting[0], 'unset')}")
@@ -759,8 +2043,455 @@ def run_setting(settings, setting):
     settings["config"][key] = value
 
 
-def run_command(settings, cur, table_info, keys, query):
+# A cursor that returns every value as the text Postgres sent.  Tree output
+# only interpolates values into strings, so parsing timestamps, numerics and
+# JSON into Python objects first is wasted work, and for wide results a large
+# share of the client's time.  NULLs are still None.
+def text_cursor(conn):
+    return text_types(conn.cursor())
+
+def text_types(cur):
+    oids = tuple(psycopg2.extensions.string_types)
+    psycopg2.extensions.register_type(psycopg2.extensions.new_type(oids, "SCRY_TEXT", lambda value, cur: value), cur)
+    return cur
+
+# run, if given, is what's recorded in the history for the query:
+# {"query", "timings"}, with the SQL, rows, bytes and the rest of the timings
+# added here.
+def run_page(settings, cur, sql_clauses, params, run=None):
+    limit = int(settings["config"]["limit"])
+    paging = settings["paging"]
+    # The pipeline streams one root entity at a time, so it needs rows ordered
+    # by the root table's key, which paging only has for a single root table.
+    pipelined = settings["config"]["pipeline"] == "on" and paging is not None and settings["config"]["format"] == "tree"
+    order_by = paging["keys"] if pipelined else None
+    if paging and limit != 0:
+        order_by = paging["keys"]
+        if paging["last"] is not None:
+            names = [f"_after{i}" for i in range(len(paging["last"]))]
+            placeholders = ", ".join(f"%({n})s" for n in names)
+            wheres = sql_clauses["wheres"] + [f"({', '.join(order_by)}) > ({placeholders})"]
+            sql_clauses = dict(sql_clauses, wheres=wheres)
+            params = dict(params, **dict(zip(names, paging["last"])))
+
+    sql = serialize_sql(sql_clauses, limit, order_by)
+
+    print(cur.mogrify(sql, display_parameters(params)).decode())
+    chunks = chunk_parameters(sql_clauses, sql, params, int(settings["config"]["in_chunk_size"]))
+    if len(chunks) > 1:
+        # The chunks are separate queries, with no one order to page through.
+        print(f"-- in {len(chunks)} chunks")
+        paging = settings["paging"] = None
+
+    run = run or {"query": None, "timings": {}}
+    run["sql"] = sql
+    timings = run["timings"]
+    start = time.perf_counter()
+
+    if pipelined and paging:
+        stages = run_pipeline(settings, cur.connection, sql, sql_clauses, params, limit, sys.stdout)
+        timings.update(stages["timings"])
+        run["total"] = time.perf_counter() - start
+        run["rows"] = stages["rows"]
+        run["bytes"] = stages["bytes"]
+        warning = truncation_warning(paging, limit)
+        if warning:
+            print(warning)
+        record_run(settings, run, None)
+        # Nothing's left to print, unless there was nothing at all.
+        return None if stages["bytes"] else []
+
+    if settings["config"]["format"] == "columns":
+        columns = {}
+        for chunk_sql, chunk in chunk_queries(sql_clauses, sql, chunks, limit, order_by,
+                                              lambda: len(next(iter(columns.values()), []))):
+            execute(settings, cur, chunk_sql, chunk)
+            for path, column in fetch_columns(cur, sql_clauses, use_numpy=False).items():
+                columns[path] = columns.get(path, []) + list(column)
+        timings["execute"] = time.perf_counter() - start
+        run["rows"] = len(next(iter(columns.values()), []))
+        start = time.perf_counter()
+        output = format_columns(columns)
+        timings["format"] = time.perf_counter() - start
+        return record_run(settings, run, output)
+
+    # Values are only displayed, so they can stay as text; the paging keys
+    # work as text too, since Postgres casts them back.
+    fetch_cur = text_cursor(cur.connection) if settings["config"]["fetch"] == "text" else cur
+    rows = []
+    for chunk_sql, chunk in chunk_queries(sql_clauses, sql, chunks, limit, order_by, lambda: len(rows)):
+        execute(settings, fetch_cur, chunk_sql, chunk)
+        rows += fetch_cur.fetchall()
+    timings["execute"] = time.perf_counter() - start
+    run["rows"] = len(rows)
+    if paging and limit != 0:
+        rows = trim_page(paging, rows, limit)
+        warning = truncation_warning(paging, limit)
+        if warning:
+            print(warning)
+    elif paging:
+        paging["done"] = True
+
+    start = time.perf_counter()
+    results = reshape_results(fill_lookups(rows, sql_clauses), sql_clauses)
+    timings["reshape"] = time.perf_counter() - start
+    start = time.perf_counter()
+    output = format_results(results)
+    timings["format"] = time.perf_counter() - start
+    return record_run(settings, run, output)
+
+# Runs the statement warm_up prepared for the SQL, if there is one.
+def execute(settings, cur, sql, params):
+    name = settings["prepared"].get(cur.mogrify(sql, params)) if settings["prepared"] else None
+    if name:
+        cur.execute(f"EXECUTE {name}")
+    else:
+        cur.execute(sql, params)
+
+def record_run(settings, run, output):
+    if settings["history"] is not None and run["query"] is not None:
+        if output is not None:
+            run["bytes"] = sum(len(line.encode()) + 1 for line in output)
+        settings["history"].record(run)
+    return output
+
+# How many batches each stage of run_pipeline can get ahead of the next.
+pipeline_depth = 4
+
+# Runs the page of a single-root query in three overlapping stages, so that a
+# large result takes about as long as its slowest stage rather than all of
+# them together: a thread fetches batches of rows from a server-side cursor,
+# another reshapes and formats them a root entity at a time, and the calling
+# thread writes the lines to out as they come.  Bounded queues between the
+# stages keep memory flat when one is slower than the others.
+#
+# The SQL must order the rows by the root table's key, and paging is updated
+# as trim_page would.  Returns the rows fetched, the bytes written, and how
+# long each stage spent working.
+def run_pipeline(settings, conn, sql, sql_clauses, params, limit, out):
+    paging = settings["paging"]
+    batch_size = int(settings["config"]["pipeline_batch"])
+    text = settings["config"]["fetch"] == "text"
+
+    stop = threading.Event()
+    fetched = queue.Queue(pipeline_depth)
+    formatted = queue.Queue(pipeline_depth)
+    stages = {"rows": 0, "bytes": 0, "timings": {"execute": 0, "reshape": 0, "format": 0}}
+    timings = stages["timings"]
+
+    # Gives up once the writer has stopped, rather than waiting on a full queue.
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def fetch():
+        cur = server_cursor(conn, batch_size)
+        if text:
+            text_types(cur)
+        try:
+            start = time.perf_counter()
+            cur.execute(sql, params)
+            while not stop.is_set():
+                rows = cur.fetchmany(batch_size)
+                timings["execute"] += time.perf_counter() - start
+                put(fetched, rows)
+                if not rows:
+                    break
+                start = time.perf_counter()
+        except Exception as e:
+            put(fetched, e)
+        try:
+            cur.close()
+        except psycopg2.Error:
+            # The cursor is already gone if the query failed.
+            pass
+
+    def key(row):
+        return tuple(row[i] for i in paging["columns"])
+
+    def emit(rows):
+        start = time.perf_counter()
+        results = reshape_results(fill_lookups(rows, sql_clauses), sql_clauses)
+        timings["reshape"] += time.perf_counter() - start
+        start = time.perf_counter()
+        lines = format_results(results)
+        timings["format"] += time.perf_counter() - start
+        put(formatted, lines)
+        paging["last"] = key(rows[-1])
+
+    # The rows of the last root entity seen are held back until the next
+    # entity starts, since the next batch may have more of them.
+    def reshape():
+        try:
+            held = []
+            emitted = False
+            while True:
+                rows = fetched.get()
+                if isinstance(rows, Exception):
+                    raise rows
+                if not rows:
+                    break
+                stages["rows"] += len(rows)
+                rows = held + rows
+                last = key(rows[-1])
+                cut = len(rows)
+                while cut and key(rows[cut - 1]) == last:
+                    cut -= 1
+                held = rows[cut:]
+                if cut:
+                    emit(rows[:cut])
+                    emitted = True
+            if limit == 0 or stages["rows"] < limit:
+                paging["done"] = True
+            # As in trim_page: at the limit, the last root entity may be cut
+            # off, so it's left for the next page unless it's all there is.
+            cut_off = limit and stages["rows"] >= limit and len(paging["sql_clauses"]["joins"]) > 1
+            if held and not (cut_off and emitted):
+                paging["truncated"] = bool(cut_off)
+                emit(held)
+            put(formatted, None)
+        except Exception as e:
+            put(formatted, e)
+
+    threads = [threading.Thread(target=fetch, daemon=True), threading.Thread(target=reshape, daemon=True)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            lines = formatted.get()
+            if lines is None:
+                break
+            if isinstance(lines, Exception):
+                raise lines
+            start = time.perf_counter()
+            chunk = "".join(line + "\n" for line in lines)
+            out.write(chunk)
+            out.flush()
+            stages["bytes"] += len(chunk.encode())
+            timings["format"] += time.perf_counter() - start
+    except BaseException:
+        # Don't wait for the rest of the rows to come in.
+        conn.cancel()
+        raise
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return stages
+
+def run_next(settings, cur):
+    paging = settings["paging"]
+    if not paging:
+        raise ScryException("No query to page through")
+    if paging["done"]:
+        return ["No more results"]
+    run = {"query": paging.get("query"), "timings": {}}
+    output = run_page(settings, cur, paging["sql_clauses"], paging["params"], run)
+    return ["No more results"] if output == [] else output
+
+def wait_for_notify(conn, channel):
+    while True:
+        select.select([conn], [], [])
+        conn.poll()
+        if any(n.channel == channel for n in conn.notifies):
+            conn.notifies[:] = [n for n in conn.notifies if n.channel != channel]
+            return
+
+# Runs the query as a prepared statement until interrupted, printing only
+# what changed between runs.
+def run_watch(settings, cur, table_info, keys, channel, interval, query):
+    bindings = {}
+    tree, aliases, setting, alias = parse(settings, table_info, keys["foreign"], query, bindings=bindings)
+    if setting or alias:
+        raise ScryException("Can only watch a query")
+
+    sql_clauses = minimize_projection(generate_sql(keys, tree))
+    params = bind_parameters(bindings, None)
+    sql = cur.mogrify(serialize_sql(sql_clauses, int(settings["config"]["limit"])), params).decode()
+    print(sql)
+
+    cur.execute("PREPARE scry_watch AS " + sql)
+    if channel:
+        cur.execute(f'LISTEN "{channel}"')
+    previous = None
+    try:
+        while True:
+            cur.execute("EXECUTE scry_watch")
+            results = reshape_results(cur, sql_clauses)
+            if previous is None:
+                output = format_results(results)
+            else:
+                output = diff_results(previous, results)
+                if output:
+                    output = ["-- " + time.strftime("%H:%M:%S")] + output
+            if output:
+                print("\n".join(output), flush=True)
+            previous = results
+
+            if channel:
+                wait_for_notify(cur.connection, channel)
+            else:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if channel:
+            cur.execute(f'UNLISTEN "{channel}"')
+        cur.execute("DEALLOCATE scry_watch")
+
+# Saves the rows of a query's root table into a temp table, which can then be
+# used like the original table: it has the same columns, unique key and joins.
+# Only the rows are saved; which columns the query selects doesn't matter.
+def run_materialize(settings, cur, table_info, keys, name, query):
+    bindings = {}
+    tree, aliases, setting, alias = parse(settings, table_info, keys["foreign"], query, bindings=bindings)
+    if setting or alias:
+        raise ScryException("Can only materialize a query")
+    roots = optimize(keys, build_ir(keys, tree))
+    if len(roots) != 1:
+        raise ScryException("Can only materialize a query with one root table")
+    root = roots[0]
+    clauses = emit_sql(keys, roots)
+    params = bind_parameters(bindings, None)
+
+    key = unique_columns(keys, root)
+    joins = " ".join(clauses["joins"])
+    wheres = " WHERE " + " AND ".join(clauses["wheres"]) if clauses["wheres"] else ""
+    if key:
+        inner = ", ".join(f"{root.query_name}.{c}" for c in key)
+        select = f"SELECT * FROM {root.schema}.{root.table} WHERE ({', '.join(key)}) IN (SELECT {inner} FROM {joins}{wheres})"
+    else:
+        select = f"SELECT DISTINCT {root.query_name}.* FROM {joins}{wheres}"
+
+    sql = f"CREATE TEMP TABLE {name} AS {select}"
+    print(cur.mogrify(sql, params).decode())
+    cur.execute(f"DROP TABLE IF EXISTS pg_temp.{name}")
+    cur.execute(sql, params)
+    count = cur.rowcount
+    if key:
+        constraint = "PRIMARY KEY" if keys["unique"][root.schema][root.table]["type"] == "primary" else "UNIQUE"
+        cur.execute(f"ALTER TABLE pg_temp.{name} ADD {constraint} ({', '.join(key)})")
+    if settings["config"]["materialize_analyze"] == "on":
+        cur.execute(f"ANALYZE pg_temp.{name}")
+    cur.execute("SELECT nspname FROM pg_namespace WHERE oid = pg_my_temp_schema()")
+    schema = cur.fetchone()[0]
+
+    # Temp tables can't have foreign keys to other tables, so copy the root
+    # table's joins as virtual keys.  Other tables' references to the root
+    # table don't carry over, since the new table only has some of its rows.
+    virtual = keys.setdefault("virtual", set())
+    virtual -= {e for e in virtual if e[:2] == (schema, name) or e[3:5] == (schema, name)}
+    edges = [r + (True,) for r in keys["references"]] + list(virtual)
+    for s1, t1, c1, s2, t2, c2, reference in edges:
+        if (s1, t1) == (root.schema, root.table):
+            virtual.add((schema, name, c1, s2, t2, c2, reference))
+        if (s2, t2) == (root.schema, root.table):
+            virtual.add((s1, t1, c1, schema, name, c2, False))
+    refresh_schema(cur, table_info, keys, {(schema, name)})
+
+    return [f"Materialized {count} rows of {root.schema}.{root.table} as {name}"]
+
+# Counts the root entities a query would return, without fetching them: the
+# distinct root keys, since joins can repeat a root row.  With estimate, the
+# planner's guess is used instead, or the table's size if there are no
+# conditions.
+def run_count(settings, cur, table_info, keys, estimate, query):
+    bindings = {}
+    tree, aliases, setting, alias = parse(settings, table_info, keys["foreign"], query, bindings=bindings)
+    if setting or alias:
+        raise ScryException("Can only count a query")
+    roots = optimize(keys, build_ir(keys, tree))
+    if len(roots) != 1:
+        raise ScryException("Can only count a query with one root table")
+    root = roots[0]
+    clauses = emit_sql(keys, roots)
+    params = bind_parameters(bindings, None)
+
+    joins = " ".join(clauses["joins"])
+    wheres = " WHERE " + " AND ".join(clauses["wheres"]) if clauses["wheres"] else ""
+    key = [f"{root.query_name}.{c}" for c in unique_columns(keys, root) or []]
+    if len(clauses["joins"]) == 1:
+        counted = "*"
+    elif key:
+        counted = f"DISTINCT ({', '.join(key)})" if len(key) > 1 else f"DISTINCT {key[0]}"
+    else:
+        counted = f"DISTINCT {root.query_name}.*"
+    name = f"{root.schema}.{root.table}"
+
+    if estimate:
+        if not clauses["wheres"] and not root.sample:
+            cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (name,))
+            count = cur.fetchone()[0]
+            # -1 if the table has never been analyzed
+            if count >= 0:
+                return [f"{name}: ~{count}"]
+        # The planner's estimate of how many rows the distinct keys come to
+        sql = f"EXPLAIN (FORMAT JSON) SELECT {'1' if counted == '*' else counted} FROM {joins}{wheres}"
+        print(cur.mogrify(sql, params).decode())
+        cur.execute(sql, params)
+        count = int(cur.fetchone()[0][0]["Plan"]["Plan Rows"])
+        return [f"{name}: ~{count}"]
+
+    sql = f"SELECT count({counted}) FROM {joins}{wheres}"
+    print(cur.mogrify(sql, params).decode())
+    cur.execute(sql, params)
+    return [f"{name}: {cur.fetchone()[0]}"]
+
+# Lists the index each lookup in a query would use, and how to create the
+# missing ones.
+def run_indexes(settings, cur, table_info, keys, query):
     tree, aliases, setting, alias = parse(settings, table_info, keys["foreign"], query)
+    if setting or alias:
+        raise ScryException("Can only list indexes for a query")
+    lines = []
+    for node, column, use in lookup_columns(optimize(keys, build_ir(keys, tree))):
+        name = leading_index(keys, node.schema, node.table, column)
+        line = f"{node.schema}.{node.table}.{column} ({use}): "
+        line += name or f"no index; CREATE INDEX ON {node.schema}.{node.table} ({column})"
+        if line not in lines:
+            lines.append(line)
+    return lines
+
+def run_command(settings, cur, table_info, keys, query):
+    if query.strip() == "\\next":
+        return run_next(settings, cur)
+    m = report_pattern.match(query)
+    if m:
+        if settings["history"] is None:
+            raise ScryException("No query history")
+        kind, n = m.groups()
+        return settings["history"].report(kind, int(n or 10))
+    m = indexes_pattern.match(query)
+    if m:
+        return run_indexes(settings, cur, table_info, keys, m.group(1))
+    m = count_pattern.match(query)
+    if m:
+        estimate, query = m.groups()
+        return run_count(settings, cur, table_info, keys, estimate == "~", query)
+    m = materialize_pattern.match(query)
+    if m:
+        return run_materialize(settings, cur, table_info, keys, *m.groups())
+    m = watch_pattern.match(query)
+    if m:
+        channel, interval, query = m.groups()
+        return run_watch(settings, cur, table_info, keys, channel, interval and float(interval), query)
+
+    start = time.perf_counter()
+    max_rows = int(settings["config"]["dimension_rows"])
+    # Cached plans don't know which tables are small enough to fill in.
+    if settings["compiler"] and not max_rows and not query.lstrip().startswith("\\"):
+        compiled = settings["compiler"].compile(query.strip(), None, settings)
+        if settings["config"]["index_warnings"] == "on":
+            for warning in compiled.warnings:
+                print(warning)
+        return run_compiled(settings, cur, query, compiled.sql_clauses, compiled.params, start)
+
+    bindings = {}
+    tree, aliases, setting, alias = parse(settings, table_info, keys["foreign"], query, bindings=bindings)
     if setting:
         run_setting(settings, setting)
         return
@@ -774,137 +2505,106 @@ def run_command(settings, cur, table_info, keys, query):
         settings["aliases"][alias] = table
         return
 
-    sql_clauses = generate_sql(keys, tree)
-
-    uniques = sql_clauses["uniques"]
-    sql = serialize_sql(sql_clauses, settings["config"]["limit"])
-
-    print(sql)
-    cur.execute(sql)
-
-    results = reshape_results(cur, sql_clauses)
-
-    return format_results(results)
-
-class ScryCompleter(Completer):
-    def __init__(self, settings, table_info, foreign_keys):
-        schemas, tables, columns, table_columns = table_info
-        self.table_info = table_info
-        self.schemas = schemas
-        self.tables = tables
-        self.columns = columns
-        self.table_columns = table_columns
-        self.foreign_keys = foreign_keys
-        self.settings = settings
-
-    def get_completions(self, doc, event):
-        full_line = "\n".join(doc.lines)
-        word = doc.get_word_before_cursor()
-        fullword = doc.get_word_before_cursor("\\S*")
-
-        # TODO: Make this less hacky
-        if full_line[0] == "\\":
-            words = re.split("\\s+", full_line)
-            candidates = []
-            if len(words) == 1:
-                word = words[0]
-                candidates = ["\\set", "\\alias"]
-            if words[0] == "\\set":
-                if len(words) == 2:
-                    candidates = ["complete_style", "search_path", "limit"]
-                if len(words) == 3 and words[1] == "complete_style":
-                    candidates = completion_styles.keys()
-            if words[0] == "\\alias":
-                if len(words) == 2:
-                    candidates = self.tables.keys()
-            matches = [c for c in candidates if c.startswith(word)]
-            return [Completion(c, -len(word)) for c in matches]
-
-        aliases = {}
-        # There really should be a way to tell Lark to parse as far as it can,
-        # but just taking the longest parsable prefix should be good enough.
-        # TODO: This should do exponential/binary search after the first couple.
-        for l in range(len(full_line), 0, -1):
-            try:
-                aliases = parse(self.settings, self.table_info, self.foreign_keys, full_line[:l], aliases_only=True)
-                break
-            except ScryException:
-                pass
-            except lark.exceptions.LarkError:
-                pass
-
-        if word == ".":
-            word = ""
-
-        schemas = set(self.settings["config"]["search_path"].split(","))
-        table_candidates = [t for t, ss in self.tables.items() if len(set(ss) & schemas) > 0]
-
-        component = doc.get_word_before_cursor("\\S*")
-        column_candidates = []
-        parts = component.split(".")
-        schema_candidates = []
-        if len(parts) > 1:
-            prev_part = parts[-2]
-            if prev_part in aliases[None]:
-                prev_part = aliases[None][prev_part][2]
-            column_candidates = self.table_columns.get(prev_part, [])
-            table_dicts = self.foreign_keys.get(prev_part, {}).values()
-            schema_candidates = [t for t, ss in self.tables.items() if prev_part in ss]
-            table_candidates = [t for joins in table_dicts for t in joins.keys()]
-        else:
-            schema_candidates += self.schemas
-            table_candidates += aliases.get(None, [])
-
-        candidates = sorted(column_candidates) + sorted(list(set(table_candidates))) + sorted(schema_candidates)
-        matches = [c for c in candidates if c.startswith(word)]
-        return [Completion(c, -len(word)) for c in matches]
-
-def repl(settings, cur, table_info, keys):
-    session = PromptSession(
-            history=FileHistory(os.getenv("HOME") + "/.scry/history"),
-            completer=ScryCompleter(settings, table_info, keys["foreign"]),
-            complete_in_thread=True)
-    try:
-        while True:
-            complete_style = completion_styles[settings["config"].get("complete_style", CompleteStyle.COLUMN)]
-            command = session.prompt("> ", complete_style=complete_style)
-            if command in ["quit", "break", "bye"]:
-                break
-            try:
-                output = run_command(settings, cur, table_info, keys, command)
-                if output is not None:
-                    print("\n".join(output))
-            except ScryException as e:
-                print(e)
-            except lark.exceptions.LarkError as e:
-                print(e)
-    except EOFError:
-        pass
+    roots = optimize(keys, build_ir(keys, tree))
+    # Columns are fetched straight from the cursor, with nowhere to fill them in.
+    if max_rows and settings["config"]["format"] != "columns":
+        if settings["dimensions"] is None:
+            settings["dimensions"] = DimensionCache(cur)
+        ttl = float(settings["config"]["dimension_ttl"])
+        text = settings["config"]["fetch"] == "text"
+        def rows(schema, table, key_column):
+            cached = settings["dimensions"].rows(schema, table, key_column, max_rows, ttl, text)
+            if cached is not None:
+                print(f"-- {schema}.{table} filled in from the client-side cache")
+            return cached
+        cache_dimensions(keys, roots, rows)
+    if settings["config"]["index_warnings"] == "on":
+        for warning in index_warnings(keys, roots):
+            print(warning)
+    sql_clauses = minimize_projection(emit_sql(keys, roots))
+    params = bind_parameters(bindings, None)
+    return run_compiled(settings, cur, query, sql_clauses, params, start)
+
+# Runs the first page of a compiled query, which started compiling at start.
+def run_compiled(settings, cur, query, sql_clauses, params, start):
+    run = {"query": query.strip(), "timings": {"compile": time.perf_counter() - start}}
+    # Columns are flat, so there are no entities to page through.
+    settings["paging"] = paging_state(sql_clauses, params) if settings["config"]["format"] != "columns" else None
+    if settings["paging"]:
+        settings["paging"]["query"] = run["query"]
+
+    return run_page(settings, cur, sql_clauses, params, run)
+
+# Plans queries (e.g. the most frequent ones from the history) ahead of time in
+# settings["compiler"], so they're cached by the time they're typed; meant to
+# be run in a background thread.  With warm_prepare on, their first pages are
+# also PREPAREd on cur's connection, so the server has planned them too.
+# Queries that no longer compile are skipped.  cur shouldn't be used by
+# anything else meanwhile, and only settings' "compiler" and "prepared" should
+# be shared with the REPL's.
+def warm_up(settings, cur, queries):
+    prepare = settings["config"]["warm_prepare"] == "on"
+    limit = int(settings["config"]["limit"])
+    for query in queries:
+        try:
+            compiled = settings["compiler"].compile(query, None, settings)
+            if not prepare:
+                continue
+            sql_clauses = compiled.sql_clauses
+            paging = paging_state(sql_clauses, compiled.params) if settings["config"]["format"] != "columns" else None
+            sql = serialize_sql(sql_clauses, limit, paging["keys"] if paging and limit != 0 else None)
+            statement = cur.mogrify(sql, compiled.params)
+            if chunk_parameters(sql_clauses, sql, compiled.params, int(settings["config"]["in_chunk_size"])) != [compiled.params]:
+                continue
+            name = f"scry_warm{next(statement_ids)}"
+            cur.execute(f"PREPARE {name} AS " + statement.decode())
+            settings["prepared"][statement] = name
+        except (ScryException, lark.exceptions.LarkError, psycopg2.Error):
+            pass
+
+# Drops the statements prepared by warm_up, e.g. once the schema has changed.
+def deallocate(settings, cur):
+    for name in settings["prepared"].values():
+        cur.execute(f"DEALLOCATE {name}")
+    settings["prepared"].clear()
 
 def read_rcfile(settings, cur, table_info, keys):
     try:
         with open(os.getenv("HOME") + "/.scry/scryrc") as rcfile:
             for line in rcfile.readlines():
+                if line.strip() == "":
+                    continue
                 run_command(settings, cur, table_info, keys, line)
     except FileNotFoundError:
         pass
 
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        from .serve import main as serve_main
+        return serve_main(sys.argv[2:])
+
     args = parseargs()
     db = psycopg2.connect(args.database or "")
     db.autocommit = True
     cur = db.cursor()
 
+    if args.install_schema_trigger:
+        cur.execute(schema_trigger_sql)
+        print("Installed schema change trigger; use \\set schema_refresh listen")
+        return
+
     settings = default_settings()
-    table_info = get_table_info(cur)
-    foreign_keys = get_foreign_keys(cur)
-    unique_keys = get_unique_keys(cur)
-    keys = { "unique": unique_keys, "foreign": foreign_keys }
+    # Fingerprint the catalog first, so that nothing changing while the schema
+    # loads can be missed.
+    monitor = SchemaMonitor(cur)
+    table_info, keys = load_schema(cur)
 
     read_rcfile(settings, cur, table_info, keys)
 
     if args.limit:
         settings["config"]["limit"] = int(args.limit)
+    if args.format:
+        settings["config"]["format"] = args.format
 
 
     if args.command:
@@ -920,7 +2620,8 @@ def main():
             else:
                 print(e)
     else:
-        repl(settings, cur, table_info, keys)
+        from .repl import repl
+        repl(settings, cur, table_info, keys, monitor)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,333 @@
+# `scry serve`: a long-running HTTP service, so that other tools can run scry
+# queries without paying for startup and schema introspection every time.
+#
+# POST /query takes a JSON body like
+#   {"query": "books.title books.year > $year", "params": {"year": 1990},
+#    "settings": {"limit": 10}, "format": "jsonl", "timeout": 5}
+# and returns the results as one JSON document, or with "format": "jsonl", as
+# one line per top-level entity.  GET /metrics returns Prometheus-style
+# metrics.
+
+import argparse
+import asyncio
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+import json
+import lark
+import psycopg2
+import psycopg2.errors
+import psycopg2.pool
+import time
+
+from .scry import (Compiler, ScryException, SchemaMonitor, default_settings, load_schema,
+                   reshape_results, results_json)
+
+# Request settings that can be overridden; anything else is ignored.
+request_settings = ["limit", "search_path", "sample"]
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+statuses = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+class Histogram:
+    buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name):
+        output = []
+        total = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            total += count
+            output.append(f'{name}_bucket{{le="{bound}"}} {total}')
+        output.append(f"{name}_sum {self.sum}")
+        output.append(f"{name}_count {self.count}")
+        return output
+
+class Server:
+    def __init__(self, dsn, concurrency=8, timeout=30, settings=None, schema_poll=10):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.schema_poll = schema_poll
+        # One more than the queries that can run at once, for the schema poller.
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, concurrency + 1, dsn)
+        self.executor = ThreadPoolExecutor(concurrency + 1)
+        # Requests beyond the concurrency limit wait for a slot, for up to
+        # their timeout.
+        self.slots = None
+        self.in_flight = 0
+        self.request_seconds = Histogram()
+        self.query_seconds = Histogram()
+        self.responses = {}
+
+        conn = self.pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                self.monitor = SchemaMonitor(cur)
+                self.compiler = Compiler(*load_schema(cur), settings or default_settings())
+        finally:
+            self.pool.putconn(conn)
+
+    def run_query(self, request, timeout):
+        settings = default_settings()
+        settings["config"].update(self.compiler.settings["config"])
+        settings["aliases"] = self.compiler.settings["aliases"]
+        for k, v in request.get("settings", {}).items():
+            if k not in request_settings:
+                raise HttpError(400, f"Unknown setting: {k}")
+            if k == "limit" and (isinstance(v, bool) or not isinstance(v, int) or v < 0):
+                raise HttpError(400, f"Invalid limit: {v}")
+            settings["config"][k] = v
+
+        compiled = self.compiler.compile(request["query"], request.get("params"), settings)
+
+        conn = self.pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SET statement_timeout = %s", (int(timeout * 1000),))
+                start = time.perf_counter()
+                cur.execute(compiled.sql, compiled.params)
+                rows = cur.fetchall()
+                seconds = time.perf_counter() - start
+        finally:
+            self.pool.putconn(conn)
+
+        return compiled.sql, results_json(reshape_results(rows, compiled.sql_clauses)), seconds
+
+    def refresh_schema(self):
+        conn = self.pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                self.compiler.refresh_schema(cur, self.monitor.changes(cur, "poll"))
+        finally:
+            self.pool.putconn(conn)
+
+    async def poll_schema(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.schema_poll)
+            await loop.run_in_executor(self.executor, self.refresh_schema)
+
+    async def query(self, body):
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            raise HttpError(400, f"Invalid JSON: {e}")
+        if not isinstance(request, dict) or not isinstance(request.get("query"), str):
+            raise HttpError(400, "Missing query")
+        format = request.get("format", "json")
+        if format not in ["json", "jsonl"]:
+            raise HttpError(400, f"Unknown format: {format}")
+        if not isinstance(request.get("params", {}), dict):
+            raise HttpError(400, "params must be an object")
+        if not isinstance(request.get("settings", {}), dict):
+            raise HttpError(400, "settings must be an object")
+        try:
+            timeout = min(float(request.get("timeout", self.timeout)), self.timeout)
+        except (TypeError, ValueError):
+            raise HttpError(400, f"Invalid timeout: {request.get('timeout')}")
+        if not timeout > 0:
+            raise HttpError(400, f"Invalid timeout: {request.get('timeout')}")
+
+        deadline = time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise HttpError(503, "Too many concurrent queries")
+        self.in_flight += 1
+        try:
+            remaining = max(deadline - time.monotonic(), 0.001)
+            loop = asyncio.get_running_loop()
+            sql, results, seconds = await loop.run_in_executor(self.executor, self.run_query, request, remaining)
+            self.query_seconds.observe(seconds)
+        except (ScryException, lark.exceptions.LarkError) as e:
+            if isinstance(e.__context__, ScryException):
+                e = e.__context__
+            raise HttpError(400, str(e))
+        except psycopg2.errors.QueryCanceled:
+            raise HttpError(504, "Query timed out")
+        except psycopg2.Error as e:
+            raise HttpError(500, str(e).strip())
+        finally:
+            self.in_flight -= 1
+            self.slots.release()
+
+        if format == "jsonl":
+            return "application/x-ndjson", (json.dumps(e, default=str) + "\n"
+                                            for entities in results.values() for e in entities)
+        return "application/json", json_pieces(sql, results)
+
+    def metrics(self):
+        hits, misses = self.compiler.hits, self.compiler.misses
+        lines = []
+        lines += ["# TYPE scry_request_seconds histogram"] + self.request_seconds.lines("scry_request_seconds")
+        lines += ["# TYPE scry_query_seconds histogram"] + self.query_seconds.lines("scry_query_seconds")
+        lines += ["# TYPE scry_responses_total counter"]
+        lines += [f'scry_responses_total{{status="{s}"}} {n}' for s, n in sorted(self.responses.items())]
+        lines += [
+            "# TYPE scry_compile_cache_hits_total counter",
+            f"scry_compile_cache_hits_total {hits}",
+            "# TYPE scry_compile_cache_misses_total counter",
+            f"scry_compile_cache_misses_total {misses}",
+            "# TYPE scry_compile_cache_hit_ratio gauge",
+            f"scry_compile_cache_hit_ratio {hits / (hits + misses) if hits + misses else 0}",
+            "# TYPE scry_queries_in_flight gauge",
+            f"scry_queries_in_flight {self.in_flight}",
+        ]
+        return "text/plain; version=0.0.4", ["\n".join(lines) + "\n"]
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        status = 200
+        path = None
+        try:
+            method, path, body = await read_request(reader)
+            if path == "/query":
+                if method != "POST":
+                    raise HttpError(405, "Use POST")
+                content_type, pieces = await self.query(body)
+            elif path == "/metrics":
+                content_type, pieces = self.metrics()
+            else:
+                raise HttpError(404, f"Unknown path: {path}")
+        except HttpError as e:
+            status = e.status
+            content_type, pieces = "application/json", [json.dumps({"error": str(e)})]
+        except Exception as e:
+            status = 500
+            content_type, pieces = "application/json", [json.dumps({"error": f"Internal error: {e}"})]
+
+        try:
+            await write_response(writer, status, content_type, pieces)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+        self.responses[status] = self.responses.get(status, 0) + 1
+        if path == "/query":
+            self.request_seconds.observe(time.perf_counter() - start)
+
+    async def serve(self, host, port, ready=None):
+        self.slots = asyncio.Semaphore(self.concurrency)
+        server = await asyncio.start_server(self.handle, host, port)
+        poller = asyncio.ensure_future(self.poll_schema()) if self.schema_poll else None
+        if ready:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if poller:
+                poller.cancel()
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.closeall()
+
+def json_pieces(sql, results):
+    yield '{"sql": ' + json.dumps(sql) + ', "results": {'
+    for i, (name, entities) in enumerate(results.items()):
+        yield (", " if i else "") + json.dumps(name) + ": ["
+        for j, e in enumerate(entities):
+            yield (", " if j else "") + json.dumps(e, default=str)
+        yield "]"
+    yield "}}\n"
+
+async def read_request(reader):
+    try:
+        request_line = (await reader.readline()).decode("latin-1")
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request")
+    length = 0
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            try:
+                length = int(value)
+            except ValueError:
+                raise HttpError(400, "Malformed content-length")
+            if length < 0:
+                raise HttpError(400, "Malformed content-length")
+    try:
+        body = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        raise HttpError(400, "Incomplete request body")
+    return method, target.split("?", 1)[0], body
+
+# Responses are sent with chunked encoding, so a large result is serialized a
+# piece at a time rather than as one string.  The rows themselves are all
+# fetched and reshaped before anything is sent.
+async def write_response(writer, status, content_type, pieces):
+    writer.write((f"HTTP/1.1 {status} {statuses[status]}\r\n"
+                  f"Content-Type: {content_type}\r\n"
+                  "Transfer-Encoding: chunked\r\n"
+                  "Connection: close\r\n\r\n").encode())
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= 65536:
+            await write_chunk(writer, "".join(buffer))
+            buffer, size = [], 0
+    if buffer:
+        await write_chunk(writer, "".join(buffer))
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+async def write_chunk(writer, text):
+    data = text.encode()
+    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+    await writer.drain()
+
+def parseargs(argv):
+    parser = argparse.ArgumentParser(prog="scry serve")
+    parser.add_argument("-d", "--database", help="database to connect to", default="")
+    parser.add_argument("--host", help="address to listen on", default="127.0.0.1")
+    parser.add_argument("-p", "--port", help="port to listen on", type=int, default=8765)
+    parser.add_argument("-l", "--limit", help="default row limit (0 for no limit)", type=int)
+    parser.add_argument("--concurrency", help="queries to run at once", type=int, default=8)
+    parser.add_argument("--timeout", help="maximum seconds per query", type=float, default=30)
+    parser.add_argument("--schema-poll", help="seconds between schema change checks (0 to never check)",
+                        type=float, default=10)
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseargs(argv)
+    settings = default_settings()
+    if args.limit is not None:
+        settings["config"]["limit"] = args.limit
+    server = Server(args.database, args.concurrency, args.timeout, settings, args.schema_poll)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
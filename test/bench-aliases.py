@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# Measures alias resolution (findAliases) on generated queries with hundreds
+# of components, and fails if the time per component grows with the size of
+# the query.  Queries are parsed once up front, so only alias resolution is
+# timed.
+#
+# Two shapes are generated, both written in the worst order, with every alias
+# used before the component that defines it:
+# - chain: a0.books@a1.title, a1.authors@a2.name, ..., each component
+#   depending on the one after it.
+# - fan: b.title b.title ... books@b, with everything depending on the last.
+
+import argparse
+import copy
+import psycopg2
+import statistics
+import time
+
+from scry import scry
+
+def chain(n):
+    components = ["authors@a0.name"]
+    for i in range(1, n):
+        table, column = ("books", "title") if i % 2 else ("authors", "name")
+        components.append(f"a{i - 1}.{table}@a{i}.{column}")
+    return " ".join(reversed(components))
+
+def fan(n):
+    return " ".join(["b.title"] * (n - 1) + ["books@b"])
+
+def resolve_time(settings, table_info, foreign_keys, parsed, runs):
+    times = []
+    for _ in range(runs):
+        tree = copy.deepcopy(parsed)
+        start = time.perf_counter()
+        scry.findAliases(settings, table_info, foreign_keys).transform(tree)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def parseargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", help="database to load the schema from", default="")
+    parser.add_argument("-n", "--runs", help="number of runs", type=int, default=5)
+    parser.add_argument("-s", "--sizes", help="numbers of components", type=int, nargs="+", default=[100, 200, 400])
+    parser.add_argument("-t", "--target", help="largest allowed growth in time per component", type=float, default=2)
+    return parser.parse_args()
+
+def main():
+    args = parseargs()
+    cur = psycopg2.connect(args.database).cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+
+    failed = False
+    for name, generate in [("chain", chain), ("fan", fan)]:
+        per_component = []
+        for n in args.sizes:
+            parsed = scry.get_parser().parse(generate(n))
+            seconds = resolve_time(settings, table_info, keys["foreign"], parsed, args.runs)
+            per_component.append(seconds / n)
+            print(f"{name} {n}: {seconds * 1000:.1f}ms ({seconds / n * 1e6:.1f}us per component)")
+        growth = per_component[-1] / per_component[0]
+        print(f"{name}: time per component grew {growth:.2f}x (target {args.target}x)")
+        failed = failed or growth > args.target
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
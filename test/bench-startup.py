@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+# Measures how long it takes to import scry for a non-interactive (-c) run,
+# using python -X importtime, and fails if it's over the target.
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def import_time():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import scry.scry"],
+        cwd=root, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        m = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)$", line)
+        if m:
+            times[m.group(2)] = int(m.group(1))
+    return times
+
+def parseargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", help="number of runs", type=int, default=10)
+    parser.add_argument("-t", "--target", help="target import time in ms", type=float, default=150)
+    return parser.parse_args()
+
+def main():
+    args = parseargs()
+    runs = [import_time() for _ in range(args.runs)]
+
+    for module in ["prompt_toolkit"]:
+        if any(module in r for r in runs):
+            print(f"{module} imported on the non-interactive path")
+            sys.exit(1)
+
+    median = statistics.median(r["scry"] for r in runs) / 1000
+    print(f"import scry.scry: {median:.1f}ms (target {args.target}ms)")
+    for module in ["psycopg2", "lark"]:
+        print(f"  {module}: {statistics.median(r.get(module, 0) for r in runs) / 1000:.1f}ms")
+    if median > args.target:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -58,6 +58,46 @@ error_instances = [
         "authors.books@b series_books.b",
         "Existing alias b for table books on path 'authors' reused on 'series_books'"
     ),
+    ErrorInstance(
+        "unknown aggregate",
+        "authors.books.year.median()",
+        "Unknown aggregate: median"
+    ),
+    ErrorInstance(
+        "aggregate other than count without a column",
+        "authors.books.sum()",
+        "sum() needs a column"
+    ),
+    ErrorInstance(
+        "selecting from an aggregated table",
+        "authors.books.count() books.title",
+        "Can't select from books while aggregating over it"
+    ),
+    ErrorInstance(
+        "parameter in a list",
+        "books.title books.id IN [1, $id]",
+        "Parameters can't be used in lists: $id"
+    ),
+    ErrorInstance(
+        "sampling a joined table",
+        "authors.books~10%.title",
+        "Only the first table of a path can be sampled: books"
+    ),
+    ErrorInstance(
+        "sampling more than everything",
+        "books~150%.title",
+        "Invalid sample percentage: 150%"
+    ),
+    ErrorInstance(
+        "aliases defined in terms of each other",
+        "b.authors@a.name a.books@b.title",
+        "Circular aliases: b -> a -> b"
+    ),
+    ErrorInstance(
+        "alias from a condition used outside it",
+        'books:authors@a.name = "x" a.name',
+        "Alias a is only defined inside a condition"
+    ),
 ]
 
 def run_test(instance):
@@ -65,16 +105,14 @@ def run_test(instance):
     cur = db.cursor()
 
     try:
-        table_info = scry.get_table_info(cur)
-        foreign_keys = scry.get_foreign_keys(cur)
-        unique_keys = scry.get_unique_keys(cur)
-        keys = {"unique": unique_keys, "foreign": foreign_keys}
+        table_info, keys = scry.load_schema(cur)
+        foreign_keys = keys["foreign"]
 
         settings = scry.default_settings()
 
         tree, aliases, _, _ = scry.parse(settings, table_info, foreign_keys, instance.query)
 
-        sql_clauses = scry.generate_sql(keys, tree)
+        sql_clauses = scry.minimize_projection(scry.generate_sql(keys, tree))
 
         sql = scry.serialize_sql(sql_clauses, 100)
         cur.execute(sql)
@@ -1,5 +1,7 @@
 import psycopg2
 import pytest
+import re
+import time
 from dataclasses import dataclass
 
 from scry import scry
@@ -25,6 +27,18 @@ def test_table_info():
 def test_foreign_keys():
     pass
 
+def test_import_skips_repl():
+    import subprocess, sys
+    check = "import sys, scry.scry; print('prompt_toolkit' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+def test_parse_meta():
+    assert scry.parse_meta("\\set limit 10\n") == (("limit", "10"), None)
+    assert scry.parse_meta("\\set limit") == (("limit",), None)
+    assert scry.parse_meta("\\alias books@b") == (None, ("books", "b"))
+    assert scry.parse_meta("books.title") is None
+
 @dataclass
 class Instance:
     name: str
@@ -41,7 +55,7 @@ test_instances = [
         'simple test of table and column',
         'scry.authors.name',
         {'scry': {'children': {'authors': {'table': 'authors', 'columns': ['name']}}}},
-        {'selects': [('scry.authors.name', 'scry.authors.name')], 'joins': ['scry.authors'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id')]},
+        {'selects': [('scry.authors.name', 'scry.authors.name')], 'joins': ['scry.authors'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id')], 'join_keys': [], 'columns': ['scry.authors.id', 'scry.authors.name']},
         'SELECT scry.authors.id, scry.authors.name FROM scry.authors  LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}, ((('name', 'J.K. Rowling'),), (('id', 2),)): {}, ((('name', 'Ted Chiang'),), (('id', 3),)): {}}}}},
         ['- scry.authors.name: J.R.R. Tolkien', '- scry.authors.name: J.K. Rowling', '- scry.authors.name: Ted Chiang']
@@ -50,7 +64,7 @@ test_instances = [
         'simple test with two columns',
         'scry.books.title scry.books.year',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['title', 'year']}}}},
-        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.books.year', 'scry.books.year')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')]},
+        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.books.year', 'scry.books.year')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': [], 'columns': ['scry.books.id', 'scry.books.title', 'scry.books.year']},
         'SELECT scry.books.id, scry.books.title, scry.books.year FROM scry.books  LIMIT 100',
         {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'), ('year', 1954)), (('id', 1),)): {}, ((('title', 'The Two Towers'), ('year', 1954)), (('id', 2),)): {}, ((('title', 'Return of the King'), ('year', 1955)), (('id', 3),)): {}, ((('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997)), (('id', 4),)): {}, ((('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999)), (('id', 5),)): {}, ((('title', 'Exhalation'), ('year', 2019)), (('id', 6),)): {}, ((('title', 'Beowolf'), ('year', 2016)), (('id', 7),)): {}}}}},
         ['- scry.books.title: Fellowship of the Rings', '  scry.books.year: 1954', '- scry.books.title: The Two Towers', '  scry.books.year: 1954', '- scry.books.title: Return of the King', '  scry.books.year: 1955', "- scry.books.title: Harry Potter and the Philosopher's Stone", '  scry.books.year: 1997', '- scry.books.title: Harry Potter and the Prisoner of Azkaban', '  scry.books.year: 1999', '- scry.books.title: Exhalation', '  scry.books.year: 2019', '- scry.books.title: Beowolf', '  scry.books.year: 2016']
@@ -59,7 +73,7 @@ test_instances = [
         'simple test with two comma-separated columns',
         'scry.books.title,year',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['title', 'year']}}}},
-        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.books.year', 'scry.books.year')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')]},
+        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.books.year', 'scry.books.year')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': [], 'columns': ['scry.books.id', 'scry.books.title', 'scry.books.year']},
         'SELECT scry.books.id, scry.books.title, scry.books.year FROM scry.books  LIMIT 100',
         {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'), ('year', 1954)), (('id', 1),)): {}, ((('title', 'The Two Towers'), ('year', 1954)), (('id', 2),)): {}, ((('title', 'Return of the King'), ('year', 1955)), (('id', 3),)): {}, ((('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997)), (('id', 4),)): {}, ((('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999)), (('id', 5),)): {}, ((('title', 'Exhalation'), ('year', 2019)), (('id', 6),)): {}, ((('title', 'Beowolf'), ('year', 2016)), (('id', 7),)): {}}}}},
         ['- scry.books.title: Fellowship of the Rings', '  scry.books.year: 1954', '- scry.books.title: The Two Towers', '  scry.books.year: 1954', '- scry.books.title: Return of the King', '  scry.books.year: 1955', "- scry.books.title: Harry Potter and the Philosopher's Stone", '  scry.books.year: 1997', '- scry.books.title: Harry Potter and the Prisoner of Azkaban', '  scry.books.year: 1999', '- scry.books.title: Exhalation', '  scry.books.year: 2019', '- scry.books.title: Beowolf', '  scry.books.year: 2016']
@@ -68,8 +82,8 @@ test_instances = [
         'Simple test with explicit star columns',
         'scry.books.*',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['id', 'title', 'year', 'author_id']}}}},
-        {'selects': [('scry.books.id', 'scry.books.id'), ('scry.books.title', 'scry.books.title'), ('scry.books.year', 'scry.books.year'), ('scry.books.author_id', 'scry.books.author_id')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')]},
-        'SELECT scry.books.id, scry.books.id, scry.books.title, scry.books.year, scry.books.author_id FROM scry.books  LIMIT 100',
+        {'selects': [('scry.books.id', 'scry.books.id'), ('scry.books.title', 'scry.books.title'), ('scry.books.year', 'scry.books.year'), ('scry.books.author_id', 'scry.books.author_id')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': [], 'columns': ['scry.books.id', 'scry.books.title', 'scry.books.year', 'scry.books.author_id']},
+        'SELECT scry.books.id, scry.books.title, scry.books.year, scry.books.author_id FROM scry.books  LIMIT 100',
         {'scry': {((None,), (None,)): {'books': {((('id', 1), ('title', 'Fellowship of the Rings'), ('year', 1954), ('author_id', 1)), (('id', 1),)): {}, ((('id', 2), ('title', 'The Two Towers'), ('year', 1954), ('author_id', 1)), (('id', 2),)): {}, ((('id', 3), ('title', 'Return of the King'), ('year', 1955), ('author_id', 1)), (('id', 3),)): {}, ((('id', 4), ('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997), ('author_id', 2)), (('id', 4),)): {}, ((('id', 5), ('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999), ('author_id', 2)), (('id', 5),)): {}, ((('id', 6), ('title', 'Exhalation'), ('year', 2019), ('author_id', 3)), (('id', 6),)): {}, ((('id', 7), ('title', 'Beowolf'), ('year', 2016), ('author_id', 1)), (('id', 7),)): {}}}}},
         ['- scry.books.id: 1', '  scry.books.title: Fellowship of the Rings', '  scry.books.year: 1954', '  scry.books.author_id: 1', '- scry.books.id: 2', '  scry.books.title: The Two Towers', '  scry.books.year: 1954', '  scry.books.author_id: 1', '- scry.books.id: 3', '  scry.books.title: Return of the King', '  scry.books.year: 1955', '  scry.books.author_id: 1', '- scry.books.id: 4', "  scry.books.title: Harry Potter and the Philosopher's Stone", '  scry.books.year: 1997', '  scry.books.author_id: 2', '- scry.books.id: 5', '  scry.books.title: Harry Potter and the Prisoner of Azkaban', '  scry.books.year: 1999', '  scry.books.author_id: 2', '- scry.books.id: 6', '  scry.books.title: Exhalation', '  scry.books.year: 2019', '  scry.books.author_id: 3', '- scry.books.id: 7', '  scry.books.title: Beowolf', '  scry.books.year: 2016', '  scry.books.author_id: 1']
         ),
@@ -77,8 +91,8 @@ test_instances = [
         'Simple test with implicit star columns',
         'scry.books',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['id', 'title', 'year', 'author_id']}}}},
-        {'selects': [('scry.books.id', 'scry.books.id'), ('scry.books.title', 'scry.books.title'), ('scry.books.year', 'scry.books.year'), ('scry.books.author_id', 'scry.books.author_id')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')]},
-        'SELECT scry.books.id, scry.books.id, scry.books.title, scry.books.year, scry.books.author_id FROM scry.books  LIMIT 100',
+        {'selects': [('scry.books.id', 'scry.books.id'), ('scry.books.title', 'scry.books.title'), ('scry.books.year', 'scry.books.year'), ('scry.books.author_id', 'scry.books.author_id')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': [], 'columns': ['scry.books.id', 'scry.books.title', 'scry.books.year', 'scry.books.author_id']},
+        'SELECT scry.books.id, scry.books.title, scry.books.year, scry.books.author_id FROM scry.books  LIMIT 100',
         {'scry': {((None,), (None,)): {'books': {((('id', 1), ('title', 'Fellowship of the Rings'), ('year', 1954), ('author_id', 1)), (('id', 1),)): {}, ((('id', 2), ('title', 'The Two Towers'), ('year', 1954), ('author_id', 1)), (('id', 2),)): {}, ((('id', 3), ('title', 'Return of the King'), ('year', 1955), ('author_id', 1)), (('id', 3),)): {}, ((('id', 4), ('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997), ('author_id', 2)), (('id', 4),)): {}, ((('id', 5), ('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999), ('author_id', 2)), (('id', 5),)): {}, ((('id', 6), ('title', 'Exhalation'), ('year', 2019), ('author_id', 3)), (('id', 6),)): {}, ((('id', 7), ('title', 'Beowolf'), ('year', 2016), ('author_id', 1)), (('id', 7),)): {}}}}},
         ['- scry.books.id: 1', '  scry.books.title: Fellowship of the Rings', '  scry.books.year: 1954', '  scry.books.author_id: 1', '- scry.books.id: 2', '  scry.books.title: The Two Towers', '  scry.books.year: 1954', '  scry.books.author_id: 1', '- scry.books.id: 3', '  scry.books.title: Return of the King', '  scry.books.year: 1955', '  scry.books.author_id: 1', '- scry.books.id: 4', "  scry.books.title: Harry Potter and the Philosopher's Stone", '  scry.books.year: 1997', '  scry.books.author_id: 2', '- scry.books.id: 5', '  scry.books.title: Harry Potter and the Prisoner of Azkaban', '  scry.books.year: 1999', '  scry.books.author_id: 2', '- scry.books.id: 6', '  scry.books.title: Exhalation', '  scry.books.year: 2019', '  scry.books.author_id: 3', '- scry.books.id: 7', '  scry.books.title: Beowolf', '  scry.books.year: 2016', '  scry.books.author_id: 1']
         ),
@@ -86,43 +100,43 @@ test_instances = [
         'Simple nested table',
         'scry.books.authors.name',
         {'scry': {'children': {'books': {'table': 'books', 'children': {'authors': {'table': 'authors', 'columns': ['name']}}}}}},
-        {'selects': [('scry.authors.name', 'scry.books.authors.name')], 'joins': ['scry.books', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id'), ('scry.authors.id', 'scry.books.authors.id')]},
-        'SELECT scry.books.id, scry.authors.id, scry.authors.name FROM scry.books LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  LIMIT 100',
-        {'scry': {((None,), (None,)): {'books': {((None,), (('id', 1),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((None,), (('id', 2),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((None,), (('id', 3),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((None,), (('id', 4),)): {'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}, ((None,), (('id', 5),)): {'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}, ((None,), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (('id', 3),)): {}}}, ((None,), (('id', 7),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}}}}},
+        {'selects': [('scry.authors.name', 'scry.books.authors.name')], 'joins': ['scry.books', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': ['scry.authors.id'], 'columns': ['scry.books.id', 'scry.authors.name']},
+        'SELECT scry.books.id, scry.authors.name FROM scry.books LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  LIMIT 100',
+        {'scry': {((None,), (None,)): {'books': {((None,), (('id', 1),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((None,), (('id', 2),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((None,), (('id', 3),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((None,), (('id', 4),)): {'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}, ((None,), (('id', 5),)): {'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}, ((None,), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (None,)): {}}}, ((None,), (('id', 7),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}}}}},
         ['- scry.books.authors.name: J.R.R. Tolkien', '- scry.books.authors.name: J.R.R. Tolkien', '- scry.books.authors.name: J.R.R. Tolkien', '- scry.books.authors.name: J.K. Rowling', '- scry.books.authors.name: J.K. Rowling', '- scry.books.authors.name: Ted Chiang', '- scry.books.authors.name: J.R.R. Tolkien']
         ),
     Instance(
         'Simple nested table with field at both levels',
         'scry.books.authors.name scry.books.title',
         {'scry': {'children': {'books': {'table': 'books', 'children': {'authors': {'table': 'authors', 'columns': ['name']}}, 'columns': ['title']}}}},
-        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.authors.name', 'scry.books.authors.name')], 'joins': ['scry.books', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id'), ('scry.authors.id', 'scry.books.authors.id')]},
-        'SELECT scry.books.id, scry.authors.id, scry.books.title, scry.authors.name FROM scry.books LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  LIMIT 100',
-        {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}, ((('title', 'Exhalation'),), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (('id', 3),)): {}}}, ((('title', 'Beowolf'),), (('id', 7),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}}}}},
+        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.authors.name', 'scry.books.authors.name')], 'joins': ['scry.books', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': ['scry.authors.id'], 'columns': ['scry.books.id', 'scry.books.title', 'scry.authors.name']},
+        'SELECT scry.books.id, scry.books.title, scry.authors.name FROM scry.books LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  LIMIT 100',
+        {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}, ((('title', 'Exhalation'),), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (None,)): {}}}, ((('title', 'Beowolf'),), (('id', 7),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}}}}},
         ['- scry.books.title: Fellowship of the Rings', '  - authors.name: J.R.R. Tolkien', '- scry.books.title: The Two Towers', '  - authors.name: J.R.R. Tolkien', '- scry.books.title: Return of the King', '  - authors.name: J.R.R. Tolkien', "- scry.books.title: Harry Potter and the Philosopher's Stone", '  - authors.name: J.K. Rowling', '- scry.books.title: Harry Potter and the Prisoner of Azkaban', '  - authors.name: J.K. Rowling', '- scry.books.title: Exhalation', '  - authors.name: Ted Chiang', '- scry.books.title: Beowolf', '  - authors.name: J.R.R. Tolkien']
         ),
     Instance(
         'Nested table with field at both levels using alias',
         'scry.books.title books.authors.name',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['title'], 'children': {'authors': {'table': 'authors', 'columns': ['name']}}}}}},
-        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.authors.name', 'scry.books.authors.name')], 'joins': ['scry.books', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id'), ('scry.authors.id', 'scry.books.authors.id')]},
-        'SELECT scry.books.id, scry.authors.id, scry.books.title, scry.authors.name FROM scry.books LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  LIMIT 100',
-        {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}, ((('title', 'Exhalation'),), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (('id', 3),)): {}}}, ((('title', 'Beowolf'),), (('id', 7),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}}}}},
+        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.authors.name', 'scry.books.authors.name')], 'joins': ['scry.books', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': ['scry.authors.id'], 'columns': ['scry.books.id', 'scry.books.title', 'scry.authors.name']},
+        'SELECT scry.books.id, scry.books.title, scry.authors.name FROM scry.books LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  LIMIT 100',
+        {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}, ((('title', 'Exhalation'),), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (None,)): {}}}, ((('title', 'Beowolf'),), (('id', 7),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}}}}},
         ['- scry.books.title: Fellowship of the Rings', '  - authors.name: J.R.R. Tolkien', '- scry.books.title: The Two Towers', '  - authors.name: J.R.R. Tolkien', '- scry.books.title: Return of the King', '  - authors.name: J.R.R. Tolkien', "- scry.books.title: Harry Potter and the Philosopher's Stone", '  - authors.name: J.K. Rowling', '- scry.books.title: Harry Potter and the Prisoner of Azkaban', '  - authors.name: J.K. Rowling', '- scry.books.title: Exhalation', '  - authors.name: Ted Chiang', '- scry.books.title: Beowolf', '  - authors.name: J.R.R. Tolkien']
         ),
     Instance(
         'Nested table with field at both levels using alias',
         'scry.books@b.title b.authors.name',
         {'scry': {'children': {'b': {'table': 'books', 'columns': ['title'], 'children': {'authors': {'table': 'authors', 'columns': ['name']}}}}}},
-        {'selects': [('b.title', 'scry.b.title'), ('scry.authors.name', 'scry.b.authors.name')], 'joins': ['scry.books AS b', 'LEFT JOIN scry.authors ON b.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('b.id', 'scry.b.id'), ('scry.authors.id', 'scry.b.authors.id')]},
-        'SELECT b.id, scry.authors.id, b.title, scry.authors.name FROM scry.books AS b LEFT JOIN scry.authors ON b.author_id = scry.authors.id  LIMIT 100',
-        {'scry': {((None,), (None,)): {'b': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}, ((('title', 'Exhalation'),), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (('id', 3),)): {}}}, ((('title', 'Beowolf'),), (('id', 7),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}}}}}}},
+        {'selects': [('b.title', 'scry.b.title'), ('scry.authors.name', 'scry.b.authors.name')], 'joins': ['scry.books AS b', 'LEFT JOIN scry.authors ON b.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('b.id', 'scry.b.id')], 'join_keys': ['scry.authors.id'], 'columns': ['b.id', 'b.title', 'scry.authors.name']},
+        'SELECT b.id, b.title, scry.authors.name FROM scry.books AS b LEFT JOIN scry.authors ON b.author_id = scry.authors.id  LIMIT 100',
+        {'scry': {((None,), (None,)): {'b': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}, ((('title', 'Exhalation'),), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (None,)): {}}}, ((('title', 'Beowolf'),), (('id', 7),)): {'authors': {((('name', 'J.R.R. Tolkien'),), (None,)): {}}}}}}},
         ['- scry.b.title: Fellowship of the Rings', '  - authors.name: J.R.R. Tolkien', '- scry.b.title: The Two Towers', '  - authors.name: J.R.R. Tolkien', '- scry.b.title: Return of the King', '  - authors.name: J.R.R. Tolkien', "- scry.b.title: Harry Potter and the Philosopher's Stone", '  - authors.name: J.K. Rowling', '- scry.b.title: Harry Potter and the Prisoner of Azkaban', '  - authors.name: J.K. Rowling', '- scry.b.title: Exhalation', '  - authors.name: Ted Chiang', '- scry.b.title: Beowolf', '  - authors.name: J.R.R. Tolkien']
         ),
     Instance(
         'simple conditional',
         'scry.books.year books.title = "Fellowship of the Rings"',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['year'], 'conditions': {'conditions': [('title', '=', "'Fellowship of the Rings'")]}}}}},
-        {'selects': [('scry.books.year', 'scry.books.year')], 'joins': ['scry.books'], 'wheres': ["scry.books.title = 'Fellowship of the Rings'"], 'uniques': [('scry.books.id', 'scry.books.id')]},
+        {'selects': [('scry.books.year', 'scry.books.year')], 'joins': ['scry.books'], 'wheres': ["scry.books.title = 'Fellowship of the Rings'"], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': [], 'columns': ['scry.books.id', 'scry.books.year']},
         "SELECT scry.books.id, scry.books.year FROM scry.books  WHERE scry.books.title = 'Fellowship of the Rings' LIMIT 100",
         {'scry': {((None,), (None,)): {'books': {((('year', 1954),), (('id', 1),)): {}}}}},
         ['- scry.books.year: 1954']
@@ -131,7 +145,7 @@ test_instances = [
         'simple conditional using alias',
         'scry.books@b.year b.title = "Fellowship of the Rings"',
         {'scry': {'children': {'b': {'table': 'books', 'columns': ['year'], 'conditions': {'conditions': [('title', '=', "'Fellowship of the Rings'")]}}}}},
-        {'selects': [('b.year', 'scry.b.year')], 'joins': ['scry.books AS b'], 'wheres': ["b.title = 'Fellowship of the Rings'"], 'uniques': [('b.id', 'scry.b.id')]},
+        {'selects': [('b.year', 'scry.b.year')], 'joins': ['scry.books AS b'], 'wheres': ["b.title = 'Fellowship of the Rings'"], 'uniques': [('b.id', 'scry.b.id')], 'join_keys': [], 'columns': ['b.id', 'b.year']},
         "SELECT b.id, b.year FROM scry.books AS b  WHERE b.title = 'Fellowship of the Rings' LIMIT 100",
         {'scry': {((None,), (None,)): {'b': {((('year', 1954),), (('id', 1),)): {}}}}},
         ['- scry.b.year: 1954']
@@ -140,25 +154,25 @@ test_instances = [
         'child conditional with alias',
         'scry.books@b.title,year b.authors.name = "J.R.R. Tolkien"',
         {'scry': {'children': {'b': {'table': 'books', 'columns': ['title', 'year'], 'children': {'authors': {'table': 'authors', 'conditions': {'conditions': [('name', '=', "'J.R.R. Tolkien'")]}}}}}}},
-        {'selects': [('b.title', 'scry.b.title'), ('b.year', 'scry.b.year')], 'joins': ['scry.books AS b', 'LEFT JOIN scry.authors ON b.author_id = scry.authors.id'], 'wheres': ["scry.authors.name = 'J.R.R. Tolkien'"], 'uniques': [('b.id', 'scry.b.id'), ('scry.authors.id', 'scry.b.authors.id')]},
-        "SELECT b.id, scry.authors.id, b.title, b.year FROM scry.books AS b LEFT JOIN scry.authors ON b.author_id = scry.authors.id  WHERE scry.authors.name = 'J.R.R. Tolkien' LIMIT 100",
-        {'scry': {((None,), (None,)): {'b': {((('title', 'Fellowship of the Rings'), ('year', 1954)), (('id', 1),)): {'authors': {((None,), (('id', 1),)): {}}}, ((('title', 'The Two Towers'), ('year', 1954)), (('id', 2),)): {'authors': {((None,), (('id', 1),)): {}}}, ((('title', 'Return of the King'), ('year', 1955)), (('id', 3),)): {'authors': {((None,), (('id', 1),)): {}}}, ((('title', 'Beowolf'), ('year', 2016)), (('id', 7),)): {'authors': {((None,), (('id', 1),)): {}}}}}}},
+        {'selects': [('b.title', 'scry.b.title'), ('b.year', 'scry.b.year')], 'joins': ['scry.books AS b', 'LEFT JOIN scry.authors ON b.author_id = scry.authors.id'], 'wheres': ["scry.authors.name = 'J.R.R. Tolkien'"], 'uniques': [('b.id', 'scry.b.id')], 'join_keys': ['scry.authors.id'], 'columns': ['b.id', 'b.title', 'b.year']},
+        "SELECT b.id, b.title, b.year FROM scry.books AS b LEFT JOIN scry.authors ON b.author_id = scry.authors.id  WHERE scry.authors.name = 'J.R.R. Tolkien' LIMIT 100",
+        {'scry': {((None,), (None,)): {'b': {((('title', 'Fellowship of the Rings'), ('year', 1954)), (('id', 1),)): {}, ((('title', 'The Two Towers'), ('year', 1954)), (('id', 2),)): {}, ((('title', 'Return of the King'), ('year', 1955)), (('id', 3),)): {}, ((('title', 'Beowolf'), ('year', 2016)), (('id', 7),)): {}}}}},
         ['- scry.b.title: Fellowship of the Rings', '  scry.b.year: 1954', '- scry.b.title: The Two Towers', '  scry.b.year: 1954', '- scry.b.title: Return of the King', '  scry.b.year: 1955', '- scry.b.title: Beowolf', '  scry.b.year: 2016']
         ),
     Instance(
         'deep conditional',
         'scry.authors@a.books.title a.books.series_books.series.name = "Lord of the Rings"',
         {'scry': {'children': {'a': {'table': 'authors', 'children': {'books': {'table': 'books', 'columns': ['title'], 'children': {'series_books': {'table': 'series_books', 'children': {'series': {'table': 'series', 'conditions': {'conditions': [('name', '=', "'Lord of the Rings'")]}}}}}}}}}}},
-        {'selects': [('scry.books.title', 'scry.a.books.title')], 'joins': ['scry.authors AS a', 'LEFT JOIN scry.books ON a.id = scry.books.author_id', 'LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id'], 'wheres': ["scry.series.name = 'Lord of the Rings'"], 'uniques': [('a.id', 'scry.a.id'), ('scry.books.id', 'scry.a.books.id'), ('scry.series.id', 'scry.a.books.series_books.series.id')]},
-        "SELECT a.id, scry.books.id, scry.series.id, scry.books.title FROM scry.authors AS a LEFT JOIN scry.books ON a.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id  WHERE scry.series.name = 'Lord of the Rings' LIMIT 100",
-        {'scry': {((None,), (None,)): {'a': {((None,), (('id', 1),)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', 1),)): {}}}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', 1),)): {}}}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', 1),)): {}}}}}}}}}}},
+        {'selects': [('scry.books.title', 'scry.a.books.title')], 'joins': ['scry.authors AS a', 'LEFT JOIN scry.books ON a.id = scry.books.author_id', 'LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id'], 'wheres': ["scry.series.name = 'Lord of the Rings'"], 'uniques': [('a.id', 'scry.a.id'), ('scry.books.id', 'scry.a.books.id')], 'join_keys': ['scry.books.author_id', 'scry.series_books.book_id', 'scry.series.id'], 'columns': ['a.id', 'scry.books.id', 'scry.books.title']},
+        "SELECT a.id, scry.books.id, scry.books.title FROM scry.authors AS a LEFT JOIN scry.books ON a.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id  WHERE scry.series.name = 'Lord of the Rings' LIMIT 100",
+        {'scry': {((None,), (None,)): {'a': {((None,), (('id', 1),)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {}, ((('title', 'The Two Towers'),), (('id', 2),)): {}, ((('title', 'Return of the King'),), (('id', 3),)): {}}}}}}},
         ['- scry.a.books.title: Fellowship of the Rings', '- scry.a.books.title: The Two Towers', '- scry.a.books.title: Return of the King']
         ),
     Instance(
         'deep conditional on prefix',
         'scry.authors.books.title authors:books.series_books.series.name = "Lord of the Rings"',
         {'scry': {'children': {'authors': {'table': 'authors', 'children': {'books': {'table': 'books', 'columns': ['title']}}, 'conditions': {'children': {'books': {'table': 'books', 'children': {'series_books': {'table': 'series_books', 'children': {'series': {'table': 'series', 'conditions': [('name', '=', "'Lord of the Rings'")]}}}}}}}}}}},
-        {'selects': [('scry.books.title', 'scry.authors.books.title')], 'joins': ['scry.authors', 'LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id'], 'wheres': ["authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id WHERE scry.series.name = 'Lord of the Rings')"], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('scry.books.id', 'scry.authors.books.id')]},
+        {'selects': [('scry.books.title', 'scry.authors.books.title')], 'joins': ['scry.authors', 'LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id'], 'wheres': ["authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id WHERE scry.series.name = 'Lord of the Rings')"], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('scry.books.id', 'scry.authors.books.id')], 'join_keys': ['scry.books.author_id'], 'columns': ['scry.authors.id', 'scry.books.id', 'scry.books.title']},
         "SELECT scry.authors.id, scry.books.id, scry.books.title FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id  WHERE authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id WHERE scry.series.name = 'Lord of the Rings') LIMIT 100",
         {'scry': {((None,), (None,)): {'authors': {((None,), (('id', 1),)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {}, ((('title', 'The Two Towers'),), (('id', 2),)): {}, ((('title', 'Return of the King'),), (('id', 3),)): {}, ((('title', 'Beowolf'),), (('id', 7),)): {}}}}}}},
         ['- scry.authors.books.title: Fellowship of the Rings', '- scry.authors.books.title: The Two Towers', '- scry.authors.books.title: Return of the King', '- scry.authors.books.title: Beowolf']
@@ -167,7 +181,7 @@ test_instances = [
         'deep conditional on prefix with alias',
         'scry.authors@a.books.title a:books.series_books.series.name = "Lord of the Rings"',
         {'scry': {'children': {'a': {'table': 'authors', 'children': {'books': {'table': 'books', 'columns': ['title']}}, 'conditions': {'children': {'books': {'table': 'books', 'children': {'series_books': {'table': 'series_books', 'children': {'series': {'table': 'series', 'conditions': [('name', '=', "'Lord of the Rings'")]}}}}}}}}}}},
-        {'selects': [('scry.books.title', 'scry.a.books.title')], 'joins': ['scry.authors AS a', 'LEFT JOIN scry.books ON a.id = scry.books.author_id'], 'wheres': ["a.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON a.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id WHERE scry.series.name = 'Lord of the Rings')"], 'uniques': [('a.id', 'scry.a.id'), ('scry.books.id', 'scry.a.books.id')]},
+        {'selects': [('scry.books.title', 'scry.a.books.title')], 'joins': ['scry.authors AS a', 'LEFT JOIN scry.books ON a.id = scry.books.author_id'], 'wheres': ["a.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON a.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id WHERE scry.series.name = 'Lord of the Rings')"], 'uniques': [('a.id', 'scry.a.id'), ('scry.books.id', 'scry.a.books.id')], 'join_keys': ['scry.books.author_id'], 'columns': ['a.id', 'scry.books.id', 'scry.books.title']},
         "SELECT a.id, scry.books.id, scry.books.title FROM scry.authors AS a LEFT JOIN scry.books ON a.id = scry.books.author_id  WHERE a.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON a.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id WHERE scry.series.name = 'Lord of the Rings') LIMIT 100",
         {'scry': {((None,), (None,)): {'a': {((None,), (('id', 1),)): {'books': {((('title', 'Beowolf'),), (('id', 7),)): {}, ((('title', 'Return of the King'),), (('id', 3),)): {}, ((('title', 'The Two Towers'),), (('id', 2),)): {}, ((('title', 'Fellowship of the Rings'),), (('id', 1),)): {}}}}}}},
         ['- scry.a.books.title: Beowolf', '- scry.a.books.title: Return of the King', '- scry.a.books.title: The Two Towers', '- scry.a.books.title: Fellowship of the Rings']
@@ -176,7 +190,7 @@ test_instances = [
         'Terminator to select no fields',
         'scry.authors@a., a.name',
         {'scry': {'children': {'a': {'table': 'authors', 'columns': ['name']}}}},
-        {'selects': [('a.name', 'scry.a.name')], 'joins': ['scry.authors AS a'], 'wheres': [], 'uniques': [('a.id', 'scry.a.id')]},
+        {'selects': [('a.name', 'scry.a.name')], 'joins': ['scry.authors AS a'], 'wheres': [], 'uniques': [('a.id', 'scry.a.id')], 'join_keys': [], 'columns': ['a.id', 'a.name']},
         'SELECT a.id, a.name FROM scry.authors AS a  LIMIT 100',
         {'scry': {((None,), (None,)): {'a': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}, ((('name', 'J.K. Rowling'),), (('id', 2),)): {}, ((('name', 'Ted Chiang'),), (('id', 3),)): {}}}}},
         ['- scry.a.name: J.R.R. Tolkien', '- scry.a.name: J.K. Rowling', '- scry.a.name: Ted Chiang']
@@ -185,7 +199,7 @@ test_instances = [
         'Terminator to select no fields without schema',
         'authors@a., a.name',
         {'scry': {'children': {'a': {'table': 'authors', 'columns': ['name']}}}},
-        {'selects': [('a.name', 'scry.a.name')], 'joins': ['scry.authors AS a'], 'wheres': [], 'uniques': [('a.id', 'scry.a.id')]},
+        {'selects': [('a.name', 'scry.a.name')], 'joins': ['scry.authors AS a'], 'wheres': [], 'uniques': [('a.id', 'scry.a.id')], 'join_keys': [], 'columns': ['a.id', 'a.name']},
         'SELECT a.id, a.name FROM scry.authors AS a  LIMIT 100',
         {'scry': {((None,), (None,)): {'a': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}, ((('name', 'J.K. Rowling'),), (('id', 2),)): {}, ((('name', 'Ted Chiang'),), (('id', 3),)): {}}}}},
         ['- scry.a.name: J.R.R. Tolkien', '- scry.a.name: J.K. Rowling', '- scry.a.name: Ted Chiang']
@@ -194,7 +208,7 @@ test_instances = [
         'simple conditional without schema',
         'books.year books.title = "Fellowship of the Rings"',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['year'], 'conditions': {'conditions': [('title', '=', "'Fellowship of the Rings'")]}}}}},
-        {'selects': [('scry.books.year', 'scry.books.year')], 'joins': ['scry.books'], 'wheres': ["scry.books.title = 'Fellowship of the Rings'"], 'uniques': [('scry.books.id', 'scry.books.id')]},
+        {'selects': [('scry.books.year', 'scry.books.year')], 'joins': ['scry.books'], 'wheres': ["scry.books.title = 'Fellowship of the Rings'"], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': [], 'columns': ['scry.books.id', 'scry.books.year']},
         "SELECT scry.books.id, scry.books.year FROM scry.books  WHERE scry.books.title = 'Fellowship of the Rings' LIMIT 100",
         {'scry': {((None,), (None,)): {'books': {((('year', 1954),), (('id', 1),)): {}}}}},
         ['- scry.books.year: 1954']
@@ -203,7 +217,7 @@ test_instances = [
         'meta-test of information_schema table',
         'columns.column_name columns.table_name="columns"',
         {'information_schema': {'children': {'columns': {'table': 'columns', 'columns': ['column_name'], 'conditions': {'conditions': [('table_name', '=', "'columns'")]}}}}},
-        {'selects': [('information_schema.columns.column_name', 'information_schema.columns.column_name')], 'joins': ['information_schema.columns'], 'wheres': ["information_schema.columns.table_name = 'columns'"], 'uniques': []},
+        {'selects': [('information_schema.columns.column_name', 'information_schema.columns.column_name')], 'joins': ['information_schema.columns'], 'wheres': ["information_schema.columns.table_name = 'columns'"], 'uniques': [], 'join_keys': [], 'columns': ['information_schema.columns.column_name']},
         "SELECT information_schema.columns.column_name FROM information_schema.columns  WHERE information_schema.columns.table_name = 'columns' LIMIT 100",
         {'information_schema': {((None,), (None,)): {'columns': {((('column_name', 'table_catalog'),), (None,)): {}, ((('column_name', 'table_schema'),), (None,)): {}, ((('column_name', 'table_name'),), (None,)): {}, ((('column_name', 'column_name'),), (None,)): {}, ((('column_name', 'ordinal_position'),), (None,)): {}, ((('column_name', 'column_default'),), (None,)): {}, ((('column_name', 'is_nullable'),), (None,)): {}, ((('column_name', 'data_type'),), (None,)): {}, ((('column_name', 'character_maximum_length'),), (None,)): {}, ((('column_name', 'character_octet_length'),), (None,)): {}, ((('column_name', 'numeric_precision'),), (None,)): {}, ((('column_name', 'numeric_precision_radix'),), (None,)): {}, ((('column_name', 'numeric_scale'),), (None,)): {}, ((('column_name', 'datetime_precision'),), (None,)): {}, ((('column_name', 'interval_type'),), (None,)): {}, ((('column_name', 'interval_precision'),), (None,)): {}, ((('column_name', 'character_set_catalog'),), (None,)): {}, ((('column_name', 'character_set_schema'),), (None,)): {}, ((('column_name', 'character_set_name'),), (None,)): {}, ((('column_name', 'collation_catalog'),), (None,)): {}, ((('column_name', 'collation_schema'),), (None,)): {}, ((('column_name', 'collation_name'),), (None,)): {}, ((('column_name', 'domain_catalog'),), (None,)): {}, ((('column_name', 'domain_schema'),), (None,)): {}, ((('column_name', 'domain_name'),), (None,)): {}, ((('column_name', 'udt_catalog'),), (None,)): {}, ((('column_name', 'udt_schema'),), (None,)): {}, ((('column_name', 'udt_name'),), (None,)): {}, ((('column_name', 'scope_catalog'),), (None,)): {}, ((('column_name', 'scope_schema'),), (None,)): {}, ((('column_name', 'scope_name'),), (None,)): {}, ((('column_name', 'maximum_cardinality'),), (None,)): {}, ((('column_name', 'dtd_identifier'),), (None,)): {}, ((('column_name', 'is_self_referencing'),), (None,)): {}, ((('column_name', 'is_identity'),), (None,)): {}, ((('column_name', 'identity_generation'),), (None,)): {}, ((('column_name', 'identity_start'),), (None,)): {}, ((('column_name', 'identity_increment'),), (None,)): {}, ((('column_name', 'identity_maximum'),), (None,)): {}, ((('column_name', 'identity_minimum'),), (None,)): {}, ((('column_name', 'identity_cycle'),), (None,)): {}, ((('column_name', 'is_generated'),), (None,)): {}, ((('column_name', 'generation_expression'),), (None,)): {}, ((('column_name', 'is_updatable'),), (None,)): {}}}}},
         ['- information_schema.columns.column_name: table_catalog', '- information_schema.columns.column_name: table_schema', '- information_schema.columns.column_name: table_name', '- information_schema.columns.column_name: column_name', '- information_schema.columns.column_name: ordinal_position', '- information_schema.columns.column_name: column_default', '- information_schema.columns.column_name: is_nullable', '- information_schema.columns.column_name: data_type', '- information_schema.columns.column_name: character_maximum_length', '- information_schema.columns.column_name: character_octet_length', '- information_schema.columns.column_name: numeric_precision', '- information_schema.columns.column_name: numeric_precision_radix', '- information_schema.columns.column_name: numeric_scale', '- information_schema.columns.column_name: datetime_precision', '- information_schema.columns.column_name: interval_type', '- information_schema.columns.column_name: interval_precision', '- information_schema.columns.column_name: character_set_catalog', '- information_schema.columns.column_name: character_set_schema', '- information_schema.columns.column_name: character_set_name', '- information_schema.columns.column_name: collation_catalog', '- information_schema.columns.column_name: collation_schema', '- information_schema.columns.column_name: collation_name', '- information_schema.columns.column_name: domain_catalog', '- information_schema.columns.column_name: domain_schema', '- information_schema.columns.column_name: domain_name', '- information_schema.columns.column_name: udt_catalog', '- information_schema.columns.column_name: udt_schema', '- information_schema.columns.column_name: udt_name', '- information_schema.columns.column_name: scope_catalog', '- information_schema.columns.column_name: scope_schema', '- information_schema.columns.column_name: scope_name', '- information_schema.columns.column_name: maximum_cardinality', '- information_schema.columns.column_name: dtd_identifier', '- information_schema.columns.column_name: is_self_referencing', '- information_schema.columns.column_name: is_identity', '- information_schema.columns.column_name: identity_generation', '- information_schema.columns.column_name: identity_start', '- information_schema.columns.column_name: identity_increment', '- information_schema.columns.column_name: identity_maximum', '- information_schema.columns.column_name: identity_minimum', '- information_schema.columns.column_name: identity_cycle', '- information_schema.columns.column_name: is_generated', '- information_schema.columns.column_name: generation_expression', '- information_schema.columns.column_name: is_updatable']
@@ -212,7 +226,7 @@ test_instances = [
         'test referencing a table in the tree',
         'authors.books.title books.year',
         {'scry': {'children': {'authors': {'table': 'authors', 'children': {'books': {'table': 'books', 'columns': ['title', 'year']}}}}}},
-        {'selects': [('scry.books.title', 'scry.authors.books.title'), ('scry.books.year', 'scry.authors.books.year')], 'joins': ['scry.authors', 'LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('scry.books.id', 'scry.authors.books.id')]},
+        {'selects': [('scry.books.title', 'scry.authors.books.title'), ('scry.books.year', 'scry.authors.books.year')], 'joins': ['scry.authors', 'LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('scry.books.id', 'scry.authors.books.id')], 'join_keys': ['scry.books.author_id'], 'columns': ['scry.authors.id', 'scry.books.id', 'scry.books.title', 'scry.books.year']},
         'SELECT scry.authors.id, scry.books.id, scry.books.title, scry.books.year FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id  LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((None,), (('id', 1),)): {'books': {((('title', 'Fellowship of the Rings'), ('year', 1954)), (('id', 1),)): {}, ((('title', 'The Two Towers'), ('year', 1954)), (('id', 2),)): {}, ((('title', 'Return of the King'), ('year', 1955)), (('id', 3),)): {}, ((('title', 'Beowolf'), ('year', 2016)), (('id', 7),)): {}}}, ((None,), (('id', 2),)): {'books': {((('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997)), (('id', 4),)): {}, ((('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999)), (('id', 5),)): {}}}, ((None,), (('id', 3),)): {'books': {((('title', 'Exhalation'), ('year', 2019)), (('id', 6),)): {}}}}}}},
         ['- scry.authors.books.title: Fellowship of the Rings', '  scry.authors.books.year: 1954', '- scry.authors.books.title: The Two Towers', '  scry.authors.books.year: 1954', '- scry.authors.books.title: Return of the King', '  scry.authors.books.year: 1955', '- scry.authors.books.title: Beowolf', '  scry.authors.books.year: 2016', "- scry.authors.books.title: Harry Potter and the Philosopher's Stone", '  scry.authors.books.year: 1997', '- scry.authors.books.title: Harry Potter and the Prisoner of Azkaban', '  scry.authors.books.year: 1999', '- scry.authors.books.title: Exhalation', '  scry.authors.books.year: 2019']
@@ -221,110 +235,155 @@ test_instances = [
         'test deep referencing a table in the tree',
         'users.favorites.books.series_books.series.name books.authors.name',
         {'scry': {'children': {'users': {'table': 'users', 'children': {'favorites': {'table': 'favorites', 'children': {'books': {'table': 'books', 'children': {'series_books': {'table': 'series_books', 'children': {'series': {'table': 'series', 'columns': ['name']}}}, 'authors': {'table': 'authors', 'columns': ['name']}}}}}}}}}},
-        {'selects': [('scry.series.name', 'scry.users.favorites.books.series_books.series.name'), ('scry.authors.name', 'scry.users.favorites.books.authors.name')], 'joins': ['scry.users', 'LEFT JOIN scry.favorites ON scry.users.id = scry.favorites.user_id', 'LEFT JOIN scry.books ON scry.favorites.book_id = scry.books.id', 'LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('scry.users.id', 'scry.users.id'), ('scry.favorites.user_id', 'scry.users.favorites.user_id'), ('scry.favorites.book_id', 'scry.users.favorites.book_id'), ('scry.books.id', 'scry.users.favorites.books.id'), ('scry.series.id', 'scry.users.favorites.books.series_books.series.id'), ('scry.authors.id', 'scry.users.favorites.books.authors.id')]},
-        'SELECT scry.users.id, scry.favorites.user_id, scry.favorites.book_id, scry.books.id, scry.series.id, scry.authors.id, scry.series.name, scry.authors.name FROM scry.users LEFT JOIN scry.favorites ON scry.users.id = scry.favorites.user_id LEFT JOIN scry.books ON scry.favorites.book_id = scry.books.id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  LIMIT 100',
-        {'scry': {((None,), (None,)): {'users': {((None,), (('id', 2),)): {'favorites': {((None,), (('user_id', 2), ('book_id', 4))): {'books': {((None,), (('id', 4),)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (('id', 2),)): {}}}}, 'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}}}, ((None,), (('user_id', 2), ('book_id', 6))): {'books': {((None,), (('id', 6),)): {'series_books': {((None,), (None,)): {}}, 'authors': {((('name', 'Ted Chiang'),), (('id', 3),)): {}}}}}}}, ((None,), (('id', 1),)): {'favorites': {((None,), (('user_id', 1), ('book_id', 4))): {'books': {((None,), (('id', 4),)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (('id', 2),)): {}}}}, 'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}}}, ((None,), (('user_id', 1), ('book_id', 5))): {'books': {((None,), (('id', 5),)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (('id', 2),)): {}}}}, 'authors': {((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}}}}}, ((None,), (('id', 3),)): {'favorites': {((None,), (('user_id', None), ('book_id', None))): {'books': {((None,), (('id', None),)): {'series_books': {((None,), (None,)): {}}}}}}}}}}},
+        {'selects': [('scry.series.name', 'scry.users.favorites.books.series_books.series.name'), ('scry.authors.name', 'scry.users.favorites.books.authors.name')], 'joins': ['scry.users', 'LEFT JOIN scry.favorites ON scry.users.id = scry.favorites.user_id', 'LEFT JOIN scry.books ON scry.favorites.book_id = scry.books.id', 'LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': [], 'uniques': [('scry.users.id', 'scry.users.id'), ('scry.favorites.book_id', 'scry.users.favorites.book_id')], 'join_keys': ['scry.favorites.user_id', 'scry.books.id', 'scry.series_books.book_id', 'scry.series.id', 'scry.authors.id'], 'columns': ['scry.users.id', 'scry.favorites.book_id', 'scry.series.name', 'scry.authors.name']},
+        'SELECT scry.users.id, scry.favorites.book_id, scry.series.name, scry.authors.name FROM scry.users LEFT JOIN scry.favorites ON scry.users.id = scry.favorites.user_id LEFT JOIN scry.books ON scry.favorites.book_id = scry.books.id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  LIMIT 100',
+        {'scry': {((None,), (None,)): {'users': {((None,), (('id', 2),)): {'favorites': {((None,), (('book_id', 4),)): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (None,)): {}}}}, 'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}}}, ((None,), (('book_id', 6),)): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {}}, 'authors': {((('name', 'Ted Chiang'),), (None,)): {}}}}}}}, ((None,), (('id', 1),)): {'favorites': {((None,), (('book_id', 4),)): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (None,)): {}}}}, 'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}}}, ((None,), (('book_id', 5),)): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (None,)): {}}}}, 'authors': {((('name', 'J.K. Rowling'),), (None,)): {}}}}}}}, ((None,), (('id', 3),)): {'favorites': {((None,), (('book_id', None),)): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {}}}}}}}}}}},
         ['- scry.users.favorites.books.series_books.series.name: Harry Potter', '- scry.users.favorites.books.authors.name: J.K. Rowling', '- scry.users.favorites.books.authors.name: Ted Chiang', '- scry.users.favorites.books.series_books.series.name: Harry Potter', '- scry.users.favorites.books.authors.name: J.K. Rowling', '- scry.users.favorites.books.series_books.series.name: Harry Potter', '- scry.users.favorites.books.authors.name: J.K. Rowling']
         ),
     Instance(
         'test referencing a table in the tree by alias',
         'authors.books@b.title b.year',
         {'scry': {'children': {'authors': {'table': 'authors', 'children': {'b': {'table': 'books', 'columns': ['title', 'year']}}}}}},
-        {'selects': [('b.title', 'scry.authors.books.title'), ('b.year', 'scry.authors.books.year')], 'joins': ['scry.authors', 'LEFT JOIN scry.books AS b ON scry.authors.id = b.author_id'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('b.id', 'scry.authors.books.id')]},
+        {'selects': [('b.title', 'scry.authors.books.title'), ('b.year', 'scry.authors.books.year')], 'joins': ['scry.authors', 'LEFT JOIN scry.books AS b ON scry.authors.id = b.author_id'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('b.id', 'scry.authors.books.id')], 'join_keys': ['b.author_id'], 'columns': ['scry.authors.id', 'b.id', 'b.title', 'b.year']},
         'SELECT scry.authors.id, b.id, b.title, b.year FROM scry.authors LEFT JOIN scry.books AS b ON scry.authors.id = b.author_id  LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((None,), (('id', 1),)): {'books': {((('title', 'Fellowship of the Rings'), ('year', 1954)), (('id', 1),)): {}, ((('title', 'The Two Towers'), ('year', 1954)), (('id', 2),)): {}, ((('title', 'Return of the King'), ('year', 1955)), (('id', 3),)): {}, ((('title', 'Beowolf'), ('year', 2016)), (('id', 7),)): {}}}, ((None,), (('id', 2),)): {'books': {((('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997)), (('id', 4),)): {}, ((('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999)), (('id', 5),)): {}}}, ((None,), (('id', 3),)): {'books': {((('title', 'Exhalation'), ('year', 2019)), (('id', 6),)): {}}}}}}},
         ['- scry.authors.books.title: Fellowship of the Rings', '  scry.authors.books.year: 1954', '- scry.authors.books.title: The Two Towers', '  scry.authors.books.year: 1954', '- scry.authors.books.title: Return of the King', '  scry.authors.books.year: 1955', '- scry.authors.books.title: Beowolf', '  scry.authors.books.year: 2016', "- scry.authors.books.title: Harry Potter and the Philosopher's Stone", '  scry.authors.books.year: 1997', '- scry.authors.books.title: Harry Potter and the Prisoner of Azkaban', '  scry.authors.books.year: 1999', '- scry.authors.books.title: Exhalation', '  scry.authors.books.year: 2019']
         ),
-   Instance(
+    Instance(
         'condition on a NULL field',
         'books.title books.series_books.series.name = NULL',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['title'], 'children': {'series_books': {'table': 'series_books', 'children': {'series': {'table': 'series', 'conditions': {'conditions': [('name', '=', 'NULL')]}}}}}}}}},
-        {'selects': [('scry.books.title', 'scry.books.title')], 'joins': ['scry.books', 'LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id'], 'wheres': ['scry.series.name IS NULL'], 'uniques': [('scry.books.id', 'scry.books.id'), ('scry.series.id', 'scry.books.series_books.series.id')]},
-        'SELECT scry.books.id, scry.series.id, scry.books.title FROM scry.books LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id  WHERE scry.series.name IS NULL LIMIT 100',
-        {'scry': {((None,), (None,)): {'books': {((('title', 'Exhalation'),), (('id', 6),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', None),)): {}}}}}, ((('title', 'Beowolf'),), (('id', 7),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', None),)): {}}}}}}}}},
+        {'selects': [('scry.books.title', 'scry.books.title')], 'joins': ['scry.books', 'LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id'], 'wheres': ['scry.series.name IS NULL'], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': ['scry.series_books.book_id', 'scry.series.id'], 'columns': ['scry.books.id', 'scry.books.title']},
+        'SELECT scry.books.id, scry.books.title FROM scry.books LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id  WHERE scry.series.name IS NULL LIMIT 100',
+        {'scry': {((None,), (None,)): {'books': {((('title', 'Exhalation'),), (('id', 6),)): {}, ((('title', 'Beowolf'),), (('id', 7),)): {}}}}},
         ['- scry.books.title: Exhalation', '- scry.books.title: Beowolf']
         ),
-   Instance(
+    Instance(
         'condition on a a not NULL field',
         'books.title books.series_books.series.name <> NULL',
         {'scry': {'children': {'books': {'table': 'books', 'columns': ['title'], 'children': {'series_books': {'table': 'series_books', 'children': {'series': {'table': 'series', 'conditions': {'conditions': [('name', '<>', 'NULL')]}}}}}}}}},
-        {'selects': [('scry.books.title', 'scry.books.title')], 'joins': ['scry.books', 'LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id'], 'wheres': ['scry.series.name IS NOT NULL'], 'uniques': [('scry.books.id', 'scry.books.id'), ('scry.series.id', 'scry.books.series_books.series.id')]},
-        'SELECT scry.books.id, scry.series.id, scry.books.title FROM scry.books LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id  WHERE scry.series.name IS NOT NULL LIMIT 100',
-        {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', 1),)): {}}}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', 1),)): {}}}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', 1),)): {}}}}}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', 2),)): {}}}}}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {'series_books': {((None,), (None,)): {'series': {((None,), (('id', 2),)): {}}}}}}}}},
+        {'selects': [('scry.books.title', 'scry.books.title')], 'joins': ['scry.books', 'LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id'], 'wheres': ['scry.series.name IS NOT NULL'], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': ['scry.series_books.book_id', 'scry.series.id'], 'columns': ['scry.books.id', 'scry.books.title']},
+        'SELECT scry.books.id, scry.books.title FROM scry.books LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id  WHERE scry.series.name IS NOT NULL LIMIT 100',
+        {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {}, ((('title', 'The Two Towers'),), (('id', 2),)): {}, ((('title', 'Return of the King'),), (('id', 3),)): {}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {}}}}},
         ['- scry.books.title: Fellowship of the Rings', '- scry.books.title: The Two Towers', '- scry.books.title: Return of the King', "- scry.books.title: Harry Potter and the Philosopher's Stone", '- scry.books.title: Harry Potter and the Prisoner of Azkaban']
         ),
-   Instance(
+    Instance(
         'deep condition on a NULL field',
         'authors.name authors:books.series_books.series_id = NULL',
         {'scry': {'children': {'authors': {'table': 'authors', 'columns': ['name'], 'conditions': {'children': {'books': {'table': 'books', 'children': {'series_books': {'table': 'series_books', 'conditions': [('series_id', '=', 'NULL')]}}}}}}}}},
-        {'selects': [('scry.authors.name', 'scry.authors.name')], 'joins': ['scry.authors'], 'wheres': ['authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NULL)'], 'uniques': [('scry.authors.id', 'scry.authors.id')]},
+        {'selects': [('scry.authors.name', 'scry.authors.name')], 'joins': ['scry.authors'], 'wheres': ['authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NULL)'], 'uniques': [('scry.authors.id', 'scry.authors.id')], 'join_keys': [], 'columns': ['scry.authors.id', 'scry.authors.name']},
         'SELECT scry.authors.id, scry.authors.name FROM scry.authors  WHERE authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NULL) LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}, ((('name', 'Ted Chiang'),), (('id', 3),)): {}}}}},
         ['- scry.authors.name: J.R.R. Tolkien', '- scry.authors.name: Ted Chiang']
         ),
-   Instance(
+    Instance(
         'deep condition on a not NULL field',
         'authors.name authors:books.series_books.series_id <> NULL',
         {'scry': {'children': {'authors': {'table': 'authors', 'columns': ['name'], 'conditions': {'children': {'books': {'table': 'books', 'children': {'series_books': {'table': 'series_books', 'conditions': [('series_id', '<>', 'NULL')]}}}}}}}}},
-        {'selects': [('scry.authors.name', 'scry.authors.name')], 'joins': ['scry.authors'], 'wheres': ['authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NOT NULL)'], 'uniques': [('scry.authors.id', 'scry.authors.id')]},
+        {'selects': [('scry.authors.name', 'scry.authors.name')], 'joins': ['scry.authors'], 'wheres': ['authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NOT NULL)'], 'uniques': [('scry.authors.id', 'scry.authors.id')], 'join_keys': [], 'columns': ['scry.authors.id', 'scry.authors.name']},
         'SELECT scry.authors.id, scry.authors.name FROM scry.authors  WHERE authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NOT NULL) LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}, ((('name', 'J.K. Rowling'),), (('id', 2),)): {}}}}},
         ['- scry.authors.name: J.R.R. Tolkien', '- scry.authors.name: J.K. Rowling']
         ),
-   Instance(
+    Instance(
         'deep condition on a NULL field',
         'authors.name authors:books.series_books.series_id = NULL',
         {'scry': {'children': {'authors': {'table': 'authors', 'columns': ['name'], 'conditions': {'children': {'books': {'table': 'books', 'children': {'series_books': {'table': 'series_books', 'conditions': [('series_id', '=', 'NULL')]}}}}}}}}},
-        {'selects': [('scry.authors.name', 'scry.authors.name')], 'joins': ['scry.authors'], 'wheres': ['authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NULL)'], 'uniques': [('scry.authors.id', 'scry.authors.id')]},
+        {'selects': [('scry.authors.name', 'scry.authors.name')], 'joins': ['scry.authors'], 'wheres': ['authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NULL)'], 'uniques': [('scry.authors.id', 'scry.authors.id')], 'join_keys': [], 'columns': ['scry.authors.id', 'scry.authors.name']},
         'SELECT scry.authors.id, scry.authors.name FROM scry.authors  WHERE authors.id IN (SELECT scry.authors.id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id LEFT JOIN scry.series_books ON scry.books.id = scry.series_books.book_id WHERE scry.series_books.series_id IS NULL) LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {}, ((('name', 'Ted Chiang'),), (('id', 3),)): {}}}}},
         ['- scry.authors.name: J.R.R. Tolkien', '- scry.authors.name: Ted Chiang']
         ),
-   Instance(
+    Instance(
         'regression test for simple chain with trailing table',
         'scry.authors.books',
         {'scry': {'children': {'authors': {'table': 'authors', 'children': {'books': {'table': 'books', 'columns': ['id', 'title', 'year', 'author_id']}}}}}},
-        {'selects': [('scry.books.id', 'scry.authors.books.id'), ('scry.books.title', 'scry.authors.books.title'), ('scry.books.year', 'scry.authors.books.year'), ('scry.books.author_id', 'scry.authors.books.author_id')], 'joins': ['scry.authors', 'LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('scry.books.id', 'scry.authors.books.id')]},
-        'SELECT scry.authors.id, scry.books.id, scry.books.id, scry.books.title, scry.books.year, scry.books.author_id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id  LIMIT 100',
+        {'selects': [('scry.books.id', 'scry.authors.books.id'), ('scry.books.title', 'scry.authors.books.title'), ('scry.books.year', 'scry.authors.books.year'), ('scry.books.author_id', 'scry.authors.books.author_id')], 'joins': ['scry.authors', 'LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('scry.books.id', 'scry.authors.books.id')], 'join_keys': ['scry.books.author_id'], 'columns': ['scry.authors.id', 'scry.books.id', 'scry.books.title', 'scry.books.year', 'scry.books.author_id']},
+        'SELECT scry.authors.id, scry.books.id, scry.books.title, scry.books.year, scry.books.author_id FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id  LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((None,), (('id', 1),)): {'books': {((('id', 1), ('title', 'Fellowship of the Rings'), ('year', 1954), ('author_id', 1)), (('id', 1),)): {}, ((('id', 2), ('title', 'The Two Towers'), ('year', 1954), ('author_id', 1)), (('id', 2),)): {}, ((('id', 3), ('title', 'Return of the King'), ('year', 1955), ('author_id', 1)), (('id', 3),)): {}, ((('id', 7), ('title', 'Beowolf'), ('year', 2016), ('author_id', 1)), (('id', 7),)): {}}}, ((None,), (('id', 2),)): {'books': {((('id', 4), ('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997), ('author_id', 2)), (('id', 4),)): {}, ((('id', 5), ('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999), ('author_id', 2)), (('id', 5),)): {}}}, ((None,), (('id', 3),)): {'books': {((('id', 6), ('title', 'Exhalation'), ('year', 2019), ('author_id', 3)), (('id', 6),)): {}}}}}}},
         ['- scry.authors.books.id: 1', '  scry.authors.books.title: Fellowship of the Rings', '  scry.authors.books.year: 1954', '  scry.authors.books.author_id: 1', '- scry.authors.books.id: 2', '  scry.authors.books.title: The Two Towers', '  scry.authors.books.year: 1954', '  scry.authors.books.author_id: 1', '- scry.authors.books.id: 3', '  scry.authors.books.title: Return of the King', '  scry.authors.books.year: 1955', '  scry.authors.books.author_id: 1', '- scry.authors.books.id: 7', '  scry.authors.books.title: Beowolf', '  scry.authors.books.year: 2016', '  scry.authors.books.author_id: 1', '- scry.authors.books.id: 4', "  scry.authors.books.title: Harry Potter and the Philosopher's Stone", '  scry.authors.books.year: 1997', '  scry.authors.books.author_id: 2', '- scry.authors.books.id: 5', '  scry.authors.books.title: Harry Potter and the Prisoner of Azkaban', '  scry.authors.books.year: 1999', '  scry.authors.books.author_id: 2', '- scry.authors.books.id: 6', '  scry.authors.books.title: Exhalation', '  scry.authors.books.year: 2019', '  scry.authors.books.author_id: 3']
         ),
-   Instance(
+    Instance(
         'regression test for query and condition on subtalbe',
         'books.authors.name authors.name = "Ted Chiang"',
         {'scry': {'children': {'books': {'table': 'books', 'children': {'authors': {'table': 'authors', 'columns': ['name'], 'conditions': {'conditions': [('name', '=', "'Ted Chiang'")]}}}}}}},
-        {'selects': [('scry.authors.name', 'scry.books.authors.name')], 'joins': ['scry.books', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': ["scry.authors.name = 'Ted Chiang'"], 'uniques': [('scry.books.id', 'scry.books.id'), ('scry.authors.id', 'scry.books.authors.id')]},
-        "SELECT scry.books.id, scry.authors.id, scry.authors.name FROM scry.books LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  WHERE scry.authors.name = 'Ted Chiang' LIMIT 100",
-        {'scry': {((None,), (None,)): {'books': {((None,), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (('id', 3),)): {}}}}}}},
+        {'selects': [('scry.authors.name', 'scry.books.authors.name')], 'joins': ['scry.books', 'LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id'], 'wheres': ["scry.authors.name = 'Ted Chiang'"], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': ['scry.authors.id'], 'columns': ['scry.books.id', 'scry.authors.name']},
+        "SELECT scry.books.id, scry.authors.name FROM scry.books LEFT JOIN scry.authors ON scry.books.author_id = scry.authors.id  WHERE scry.authors.name = 'Ted Chiang' LIMIT 100",
+        {'scry': {((None,), (None,)): {'books': {((None,), (('id', 6),)): {'authors': {((('name', 'Ted Chiang'),), (None,)): {}}}}}}},
         ['- scry.books.authors.name: Ted Chiang']
         ),
-   Instance(
+    Instance(
         'alias used before declaration',
         'b.year books@b.title',
         {'scry': {'children': {'b': {'table': 'books', 'columns': ['year', 'title']}}}},
-        {'selects': [('b.year', 'scry.b.year'), ('b.title', 'scry.b.title')], 'joins': ['scry.books AS b'], 'wheres': [], 'uniques': [('b.id', 'scry.b.id')]},
+        {'selects': [('b.year', 'scry.b.year'), ('b.title', 'scry.b.title')], 'joins': ['scry.books AS b'], 'wheres': [], 'uniques': [('b.id', 'scry.b.id')], 'join_keys': [], 'columns': ['b.id', 'b.year', 'b.title']},
         'SELECT b.id, b.year, b.title FROM scry.books AS b  LIMIT 100',
         {'scry': {((None,), (None,)): {'b': {((('year', 1954), ('title', 'Fellowship of the Rings')), (('id', 1),)): {}, ((('year', 1954), ('title', 'The Two Towers')), (('id', 2),)): {}, ((('year', 1955), ('title', 'Return of the King')), (('id', 3),)): {}, ((('year', 1997), ('title', "Harry Potter and the Philosopher's Stone")), (('id', 4),)): {}, ((('year', 1999), ('title', 'Harry Potter and the Prisoner of Azkaban')), (('id', 5),)): {}, ((('year', 2019), ('title', 'Exhalation')), (('id', 6),)): {}, ((('year', 2016), ('title', 'Beowolf')), (('id', 7),)): {}}}}},
         ['- scry.b.year: 1954', '  scry.b.title: Fellowship of the Rings', '- scry.b.year: 1954', '  scry.b.title: The Two Towers', '- scry.b.year: 1955', '  scry.b.title: Return of the King', '- scry.b.year: 1997', "  scry.b.title: Harry Potter and the Philosopher's Stone", '- scry.b.year: 1999', '  scry.b.title: Harry Potter and the Prisoner of Azkaban', '- scry.b.year: 2019', '  scry.b.title: Exhalation', '- scry.b.year: 2016', '  scry.b.title: Beowolf']
         ),
-   Instance(
+    Instance(
         'alias used in a correct full path',
         'authors.books@b.title authors.b.year',
         {'scry': {'children': {'authors': {'table': 'authors', 'children': {'b': {'table': 'books', 'columns': ['title', 'year']}}}}}},
-        {'selects': [('b.title', 'scry.authors.books.title'), ('b.year', 'scry.authors.books.year')], 'joins': ['scry.authors', 'LEFT JOIN scry.books AS b ON scry.authors.id = b.author_id'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('b.id', 'scry.authors.books.id')]},
+        {'selects': [('b.title', 'scry.authors.books.title'), ('b.year', 'scry.authors.books.year')], 'joins': ['scry.authors', 'LEFT JOIN scry.books AS b ON scry.authors.id = b.author_id'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id'), ('b.id', 'scry.authors.books.id')], 'join_keys': ['b.author_id'], 'columns': ['scry.authors.id', 'b.id', 'b.title', 'b.year']},
         'SELECT scry.authors.id, b.id, b.title, b.year FROM scry.authors LEFT JOIN scry.books AS b ON scry.authors.id = b.author_id  LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((None,), (('id', 1),)): {'books': {((('title', 'Fellowship of the Rings'), ('year', 1954)), (('id', 1),)): {}, ((('title', 'The Two Towers'), ('year', 1954)), (('id', 2),)): {}, ((('title', 'Return of the King'), ('year', 1955)), (('id', 3),)): {}, ((('title', 'Beowolf'), ('year', 2016)), (('id', 7),)): {}}}, ((None,), (('id', 2),)): {'books': {((('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997)), (('id', 4),)): {}, ((('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999)), (('id', 5),)): {}}}, ((None,), (('id', 3),)): {'books': {((('title', 'Exhalation'), ('year', 2019)), (('id', 6),)): {}}}}}}},
         ['- scry.authors.books.title: Fellowship of the Rings', '  scry.authors.books.year: 1954', '- scry.authors.books.title: The Two Towers', '  scry.authors.books.year: 1954', '- scry.authors.books.title: Return of the King', '  scry.authors.books.year: 1955', '- scry.authors.books.title: Beowolf', '  scry.authors.books.year: 2016', "- scry.authors.books.title: Harry Potter and the Philosopher's Stone", '  scry.authors.books.year: 1997', '- scry.authors.books.title: Harry Potter and the Prisoner of Azkaban', '  scry.authors.books.year: 1999', '- scry.authors.books.title: Exhalation', '  scry.authors.books.year: 2019']
         ),
-   Instance(
+    Instance(
         'use another table name as an alias',
         'books@authors.title authors.year',
         {'scry': {'children': {'authors': {'table': 'books', 'columns': ['title', 'year']}}}},
-        {'selects': [('authors.title', 'scry.authors.title'), ('authors.year', 'scry.authors.year')], 'joins': ['scry.books AS authors'], 'wheres': [], 'uniques': [('authors.id', 'scry.authors.id')]},
+        {'selects': [('authors.title', 'scry.authors.title'), ('authors.year', 'scry.authors.year')], 'joins': ['scry.books AS authors'], 'wheres': [], 'uniques': [('authors.id', 'scry.authors.id')], 'join_keys': [], 'columns': ['authors.id', 'authors.title', 'authors.year']},
         'SELECT authors.id, authors.title, authors.year FROM scry.books AS authors  LIMIT 100',
         {'scry': {((None,), (None,)): {'authors': {((('title', 'Fellowship of the Rings'), ('year', 1954)), (('id', 1),)): {}, ((('title', 'The Two Towers'), ('year', 1954)), (('id', 2),)): {}, ((('title', 'Return of the King'), ('year', 1955)), (('id', 3),)): {}, ((('title', "Harry Potter and the Philosopher's Stone"), ('year', 1997)), (('id', 4),)): {}, ((('title', 'Harry Potter and the Prisoner of Azkaban'), ('year', 1999)), (('id', 5),)): {}, ((('title', 'Exhalation'), ('year', 2019)), (('id', 6),)): {}, ((('title', 'Beowolf'), ('year', 2016)), (('id', 7),)): {}}}}},
         ['- scry.authors.title: Fellowship of the Rings', '  scry.authors.year: 1954', '- scry.authors.title: The Two Towers', '  scry.authors.year: 1954', '- scry.authors.title: Return of the King', '  scry.authors.year: 1955', "- scry.authors.title: Harry Potter and the Philosopher's Stone", '  scry.authors.year: 1997', '- scry.authors.title: Harry Potter and the Prisoner of Azkaban', '  scry.authors.year: 1999', '- scry.authors.title: Exhalation', '  scry.authors.year: 2019', '- scry.authors.title: Beowolf', '  scry.authors.year: 2016']
         ),
+    Instance(
+        'count of children',
+        'authors.name authors.books.count()',
+        {'scry': {'children': {'authors': {'table': 'authors', 'columns': ['name'], 'children': {'books': {'table': 'books', 'aggregates': [('count', None)]}}}}}},
+        {'selects': [('scry.authors.name', 'scry.authors.name'), ('(SELECT count(*) FROM scry.books WHERE scry.authors.id = scry.books.author_id)', 'scry.authors.books.count()')], 'joins': ['scry.authors'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id')], 'join_keys': [], 'columns': ['scry.authors.id', 'scry.authors.name', '(SELECT count(*) FROM scry.books WHERE scry.authors.id = scry.books.author_id)']},
+        'SELECT scry.authors.id, scry.authors.name, (SELECT count(*) FROM scry.books WHERE scry.authors.id = scry.books.author_id) FROM scry.authors  LIMIT 100',
+        {'scry': {((None,), (None,)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {'books': {((('count()', 4),), (None,)): {}}}, ((('name', 'J.K. Rowling'),), (('id', 2),)): {'books': {((('count()', 2),), (None,)): {}}}, ((('name', 'Ted Chiang'),), (('id', 3),)): {'books': {((('count()', 1),), (None,)): {}}}}}}},
+        ['- scry.authors.name: J.R.R. Tolkien', '  - books.count(): 4', '- scry.authors.name: J.K. Rowling', '  - books.count(): 2', '- scry.authors.name: Ted Chiang', '  - books.count(): 1']
+        ),
+    Instance(
+        'aggregate on a column of children with a condition',
+        'authors.name authors.books.year.max() authors.books.year < 2000',
+        {'scry': {'children': {'authors': {'table': 'authors', 'columns': ['name'], 'children': {'books': {'table': 'books', 'aggregates': [('max', 'year')], 'conditions': {'conditions': [('year', '<', '2000')]}}}}}}},
+        {'selects': [('scry.authors.name', 'scry.authors.name'), ('(SELECT max(scry.books.year) FROM scry.books WHERE scry.authors.id = scry.books.author_id AND scry.books.year < 2000)', 'scry.authors.books.max(year)')], 'joins': ['scry.authors'], 'wheres': [], 'uniques': [('scry.authors.id', 'scry.authors.id')], 'join_keys': [], 'columns': ['scry.authors.id', 'scry.authors.name', '(SELECT max(scry.books.year) FROM scry.books WHERE scry.authors.id = scry.books.author_id AND scry.books.year < 2000)']},
+        'SELECT scry.authors.id, scry.authors.name, (SELECT max(scry.books.year) FROM scry.books WHERE scry.authors.id = scry.books.author_id AND scry.books.year < 2000) FROM scry.authors  LIMIT 100',
+        {'scry': {((None,), (None,)): {'authors': {((('name', 'J.R.R. Tolkien'),), (('id', 1),)): {'books': {((('max(year)', 1955),), (None,)): {}}}, ((('name', 'J.K. Rowling'),), (('id', 2),)): {'books': {((('max(year)', 1999),), (None,)): {}}}, ((('name', 'Ted Chiang'),), (('id', 3),)): {}}}}},
+        ['- scry.authors.name: J.R.R. Tolkien', '  - books.max(year): 1955', '- scry.authors.name: J.K. Rowling', '  - books.max(year): 1999', '- scry.authors.name: Ted Chiang']
+        ),
+    Instance(
+        'aggregate over the root table',
+        'books.count() books.year > 1990',
+        {'scry': {'children': {'books': {'table': 'books', 'aggregates': [('count', None)], 'conditions': {'conditions': [('year', '>', '1990')]}}}}},
+        {'selects': [('count(*)', 'scry.books.count()')], 'joins': ['scry.books'], 'wheres': ['scry.books.year > 1990'], 'uniques': [], 'join_keys': [], 'columns': ['count(*)']},
+        'SELECT count(*) FROM scry.books  WHERE scry.books.year > 1990 LIMIT 100',
+        {'scry': {((None,), (None,)): {'books': {((('count()', 4),), (None,)): {}}}}},
+        ['- scry.books.count(): 4']
+        ),
+    Instance(
+        'join through a table that contributes nothing is skipped',
+        'favorites.reason favorites.books.series_books.series.name',
+        {'scry': {'children': {'favorites': {'table': 'favorites', 'columns': ['reason'], 'children': {'books': {'table': 'books', 'children': {'series_books': {'table': 'series_books', 'children': {'series': {'table': 'series', 'columns': ['name']}}}}}}}}}},
+        {'selects': [('scry.favorites.reason', 'scry.favorites.reason'), ('scry.series.name', 'scry.favorites.books.series_books.series.name')], 'joins': ['scry.favorites', 'LEFT JOIN scry.series_books ON scry.favorites.book_id = scry.series_books.book_id', 'LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id'], 'wheres': [], 'uniques': [('scry.favorites.user_id', 'scry.favorites.user_id'), ('scry.favorites.book_id', 'scry.favorites.book_id')], 'join_keys': ['scry.series_books.book_id', 'scry.series.id'], 'columns': ['scry.favorites.user_id', 'scry.favorites.book_id', 'scry.favorites.reason', 'scry.series.name']},
+        'SELECT scry.favorites.user_id, scry.favorites.book_id, scry.favorites.reason, scry.series.name FROM scry.favorites LEFT JOIN scry.series_books ON scry.favorites.book_id = scry.series_books.book_id LEFT JOIN scry.series ON scry.series_books.series_id = scry.series.id  LIMIT 100',
+        {'scry': {((None,), (None,)): {'favorites': {((('reason', 'The only good book in the series'),), (('user_id', 2), ('book_id', 4))): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (None,)): {}}}}}}}, ((('reason', 'Short and fun'),), (('user_id', 1), ('book_id', 4))): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (None,)): {}}}}}}}, ((('reason', 'Long but still good'),), (('user_id', 1), ('book_id', 5))): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {'series': {((('name', 'Harry Potter'),), (None,)): {}}}}}}}, ((('reason', 'Short stories are awesome'),), (('user_id', 2), ('book_id', 6))): {'books': {((None,), (None,)): {'series_books': {((None,), (None,)): {}}}}}}}}},
+        ['- scry.favorites.reason: The only good book in the series', '  - books.series_books.series.name: Harry Potter', '- scry.favorites.reason: Short and fun', '  - books.series_books.series.name: Harry Potter', '- scry.favorites.reason: Long but still good', '  - books.series_books.series.name: Harry Potter', '- scry.favorites.reason: Short stories are awesome']
+        ),
+    Instance(
+        'join only used for its key column is skipped',
+        'books.title books.authors.id',
+        {'scry': {'children': {'books': {'table': 'books', 'columns': ['title'], 'children': {'authors': {'table': 'authors', 'columns': ['id']}}}}}},
+        {'selects': [('scry.books.title', 'scry.books.title'), ('scry.books.author_id', 'scry.books.authors.id')], 'joins': ['scry.books'], 'wheres': [], 'uniques': [('scry.books.id', 'scry.books.id')], 'join_keys': [], 'columns': ['scry.books.id', 'scry.books.title', 'scry.books.author_id']},
+        'SELECT scry.books.id, scry.books.title, scry.books.author_id FROM scry.books  LIMIT 100',
+        {'scry': {((None,), (None,)): {'books': {((('title', 'Fellowship of the Rings'),), (('id', 1),)): {'authors': {((('id', 1),), (None,)): {}}}, ((('title', 'The Two Towers'),), (('id', 2),)): {'authors': {((('id', 1),), (None,)): {}}}, ((('title', 'Return of the King'),), (('id', 3),)): {'authors': {((('id', 1),), (None,)): {}}}, ((('title', "Harry Potter and the Philosopher's Stone"),), (('id', 4),)): {'authors': {((('id', 2),), (None,)): {}}}, ((('title', 'Harry Potter and the Prisoner of Azkaban'),), (('id', 5),)): {'authors': {((('id', 2),), (None,)): {}}}, ((('title', 'Exhalation'),), (('id', 6),)): {'authors': {((('id', 3),), (None,)): {}}}, ((('title', 'Beowolf'),), (('id', 7),)): {'authors': {((('id', 1),), (None,)): {}}}}}}},
+        ['- scry.books.title: Fellowship of the Rings', '  - authors.id: 1', '- scry.books.title: The Two Towers', '  - authors.id: 1', '- scry.books.title: Return of the King', '  - authors.id: 1', "- scry.books.title: Harry Potter and the Philosopher's Stone", '  - authors.id: 2', '- scry.books.title: Harry Potter and the Prisoner of Azkaban', '  - authors.id: 2', '- scry.books.title: Exhalation', '  - authors.id: 3', '- scry.books.title: Beowolf', '  - authors.id: 1']
+        ),
     # End of instances
 ]
 
@@ -332,17 +391,15 @@ def run_test(instance):
     db = psycopg2.connect("")
     cur = db.cursor()
 
-    table_info = scry.get_table_info(cur)
-    foreign_keys = scry.get_foreign_keys(cur)
-    unique_keys = scry.get_unique_keys(cur)
-    keys = {"unique": unique_keys, "foreign": foreign_keys}
+    table_info, keys = scry.load_schema(cur)
+    foreign_keys = keys["foreign"]
 
     settings = scry.default_settings()
 
     tree, aliases, _, _ = scry.parse(settings, table_info, foreign_keys, instance.query)
     assert tree == instance.tree
 
-    sql_clauses = scry.generate_sql(keys, tree)
+    sql_clauses = scry.minimize_projection(scry.generate_sql(keys, tree))
     assert sql_clauses == instance.sql_clauses
 
     sql = scry.serialize_sql(sql_clauses, 100)
@@ -350,7 +407,7 @@ def run_test(instance):
     cur.execute(sql)
 
     results = scry.reshape_results(cur, sql_clauses)
-    assert results == instance.results
+    assert results.as_tree() == instance.results
 
     output = scry.format_results(results)
     assert output == instance.output
@@ -359,3 +416,556 @@ def run_test(instance):
 def test_scry(instance):
     run_test(instance)
 
+
+def test_compiler():
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    compiler = scry.Compiler.from_cursor(cur)
+
+    query = "books.year books.title = $title"
+    compiled = compiler.compile(query, {"title": "Fellowship of the Rings"})
+    assert compiled.sql == "SELECT scry.books.id, scry.books.year FROM scry.books  WHERE scry.books.title = %(title)s LIMIT 100"
+    assert compiled.params == {"title": "Fellowship of the Rings"}
+
+    cur.execute(compiled.sql, compiled.params)
+    results = scry.reshape_results(cur, compiled.sql_clauses)
+    assert scry.format_results(results) == ['- scry.books.year: 1954']
+
+    compiled = compiler.compile(query, {"title": "Exhalation"})
+    assert compiled.params == {"title": "Exhalation"}
+    assert (compiler.hits, compiler.misses) == (1, 1)
+
+    with pytest.raises(scry.ScryException, match="No value given for parameter \\$title"):
+        compiler.compile(query)
+
+def test_compiler_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    compiler = scry.Compiler.from_cursor(cur)
+
+    queries = [i.query for i in test_instances] * 4
+    expected = [i.sql for i in test_instances] * 4
+    with ThreadPoolExecutor(8) as pool:
+        sqls = list(pool.map(lambda q: compiler.compile(q).sql, queries))
+    assert sqls == expected
+    assert compiler.hits + compiler.misses == len(queries)
+
+def test_completion():
+    from prompt_toolkit.document import Document
+    from scry.repl import ScryCompleter
+
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    completer = ScryCompleter(scry.default_settings(), table_info, keys["foreign"])
+
+    def complete(text):
+        return [c.text for c in completer.get_completions(Document(text), None)]
+
+    assert complete("auth") == ["authors"]
+    assert complete("books.") == ["author_id", "id", "title", "year", "authors", "books_genres", "favorites", "series_books"]
+    assert complete("books.authors.n") == ["name"]
+    assert complete("books@b.title b.y") == ["year"]
+    assert complete("scry.ser") == ["series", "series_books"]
+    assert complete("\\alias gen") == ["genres"]
+
+def test_value_completion():
+    from prompt_toolkit.document import Document
+    from scry.repl import ScryCompleter, ValueCache
+
+    db = psycopg2.connect("")
+    db.autocommit = True
+    cur = db.cursor()
+    # Analyzing the fixture tables would change their query plans (and so
+    # the order of unordered results), so analyze a copy.
+    cur.execute("CREATE TEMP TABLE titles AS SELECT * FROM scry.books")
+    cur.execute("ANALYZE titles")
+    cur.execute("SELECT nspname FROM pg_namespace WHERE oid = pg_my_temp_schema()")
+    temp = cur.fetchone()[0]
+    table_info, keys = scry.load_schema(cur)
+    now = [0]
+    values = ValueCache(db.cursor(), size=2, ttl=60, clock=lambda: now[0])
+    completer = ScryCompleter(scry.default_settings(), table_info, keys["foreign"], values)
+
+    def complete(text):
+        return [c.text for c in completer.get_completions(Document(text), None)]
+
+    assert complete('titles.title = "Harry') == ['"Harry Potter and the Philosopher\'s Stone"', '"Harry Potter and the Prisoner of Azkaban"']
+    assert complete('titles@t.title t.title = "Harry Potter and the Pr') == ['"Harry Potter and the Prisoner of Azkaban"']
+    assert complete("titles.year > 195") == ["1954", "1955"]
+    assert list(values.cache) == [(temp, "titles", "title"), (temp, "titles", "year")]
+
+    # Least recently used columns are dropped, and old entries refetched.
+    complete("authors.name = ")
+    assert list(values.cache) == [(temp, "titles", "year"), ("scry", "authors", "name")]
+    values.cache[(temp, "titles", "year")] = (0, ["1066"])
+    assert complete("titles.year = 1") == ["1066"]
+    now[0] = 61
+    assert complete("titles.year = 1") == ["1954", "1955", "1997", "1999"]
+
+    # Values are completed as written, and those that can't be written are left out.
+    cur.execute("""CREATE TEMP TABLE drinks AS SELECT * FROM (VALUES ('Tea'), ('Tea'), ('Say "hi"'), ('C:\\')) v (name)""")
+    cur.execute("ANALYZE drinks")
+    table_info, keys = scry.load_schema(cur)
+    completer = ScryCompleter(scry.default_settings(), table_info, keys["foreign"], values)
+    assert complete("drinks.name = ") == ['"Tea"']
+
+def test_paging():
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    settings["config"]["limit"] = 3
+
+    def run(query):
+        return scry.run_command(settings, cur, table_info, keys, query)
+
+    assert run("books.title") == ['- scry.books.title: Fellowship of the Rings', '- scry.books.title: The Two Towers', '- scry.books.title: Return of the King']
+    assert run("\\next") == ["- scry.books.title: Harry Potter and the Philosopher's Stone", '- scry.books.title: Harry Potter and the Prisoner of Azkaban', '- scry.books.title: Exhalation']
+    assert run("\\next") == ['- scry.books.title: Beowolf']
+    assert run("\\next") == ["No more results"]
+
+    # The fifth row is the start of another user, so it's left for the next page.
+    settings["config"]["limit"] = 5
+    assert run("users.name users.favorites.reason") == ['- scry.users.name: Winnie the Pooh', '  - favorites.reason: Short and fun', '  - favorites.reason: Long but still good', '- scry.users.name: Tigger', '  - favorites.reason: The only good book in the series', '  - favorites.reason: Short stories are awesome']
+    assert run("\\next") == ['- scry.users.name: Piglet']
+
+def test_paging_truncated(capsys):
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    settings["config"]["limit"] = 2
+
+    # Tolkien has more books than fit on a page, so there's no complete author
+    # to end it with.
+    for pipeline in ["off", "on"]:
+        settings["config"]["pipeline"] = pipeline
+        scry.run_command(settings, cur, table_info, keys, "authors.name authors.books.title")
+        assert "-- The limit of 2 rows may have cut off this scry.authors; \\set limit higher to see all of it" in capsys.readouterr().out.splitlines()
+    scry.run_command(settings, cur, table_info, keys, "\\next")
+    assert "may have cut off" not in capsys.readouterr().out
+
+def test_watch_diff():
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    tree, _, _, _ = scry.parse(scry.default_settings(), table_info, keys["foreign"], "authors.name authors.books.title")
+    sql_clauses = scry.minimize_projection(scry.generate_sql(keys, tree))
+    cur.execute(scry.serialize_sql(sql_clauses, 100))
+    rows = cur.fetchall()
+    old = scry.reshape_results(rows, sql_clauses)
+    assert scry.diff_results(old, scry.reshape_results(rows, sql_clauses)) == []
+
+    # Rows are (authors.id, books.id, authors.name, books.title)
+    rows = [r for r in rows if r[3] != "Beowolf"]
+    rows = [(a, b, "Ted Chiang (author)" if a == 3 else name, title) for a, b, name, title in rows]
+    rows.append((4, 8, "Ursula K. Le Guin", "A Wizard of Earthsea"))
+    new = scry.reshape_results(rows, sql_clauses)
+    assert scry.diff_results(old, new) == [
+        '  - scry.authors.name: J.R.R. Tolkien',
+        '-   - books.title: Beowolf',
+        '~ - scry.authors.name: Ted Chiang -> Ted Chiang (author)',
+        '+ - scry.authors.name: Ursula K. Le Guin',
+        '+   - books.title: A Wizard of Earthsea',
+    ]
+
+    assert scry.watch_pattern.match("\\watch 2.5 books.title").groups() == (None, "2.5", "books.title")
+    assert scry.watch_pattern.match("\\watch @books books.title").groups() == ("books", None, "books.title")
+
+def test_schema_refresh():
+    db = psycopg2.connect("")
+    db.autocommit = True
+    cur = db.cursor()
+    monitor = scry.SchemaMonitor(cur)
+    table_info, keys = scry.load_schema(cur)
+    compiler = scry.Compiler(table_info, keys)
+    compiler.compile("authors.name")
+    compiler.compile("users.name")
+
+    def normalized(table_info, keys):
+        schemas, tables, columns, table_columns = table_info
+        return (sorted(schemas), {t: sorted(ss) for t, ss in tables.items()}, sorted(columns),
+                {t: sorted(cs) for t, cs in table_columns.items()}, keys)
+
+    try:
+        cur.execute("CREATE TABLE scry.reviews (id int8 PRIMARY KEY, book_id int8 REFERENCES scry.books (id), body text)")
+        cur.execute("ALTER TABLE scry.authors ADD COLUMN born int")
+        changed = monitor.changes(cur, "poll")
+        assert changed == {("scry", "reviews"), ("scry", "authors")}
+
+        scry.refresh_schema(cur, table_info, keys, changed)
+        assert normalized(table_info, keys) == normalized(*scry.load_schema(cur))
+        assert ("scry", "reviews", "book_id", "scry", "books", "id") in keys["references"]
+
+        compiler.refresh_schema(cur, changed)
+        assert compiler.compile("authors.born").sql == "SELECT scry.authors.id, scry.authors.born FROM scry.authors  LIMIT 100"
+        assert compiler.compile("books.reviews.body").sql.startswith("SELECT")
+        compiler.compile("users.name")
+        assert (compiler.hits, compiler.misses) == (1, 4)
+    finally:
+        cur.execute("DROP TABLE IF EXISTS scry.reviews")
+        cur.execute("ALTER TABLE scry.authors DROP COLUMN IF EXISTS born")
+
+    changed = monitor.changes(cur, "poll")
+    scry.refresh_schema(cur, table_info, keys, changed)
+    assert normalized(table_info, keys) == normalized(*scry.load_schema(cur))
+    assert monitor.changes(cur, "off") == set()
+
+def test_query():
+    import scry as package
+
+    db = psycopg2.connect("")
+    db.autocommit = True
+
+    # A batch size of 2 splits Tolkien's books across fetches.
+    authors = list(package.query(db, "authors.name authors.books.title", batch_size=2))
+    assert [a.name for a in authors] == ["J.R.R. Tolkien", "J.K. Rowling", "Ted Chiang"]
+    assert sorted(b.title for b in authors[0].books) == ["Beowolf", "Fellowship of the Rings", "Return of the King", "The Two Towers"]
+
+    users = package.query(db, "users.name users.favorites.books.title")
+    pooh = next(users)
+    assert pooh.name == "Winnie the Pooh"
+    assert sorted(f.books[0].title for f in pooh.favorites) == ["Harry Potter and the Philosopher's Stone", "Harry Potter and the Prisoner of Azkaban"]
+    assert [u.favorites for u in users if u.name == "Piglet"] == [[]]
+
+    assert list(package.query(db, "books.year = $year books.title", {"year": 2019})) == [("Exhalation",)]
+    [author] = package.query(db, "authors.name = \"Ted Chiang\" authors.books.count()")
+    assert author.books[0].count == 1
+
+def test_query_columns():
+    from array import array
+    import scry as package
+
+    db = psycopg2.connect("")
+    db.autocommit = True
+
+    columns = package.query_columns(db, "books.title,year books.year < 1990", batch_size=2, use_numpy=False)
+    assert columns == {
+        "scry.books.title": ["Fellowship of the Rings", "The Two Towers", "Return of the King"],
+        "scry.books.year": array("q", [1954, 1954, 1955]),
+    }
+
+    # Piglet has no favorites, so the year column has a NULL.
+    columns = package.query_columns(db, "users.name users.favorites.books.year", batch_size=2, use_numpy=False)
+    assert columns["scry.users.favorites.books.year"] == [1997, 1999, 1997, 2019, None]
+
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    settings["config"]["format"] = "columns"
+    assert scry.run_command(settings, cur, table_info, keys, "authors.name authors.id < 3") == ['{"scry.authors.name": ["J.R.R. Tolkien", "J.K. Rowling"]}']
+    assert settings["paging"] is None
+
+def test_in_lists(tmp_path):
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    compiler = scry.Compiler(table_info, keys)
+
+    compiled = compiler.compile('books.title books.title IN ["Exhalation", "Beowolf"] books.id NOT IN [7]')
+    assert compiled.sql == "SELECT scry.books.id, scry.books.title FROM scry.books  WHERE scry.books.title = ANY(%(_list0)s) AND scry.books.id <> ALL(%(_list1)s) LIMIT 100"
+    assert compiled.params == {"_list0": ["Exhalation", "Beowolf"], "_list1": [7]}
+
+    ids = tmp_path / "ids"
+    ids.write_text("1\n3\n\n5\n")
+    compiled = compiler.compile(f"books.title books.id IN @{ids}")
+    assert compiled.params == {"_list0": ["1", "3", "5"]}
+    # The file is read each time the query is run, not when it's compiled.
+    ids.write_text("6\n")
+    assert compiler.compile(f"books.title books.id IN @{ids}").params == {"_list0": ["6"]}
+    assert compiler.compile("books.title books.id IN $ids", {"ids": [2]}).params == {"ids": [2]}
+
+    with pytest.raises(scry.ScryException, match="Can't read values from"):
+        compiler.compile(f"books.title books.id IN @{tmp_path}/missing")
+
+    settings = scry.default_settings()
+    def run(query):
+        return scry.run_command(settings, cur, table_info, keys, query)
+
+    ids.write_text("1\n3\n5\n6\n")
+    query = f"authors.name authors.books.title authors.books.id IN @{ids}"
+    unchunked = run(query)
+    settings["config"]["in_chunk_size"] = 3
+    assert run(query) == unchunked
+    assert settings["paging"] is None
+    assert run(f"books.count() books.id IN @{ids}") == ["- scry.books.count(): 4"]
+    # The limit is for the whole query, not each chunk.
+    settings["config"]["limit"] = 2
+    settings["config"]["in_chunk_size"] = 2
+    assert run(f"books.title books.id IN @{ids}") == ["- scry.books.title: Fellowship of the Rings", "- scry.books.title: Return of the King"]
+
+    # Values are cast to the column's type by Postgres, so they aren't
+    # mistaken for numbers.
+    settings["config"]["limit"] = 100
+    titles = tmp_path / "titles"
+    titles.write_text('007\nSay "hi" \\ bye\nExhalation\n')
+    assert run(f"books.year books.title IN @{titles}") == ["- scry.books.year: 2019"]
+
+def test_materialize():
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    def run(query):
+        # The temp schema's name depends on the backend.
+        return [re.sub(r"pg_temp_\d+", "pg_temp", line) for line in scry.run_command(settings, cur, table_info, keys, query)]
+
+    assert run("\\materialize fav_users users.favorites.books.year = 1997") == ["Materialized 2 rows of scry.users as fav_users"]
+    assert run("fav_users.name fav_users.favorites.books.title fav_users.name = \"Tigger\"") == [
+        "- pg_temp.fav_users.name: Tigger",
+        "  - favorites.books.title: Harry Potter and the Philosopher's Stone",
+        "  - favorites.books.title: Exhalation",
+    ]
+    # Tables that reference the root table can join to the materialized one too.
+    assert run("books.title books.favorites.fav_users.name books.id = 5") == [
+        "- scry.books.title: Harry Potter and the Prisoner of Azkaban",
+        "  - favorites.fav_users.name: Winnie the Pooh",
+    ]
+
+    assert run("\\materialize fav_users users.name = \"Tigger\"") == ["Materialized 1 rows of scry.users as fav_users"]
+    assert run("fav_users.name") == ["- pg_temp.fav_users.name: Tigger"]
+    with pytest.raises(scry.ScryException, match="one root table"):
+        run("\\materialize both users.name authors.name")
+
+def test_sample():
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    compiler = scry.Compiler(table_info, keys)
+
+    compiled = compiler.compile("books@b~2.5%.title b.authors.name")
+    assert compiled.sql == "SELECT b.id, b.title, scry.authors.name FROM scry.books AS b TABLESAMPLE SYSTEM (2.5) LEFT JOIN scry.authors ON b.author_id = scry.authors.id  LIMIT 100"
+
+    settings = scry.default_settings()
+    settings["config"].update({"sample": "50%", "sample_method": "bernoulli", "sample_seed": "7"})
+    compiled = compiler.compile("books.title", settings=settings)
+    assert compiled.sql == "SELECT scry.books.id, scry.books.title FROM scry.books TABLESAMPLE BERNOULLI (50) REPEATABLE (7)  LIMIT 100"
+    # A ~ on the table overrides the setting.
+    assert "TABLESAMPLE BERNOULLI (100) REPEATABLE (7)" in compiler.compile("books~100%.count()", settings=settings).sql
+
+    def run(query):
+        return scry.run_command(settings, cur, table_info, keys, query)
+    assert run("books~100%.count()") == ["- scry.books.count(): 7"]
+    assert run("books.title") == run("books.title")
+
+def test_count():
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    def run(query):
+        return scry.run_command(settings, cur, table_info, keys, query)
+
+    assert run("\\count books.title books.year > 1990") == ["scry.books: 4"]
+    # Authors are counted once, however many books match.
+    assert run("\\count authors.name authors.books.year > 1990") == ["scry.authors: 3"]
+    assert run("\\count users.favorites.books.year = 1997") == ["scry.users: 2"]
+    [estimate] = run("\\count~ authors.books.year > 1990")
+    assert re.fullmatch(r"scry.authors: ~\d+", estimate)
+    with pytest.raises(scry.ScryException, match="one root table"):
+        run("\\count books.title authors.name")
+
+def test_indexes():
+    db = psycopg2.connect("")
+    db.autocommit = True
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    assert keys["indexes"]["scry"]["favorites"] == [("favorites_pkey", ["user_id", "book_id"])]
+
+    compiler = scry.Compiler(table_info, keys)
+    # favorites.user_id leads the primary key, but books.author_id has no index.
+    assert compiler.compile("users.favorites.books.title").warnings == ()
+    assert compiler.compile("authors.books.title books.year > 2000").warnings == (
+        "-- No index on scry.books.author_id (join from scry.authors)",
+        "-- No index on scry.books.year (condition)",
+    )
+
+    settings = scry.default_settings()
+    assert scry.run_command(settings, cur, table_info, keys, "\\indexes authors.books.title authors.id = 1") == [
+        "scry.authors.id (condition): authors_pkey",
+        "scry.books.author_id (join from scry.authors): no index; CREATE INDEX ON scry.books (author_id)",
+    ]
+
+    # Creating an index updates the table's statistics, so use a copy rather
+    # than change the fixture tables' query plans.
+    cur.execute("CREATE TEMP TABLE book_copies AS SELECT * FROM scry.books")
+    cur.execute("SELECT nspname FROM pg_namespace WHERE oid = pg_my_temp_schema()")
+    temp = cur.fetchone()[0]
+    monitor = scry.SchemaMonitor(cur)
+    cur.execute("CREATE INDEX book_copies_author_id ON book_copies (author_id)")
+    scry.refresh_schema(cur, table_info, keys, monitor.changes(cur, "poll"))
+    assert scry.leading_index(keys, temp, "book_copies", "author_id") == "book_copies_author_id"
+
+def test_alias_order():
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    compiler = scry.Compiler.from_cursor(cur)
+
+    # Each component uses the alias defined by the one after it.
+    components = ["authors@a0.name"]
+    for i in range(1, 40):
+        table, column = ("books", "title") if i % 2 else ("authors", "name")
+        components.append(f"a{i - 1}.{table}@a{i}.{column}")
+    compiled = compiler.compile(" ".join(reversed(components)))
+    assert compiled.sql.count("LEFT JOIN") == 39
+    assert "LEFT JOIN scry.authors AS a38 ON a37.author_id = a38.id" in compiled.sql
+
+def test_text_fetch():
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+
+    def pages(fetch):
+        settings = scry.default_settings()
+        settings["config"].update({"fetch": fetch, "limit": 3})
+        run = lambda query: scry.run_command(settings, cur, table_info, keys, query)
+        return [run("authors.name authors.books.title,year"), run("\\next"), run("\\next")]
+
+    # Integers and strings display the same either way, and paging keys
+    # still work as text.
+    assert pages("text") == pages("typed")
+
+    text = scry.text_cursor(db)
+    text.execute("SET TIME ZONE 'UTC'")
+    text.execute("""SELECT 1, 2.50::numeric, '2020-01-02 03:04:05+00'::timestamptz, '{"a": [1]}'::jsonb, true, NULL::int""")
+    assert text.fetchone() == ("1", "2.50", "2020-01-02 03:04:05+00", '{"a": [1]}', "t", None)
+    cur.execute("SELECT 1")
+    assert cur.fetchone() == (1,)
+
+def test_dimension_cache():
+    db = psycopg2.connect("")
+    db.autocommit = True
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    def run(query):
+        return scry.run_command(settings, cur, table_info, keys, query)
+
+    # The fixture tables have never been analyzed, so they aren't known to be
+    # small, but a materialized copy is.
+    run("\\materialize g genres.name")
+    cur.execute("SELECT nspname FROM pg_namespace WHERE oid = pg_my_temp_schema()")
+    temp = cur.fetchone()[0]
+    query = "books.title books.books_genres.g.name books.authors.name"
+    joined = run(query)
+    settings["config"]["dimension_rows"] = 10
+    assert run(query) == joined
+    # Tables that aren't small are remembered too, so they aren't checked every time.
+    tables = settings["dimensions"].tables
+    assert tables[(temp, "g", "id", False)][1] is not None
+    assert tables[("scry", "authors", "id", False)][1] is None
+
+    tree, _, _, _ = scry.parse(settings, table_info, keys["foreign"], query)
+    roots = scry.optimize(keys, scry.build_ir(keys, tree))
+    scry.cache_dimensions(keys, roots, lambda s, t, k: settings["dimensions"].rows(s, t, k, 10, 60))
+    sql_clauses = scry.minimize_projection(scry.emit_sql(keys, roots))
+    assert "pg_temp" not in scry.serialize_sql(sql_clauses, 100)
+    assert sql_clauses["lookups"] == [scry.Lookup("scry.books_genres.genre_id", temp, "g", "id", "name")]
+
+    now = [0]
+    dimensions = scry.DimensionCache(cur, clock=lambda: now[0])
+    names, rows = dimensions.rows(temp, "g", "id", 10, 60)
+    assert sorted(row[names.index("name")] for row in rows.values()) == ["Fantasy", "Science Fiction"]
+    # Still cached, even though it's too big for the new limit until refetched.
+    assert dimensions.rows(temp, "g", "id", 1, 60) is not None
+    now[0] = 61
+    assert dimensions.rows(temp, "g", "id", 1, 60) is None
+
+def test_history(tmp_path):
+    from scry.history import History
+    db = psycopg2.connect("")
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    settings["config"]["limit"] = 3
+    def run(query):
+        return scry.run_command(settings, cur, table_info, keys, query)
+
+    with pytest.raises(scry.ScryException, match="No query history"):
+        run("\\slow")
+    settings["history"] = History(tmp_path / "history.db")
+    output = run("books.title")
+    run("\\next")
+    run("authors.name")
+    run("\\set limit 100")
+
+    [(sql, rows, size, *timings)] = settings["history"].db.execute(
+        "SELECT sql, rows, bytes, compile_ms, execute_ms, reshape_ms, format_ms FROM queries WHERE id = 1").fetchall()
+    assert sql.startswith("SELECT scry.books.id, scry.books.title FROM scry.books")
+    assert rows == 3 and size == len("\n".join(output)) + 1
+    assert all(t is not None and t >= 0 for t in timings)
+    # Pages are recorded under the query they're from, with no compile time.
+    assert settings["history"].db.execute("SELECT query, compile_ms FROM queries WHERE id = 2").fetchone() == ("books.title", None)
+
+    top = run("\\top 1")
+    assert len(top) == 2 and top[1].split()[0] == "2" and top[1].endswith("  books.title")
+    slow = run("\\slow")
+    assert len(slow) == 5
+    assert sorted(line.rsplit(" ", 1)[-1] for line in slow[1::2]) == ["authors.name", "books.title"]
+    assert all(line.split()[0:4:2] == ["compile", "execute"] for line in slow[4::2] if "compile" in line)
+    assert settings["history"].most_frequent(10, since=time.time() + 60) == []
+    settings["history"].close()
+
+def test_warm_up():
+    db = psycopg2.connect("")
+    db.autocommit = True
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    def run(query):
+        return scry.run_command(settings, cur, table_info, keys, query)
+
+    query = "authors.name authors.books.title"
+    expected = run(query)
+    settings["compiler"] = compiler = scry.Compiler(table_info, keys, settings)
+    settings["config"]["warm_prepare"] = "on"
+    scry.warm_up(settings, cur, [query, "authors.nope", "books.title"])
+    assert (compiler.hits, compiler.misses) == (0, 2)
+    [(name, sql)] = [(n, s) for s, n in settings["prepared"].items() if b"scry.authors" in s]
+
+    assert run(query) == expected
+    assert (compiler.hits, compiler.misses) == (1, 2)
+    cur.execute("SELECT custom_plans + generic_plans FROM pg_prepared_statements WHERE name = %s", (name,))
+    assert cur.fetchone() == (1,)
+    # A different limit is different SQL, so it isn't run from the statement.
+    run("\\set limit 1")
+    run(query)
+    cur.execute("SELECT custom_plans + generic_plans FROM pg_prepared_statements WHERE name = %s", (name,))
+    assert cur.fetchone() == (1,)
+
+    scry.deallocate(settings, cur)
+    cur.execute("SELECT count(*) FROM pg_prepared_statements WHERE name LIKE 'scry_warm%%'")
+    assert cur.fetchone() == (0,) and settings["prepared"] == {}
+
+def test_pipeline(capsys):
+    db = psycopg2.connect("")
+    db.autocommit = True
+    cur = db.cursor()
+    table_info, keys = scry.load_schema(cur)
+    settings = scry.default_settings()
+    def run(query):
+        output = scry.run_command(settings, cur, table_info, keys, query)
+        printed = [l for l in capsys.readouterr().out.splitlines() if not l.startswith(("SELECT", "-- "))]
+        output = printed if output is None else output
+        # Without a limit, rows are only ordered when pipelined.
+        return output if settings["config"]["limit"] else sorted(output)
+
+    queries = ["authors.name authors.books.title", "users.name users.favorites.reason users.favorites.books.title"]
+    for limit in [0, 4]:
+        settings["config"]["limit"] = limit
+        settings["config"]["pipeline"] = "off"
+        expected = [[run(q)] + [run("\\next") for _ in range(3)] for q in queries]
+        settings["config"]["pipeline"] = "on"
+        # Small batches, so root entities are split between them.
+        for batch in [1, 2, 1000]:
+            settings["config"]["pipeline_batch"] = batch
+            assert [[run(q)] + [run("\\next") for _ in range(3)] for q in queries] == expected
+
+    settings["config"]["fetch"] = "text"
+    settings["config"]["limit"] = 0
+    assert run("books.title books.year > 2017") == ["- scry.books.title: Exhalation"]
+    with pytest.raises(psycopg2.Error):
+        run('books.title books.year = "x"')
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+from scry.serve import Server
+
+
+def start_server():
+    server = Server("", concurrency=2, timeout=5, schema_poll=0)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    ports = []
+
+    def ready(s):
+        ports.append(s.sockets[0].getsockname()[1])
+        started.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(server.serve("127.0.0.1", 0, ready))
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait(5)
+
+    def stop():
+        for task in asyncio.all_tasks(loop):
+            loop.call_soon_threadsafe(task.cancel)
+        thread.join(5)
+        server.close()
+
+    return f"http://127.0.0.1:{ports[0]}", stop
+
+def post(url, request):
+    req = urllib.request.Request(url + "/query", data=json.dumps(request).encode(), method="POST")
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+def send_raw(url, data):
+    host, port = url.rsplit("/", 1)[-1].split(":")
+    with socket.create_connection((host, int(port)), timeout=5) as sock:
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        response = b""
+        while True:
+            piece = sock.recv(65536)
+            if not piece:
+                return response.decode()
+            response += piece
+
+def test_serve():
+    url, stop = start_server()
+    try:
+        status, body = post(url, {"query": "authors.name authors.books.title", "settings": {"limit": 3}})
+        assert status == 200
+        body = json.loads(body)
+        assert body["sql"] == "SELECT scry.authors.id, scry.books.id, scry.authors.name, scry.books.title FROM scry.authors LEFT JOIN scry.books ON scry.authors.id = scry.books.author_id  LIMIT 3"
+        [author] = body["results"]["scry.authors"]
+        assert author["name"] == "J.R.R. Tolkien" and len(author["books"]) == 3
+
+        status, body = post(url, {"query": "books.title books.year > $year", "params": {"year": 2017}, "format": "jsonl"})
+        assert status == 200
+        assert [json.loads(line) for line in body.splitlines()] == [{"title": "Exhalation"}]
+
+        assert post(url, {"query": "authors.nope"}) == (400, '{"error": "Unknown table or column: nope"}')
+        assert post(url, {"query": "authors.name", "settings": {"colour": "red"}}) == (400, '{"error": "Unknown setting: colour"}')
+
+        assert post(url, {"query": "authors.name", "timeout": "soon"}) == (400, '{"error": "Invalid timeout: soon"}')
+        assert post(url, {"query": "authors.name", "params": [1]}) == (400, '{"error": "params must be an object"}')
+        assert post(url, {"query": "authors.name", "settings": {"limit": "many"}}) == (400, '{"error": "Invalid limit: many"}')
+
+        post(url, {"query": "authors.name"})
+        post(url, {"query": "authors.name"})
+        with urllib.request.urlopen(url + "/metrics") as response:
+            metrics = response.read().decode().splitlines()
+        assert 'scry_responses_total{status="200"} 4' in metrics
+        assert 'scry_responses_total{status="400"} 5' in metrics
+        assert "scry_compile_cache_hits_total 1" in metrics
+        assert 'scry_request_seconds_bucket{le="+Inf"} 9' in metrics
+
+        response = send_raw(url, b"POST /query HTTP/1.1\r\nContent-Length: lots\r\n\r\n")
+        assert response.startswith("HTTP/1.1 400") and "Malformed content-length" in response
+        response = send_raw(url, b'POST /query HTTP/1.1\r\nContent-Length: 100\r\n\r\n{"query": ')
+        assert response.startswith("HTTP/1.1 400") and "Incomplete request body" in response
+    finally:
+        stop()
@@ -13,15 +13,12 @@ def parseadd(args):
     db = psycopg2.connect("")
     cur = db.cursor()
 
-    table_info = scry.get_table_info(cur)
-    foreign_keys = scry.get_foreign_keys(cur)
-    unique_keys = scry.get_unique_keys(cur)
+    table_info, keys = scry.load_schema(cur)
+    foreign_keys = keys["foreign"]
     query = args.command
     tree, aliases, command, alias = scry.parse(scry.default_settings(), table_info, foreign_keys, query)
 
-    keys = { "unique": unique_keys, "foreign": foreign_keys }
-
-    sql_clauses = scry.generate_sql(keys, tree)
+    sql_clauses = scry.minimize_projection(scry.generate_sql(keys, tree))
 
     uniques = sql_clauses["uniques"]
     sql = scry.serialize_sql(sql_clauses, 100)
@@ -46,7 +43,7 @@ def parseadd(args):
         {repr(tree)},
         {repr(sql_clauses)},
         {repr(sql)},
-        {repr(results)},
+        {repr(results.as_tree())},
         {repr(output)}
         ),
     """
@@ -66,22 +63,19 @@ def parseupdate(args):
     db = psycopg2.connect("")
     cur = db.cursor()
 
-    table_info = scry.get_table_info(cur)
-    foreign_keys = scry.get_foreign_keys(cur)
-    unique_keys = scry.get_unique_keys(cur)
+    table_info, keys = scry.load_schema(cur)
+    foreign_keys = keys["foreign"]
 
     from test_scry import test_instances, Instance
     new_instances = []
     for instance in test_instances:
         name = instance.name
         query = instance.query
-        tree = scry.parse(scry.defaultSettings(), table_info, foreign_keys, query)
+        tree, _, _, _ = scry.parse(scry.default_settings(), table_info, foreign_keys, query)
         if should_be_same("tree") and tree != instance.tree:
             raise Exception(f"Tree doesn't match for {name}\n\n{tree}\n\n{instance.tree}")
 
-        keys = { "unique": unique_keys, "foreign": foreign_keys }
-
-        sql_clauses = scry.generate_sql(keys, tree)
+        sql_clauses = scry.minimize_projection(scry.generate_sql(keys, tree))
         if should_be_same("sql_clauses") and sql_clauses != instance.sql_clauses:
             raise Exception(f"Sql_clauses don't match for {name}\n\n{sql_clauses}\n\n{instance.sql_clauses}")
 
@@ -94,8 +88,8 @@ def parseupdate(args):
         cur.execute(sql)
 
         results = scry.reshape_results(cur, sql_clauses)
-        if should_be_same("results") and results != instance.results:
-            raise Exception(f"Results don't match for {name}\n\n{results}\n\n{instance.results}")
+        if should_be_same("results") and results.as_tree() != instance.results:
+            raise Exception(f"Results don't match for {name}\n\n{results.as_tree()}\n\n{instance.results}")
 
         output = scry.format_results(results)
         if should_be_same("output") and output != instance.output:
@@ -107,7 +101,7 @@ def parseupdate(args):
             tree,
             sql_clauses,
             sql,
-            results,
+            results.as_tree(),
             output
         ))
 